@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""测试公用的夹具：生成源图片目录和水印图片"""
+
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def watermark(tmp_path):
+    """半透明的水印图片"""
+    path = tmp_path / 'watermark.png'
+    Image.new('RGBA', (24, 16), (0, 0, 255, 160)).save(path)
+    return str(path)
+
+
+@pytest.fixture
+def make_sources(tmp_path):
+    """
+    生成源图片目录：make_sources(数量) 返回目录路径，图片分布在 a、b 两个子目录中，
+    内容各不相同
+    """
+    def make(count=12, name='src'):
+        root = tmp_path / name
+        for i in range(count):
+            directory = root / ('a' if i % 2 else 'b')
+            directory.mkdir(parents=True, exist_ok=True)
+            Image.new('RGB', (64 + i, 48), (i * 15 % 256, 80, 160)).save(directory / f"img{i:02d}.png")
+        return root
+    return make
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""压缩包处理：替换扩展名后的成员重名"""
+
+import io
+import warnings
+import zipfile
+
+import pytest
+from PIL import Image
+
+from watermark_archive import member_output_name
+from watermark_processor import WatermarkProcessor
+
+
+def image_bytes(format_name):
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), (200, 100, 50)).save(buffer, format_name)
+    return buffer.getvalue()
+
+
+def test_member_output_name_keeps_source_extension_on_clash():
+    assert member_output_name('d/a.png', 'webp') == 'd/a.webp'
+    assert member_output_name('d/a.jpg', 'webp', {'d/a.webp'}) == 'd/a.jpg.webp'
+    with pytest.raises(ValueError):
+        member_output_name('d/a.jpg', 'webp', {'d/a.webp', 'd/a.jpg.webp'})
+    with pytest.raises(ValueError):
+        member_output_name('a.png', 'keep', {'a.png'})
+
+
+def test_converted_members_do_not_overwrite_each_other(watermark, tmp_path):
+    source = tmp_path / 'photos.zip'
+    with zipfile.ZipFile(source, 'w') as archive:
+        archive.writestr('a.png', image_bytes('PNG'))
+        archive.writestr('a.jpg', image_bytes('JPEG'))
+        archive.writestr('a.webp', b'not an image')
+    output = tmp_path / 'out.zip'
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        success, total, errors = WatermarkProcessor().process_archive(
+            source, watermark, output, output_format='webp'
+        )
+    assert (success, total) == (2, 3)
+    assert len(errors) == 1 and 'a.webp' in errors[0]
+    with zipfile.ZipFile(output) as archive:
+        assert sorted(archive.namelist()) == ['a.jpg.webp', 'a.webp']
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""批处理日志：进程在处理中途被终止后从中断处继续"""
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from watermark_atomic import TEMP_SUFFIX
+from watermark_journal import JOURNAL_FILENAME
+from watermark_processor import WatermarkProcessor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在子进程中批量处理，第 KILL_AT 个文件写出一半时直接终止进程（不执行任何清理）
+KILLED_RUN = """
+import os, sys
+from watermark_atomic import temp_path_for
+from watermark_processor import WatermarkProcessor
+
+KILL_AT = int(sys.argv[4])
+calls = 0
+original = WatermarkProcessor.process_file
+
+def process_file(self, input_path, watermark_path, output, **kwargs):
+    global calls
+    calls += 1
+    if calls == KILL_AT:
+        with open(temp_path_for(output), 'wb') as f:
+            f.write(b'partial')
+        os._exit(9)
+    return original(self, input_path, watermark_path, output, **kwargs)
+
+WatermarkProcessor.process_file = process_file
+WatermarkProcessor().batch_process(sys.argv[1], sys.argv[2], sys.argv[3],
+                                   record_manifest=True, journal=True)
+"""
+
+
+def run_killed(source_dir, watermark, output_dir, kill_at):
+    result = subprocess.run(
+        [sys.executable, '-c', KILLED_RUN, str(source_dir), watermark, str(output_dir),
+         str(kill_at)],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    assert result.returncode == 9, result.stderr
+
+
+def outputs(output_dir):
+    return sorted(p.relative_to(output_dir) for p in output_dir.rglob('*.png'))
+
+
+def temp_files(output_dir):
+    return list(output_dir.rglob('*' + TEMP_SUFFIX))
+
+
+@pytest.fixture
+def killed(make_sources, watermark, tmp_path):
+    """处理 4 个文件后在第 5 个文件写出时被终止的批处理"""
+    source_dir = make_sources(12)
+    output_dir = tmp_path / 'out'
+    run_killed(source_dir, watermark, output_dir, kill_at=5)
+    return source_dir, output_dir
+
+
+def test_kill_leaves_journal_and_partial_output(killed):
+    _, output_dir = killed
+    assert (output_dir / JOURNAL_FILENAME).exists()
+    assert len(outputs(output_dir)) == 4
+    assert len(temp_files(output_dir)) == 1
+
+
+def test_resume_processes_only_remaining_files(killed, watermark):
+    source_dir, output_dir = killed
+    progress = []
+    success, total, errors = WatermarkProcessor().batch_process(
+        source_dir, watermark, output_dir, record_manifest=True, journal=True, resume=True,
+        progress_callback=lambda current, total, name: progress.append(name)
+    )
+    assert (success, total, errors) == (8, 8, [])
+    assert len(outputs(output_dir)) == 12
+    assert temp_files(output_dir) == []
+    # 正常结束后删除日志
+    assert not (output_dir / JOURNAL_FILENAME).exists()
+
+    # 中断前完成但未提交到处理清单的记录在继续时补记，之后全部按清单跳过
+    assert WatermarkProcessor().batch_process(
+        source_dir, watermark, output_dir, skip_processed=True, record_manifest=True
+    ) == (0, 0, [])
+
+
+def test_resume_reprocesses_files_changed_after_kill(killed, watermark):
+    source_dir, output_dir = killed
+    changed = source_dir / outputs(output_dir)[0]
+    later = time.time() + 10
+    os.utime(changed, (later, later))
+
+    success, total, errors = WatermarkProcessor().batch_process(
+        source_dir, watermark, output_dir, journal=True, resume=True
+    )
+    assert (success, total, errors) == (9, 9, [])
+
+
+def test_journal_is_not_reused_for_other_settings(killed, watermark):
+    source_dir, output_dir = killed
+    success, total, errors = WatermarkProcessor().batch_process(
+        source_dir, watermark, output_dir, opacity=0.3, journal=True, resume=True
+    )
+    assert (success, total, errors) == (12, 12, [])
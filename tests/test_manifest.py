@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""处理清单：跳过已处理的文件，源文件或水印设置变化时重新处理"""
+
+import os
+import time
+
+import pytest
+from PIL import Image
+
+from watermark_manifest import MANIFEST_FILENAME
+from watermark_processor import WatermarkProcessor
+
+
+@pytest.fixture
+def processed(make_sources, watermark, tmp_path):
+    """已完整处理一次（记录处理清单）的源目录和输出目录"""
+    source_dir = make_sources(8)
+    output_dir = tmp_path / 'out'
+    result = WatermarkProcessor().batch_process(source_dir, watermark, output_dir,
+                                                record_manifest=True)
+    assert result == (8, 8, [])
+    return source_dir, output_dir
+
+
+def rerun(source_dir, watermark, output_dir, **settings):
+    return WatermarkProcessor().batch_process(
+        source_dir, watermark, output_dir, skip_processed=True, record_manifest=True, **settings
+    )
+
+
+def test_manifest_is_opt_in(make_sources, watermark, tmp_path):
+    output_dir = tmp_path / 'out'
+    WatermarkProcessor().batch_process(make_sources(2), watermark, output_dir)
+    assert not (output_dir / MANIFEST_FILENAME).exists()
+
+
+def test_unchanged_files_are_skipped(processed, watermark):
+    source_dir, output_dir = processed
+    assert rerun(source_dir, watermark, output_dir) == (0, 0, [])
+
+
+def test_settings_change_invalidates_all_files(processed, watermark):
+    source_dir, output_dir = processed
+    assert rerun(source_dir, watermark, output_dir, opacity=0.4) == (8, 8, [])
+    # 新设置处理后再次运行时全部跳过，旧设置则需要重新处理
+    assert rerun(source_dir, watermark, output_dir, opacity=0.4) == (0, 0, [])
+    assert rerun(source_dir, watermark, output_dir) == (8, 8, [])
+
+
+def test_watermark_content_change_invalidates_all_files(processed, watermark):
+    source_dir, output_dir = processed
+    Image.new('RGBA', (24, 16), (255, 0, 0, 160)).save(watermark)
+    assert rerun(source_dir, watermark, output_dir) == (8, 8, [])
+
+
+def test_modified_source_is_reprocessed(processed, watermark):
+    source_dir, output_dir = processed
+    changed = sorted(source_dir.rglob('*.png'))[3]
+    Image.new('RGB', (80, 60), (1, 2, 3)).save(changed)
+    later = time.time() + 10
+    os.utime(changed, (later, later))
+    assert rerun(source_dir, watermark, output_dir) == (1, 1, [])
+
+
+def test_touched_source_is_skipped_with_verify_hash(make_sources, watermark, tmp_path):
+    # 只有修改时间变化、内容相同的文件在 verify_hash 时按记录的内容哈希确认后跳过
+    source_dir = make_sources(4)
+    output_dir = tmp_path / 'out'
+    assert rerun(source_dir, watermark, output_dir, verify_hash=True) == (4, 4, [])
+    touched = sorted(source_dir.rglob('*.png'))[0]
+    later = time.time() + 10
+    os.utime(touched, (later, later))
+    assert rerun(source_dir, watermark, output_dir, verify_hash=True) == (0, 0, [])
+    # 不确认内容时按修改时间重新处理
+    os.utime(touched, (later + 10, later + 10))
+    assert rerun(source_dir, watermark, output_dir) == (1, 1, [])
+
+
+def test_missing_output_is_reprocessed(processed, watermark):
+    source_dir, output_dir = processed
+    next(output_dir.rglob('*.png')).unlink()
+    assert rerun(source_dir, watermark, output_dir) == (1, 1, [])
+
+
+def test_existing_outputs_without_manifest_are_skipped_and_recorded(make_sources, watermark,
+                                                                    tmp_path):
+    # 第一次在已有输出（没有处理清单）的目录上记录清单：按相对路径跳过已有输出并补记
+    source_dir = make_sources(6)
+    output_dir = tmp_path / 'out'
+    assert WatermarkProcessor().batch_process(source_dir, watermark, output_dir) == (6, 6, [])
+    assert not (output_dir / MANIFEST_FILENAME).exists()
+    next(output_dir.rglob('*.png')).unlink()
+
+    assert rerun(source_dir, watermark, output_dir) == (1, 1, [])
+    assert rerun(source_dir, watermark, output_dir) == (0, 0, [])
+    assert rerun(source_dir, watermark, output_dir, opacity=0.4) == (6, 6, [])
+
+
+@pytest.mark.parametrize('settings', [{}, {'parallel': True, 'workers': 2}, {'pipeline': True}])
+def test_skip_stats_count_skipped_files(processed, watermark, settings):
+    source_dir, output_dir = processed
+    next(output_dir.rglob('*.png')).unlink()
+    processor = WatermarkProcessor()
+    result = processor.batch_process(source_dir, watermark, output_dir, skip_processed=True,
+                                     record_manifest=True, **settings)
+    assert result == (1, 1, [])
+    assert processor.last_skip_stats == {'scanned': 8, 'skipped': 7}
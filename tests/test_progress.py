@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""进度回调：callback(current, total, filename) 中 current 为该文件之前已完成的文件数"""
+
+import pytest
+
+from watermark_processor import WatermarkProcessor
+
+
+@pytest.mark.parametrize('settings', [{}, {'parallel': True, 'workers': 2}, {'pipeline': True}])
+def test_progress_reports_files_done_before_each_file(make_sources, watermark, tmp_path,
+                                                      settings):
+    source_dir = make_sources(6)
+    calls = []
+    result = WatermarkProcessor().batch_process(
+        source_dir, watermark, tmp_path / 'out',
+        progress_callback=lambda current, total, name: calls.append((current, total, name)),
+        **settings
+    )
+    assert result == (6, 6, [])
+    assert [current for current, _, _ in calls] == [0, 1, 2, 3, 4, 5, 6]
+    assert sorted(name for _, _, name in calls[:-1]) == sorted(
+        path.name for path in source_dir.rglob('*.png'))
+    assert calls[-1] == (6, 6, "完成")
+
+
+def test_sequential_progress_is_reported_before_the_file(make_sources, watermark, tmp_path):
+    source_dir = make_sources(3)
+    output_dir = tmp_path / 'out'
+    existing = []
+
+    def callback(current, total, name):
+        existing.append(len(list(output_dir.rglob('*.png'))))
+
+    WatermarkProcessor().batch_process(source_dir, watermark, output_dir,
+                                       progress_callback=callback)
+    assert existing == [0, 1, 2, 3]
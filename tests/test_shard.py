@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""分片分配的稳定性，以及分片清单和报告的合并"""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from watermark_manifest import MANIFEST_FILENAME, ProcessedManifest, manifest_exists
+from watermark_processor import WatermarkProcessor
+from watermark_shard import (shard_of, iter_shard, shard_filename, merge_manifests,
+                             merge_reports, validate_shard)
+
+PATHS = [f"dir{i % 7}/sub{i % 3}/photo_{i}.jpg" for i in range(200)]
+
+
+def test_shard_of_does_not_depend_on_hash_seed():
+    # 分片只取决于相对路径，不同进程（不同的哈希随机化种子）得到相同的结果
+    script = ("import sys, json; from watermark_shard import shard_of; "
+              "print(json.dumps([shard_of(p, 5) for p in json.loads(sys.argv[1])]))")
+    expected = [shard_of(path, 5) for path in PATHS]
+    for seed in ('1', '2'):
+        output = subprocess.run(
+            [sys.executable, '-c', script, json.dumps(PATHS)],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env=dict(os.environ, PYTHONHASHSEED=seed),
+            capture_output=True, text=True, check=True,
+        ).stdout
+        assert json.loads(output) == expected
+
+
+def test_shard_of_uses_posix_relative_path():
+    assert shard_of(Path('dir0') / 'photo.jpg', 4) == shard_of('dir0/photo.jpg', 4)
+
+
+def test_shards_partition_the_files():
+    input_dir = Path('/data')
+    files = [input_dir / path for path in PATHS]
+    shards = [list(iter_shard(files, input_dir, index, 3)) for index in range(3)]
+    assigned = [path for shard in shards for path in shard]
+    assert sorted(assigned) == sorted(files)
+    assert len(set(assigned)) == len(files)
+    assert all(shards)
+
+
+def test_validate_shard_rejects_out_of_range_index():
+    validate_shard(2, 3)
+    with pytest.raises(ValueError):
+        validate_shard(3, 3)
+    with pytest.raises(ValueError):
+        validate_shard(0, 0)
+
+
+def test_sharded_runs_merge_into_main_manifest(make_sources, watermark, tmp_path):
+    source_dir = make_sources(12)
+    output_dir = tmp_path / 'out'
+    processor = WatermarkProcessor()
+
+    reports = []
+    for index in range(2):
+        success, total, errors = processor.batch_process(
+            source_dir, watermark, output_dir, record_manifest=True,
+            shard_index=index, shard_count=2
+        )
+        assert errors == []
+        assert manifest_exists(output_dir, shard_filename(MANIFEST_FILENAME, index, 2))
+        reports.append({'shard': {'index': index, 'count': 2}, 'total': total,
+                        'success': success, 'failed': 0, 'errors': [], 'wall_time': 1.0})
+
+    merged = merge_reports(reports)
+    assert merged['total'] == 12
+    assert merged['missing_shards'] == []
+    assert [shard['total'] for shard in merged['per_shard']] == [r['total'] for r in reports]
+
+    assert merge_manifests(output_dir) == 12
+    assert not manifest_exists(output_dir, shard_filename(MANIFEST_FILENAME, 0, 2))
+    fingerprint = processor.settings_fingerprint(watermark, processor.watermark_options())
+    with ProcessedManifest(output_dir) as manifest:
+        for source in source_dir.rglob('*.png'):
+            assert manifest.is_current(source.relative_to(source_dir), source, fingerprint)
+
+    # 合并后不分片运行时，所有文件都按主清单跳过
+    assert processor.batch_process(source_dir, watermark, output_dir, skip_processed=True,
+                                   record_manifest=True) == (0, 0, [])
+
+
+def test_merge_reports_lists_missing_shards():
+    merged = merge_reports([{'shard': {'index': 1, 'count': 3}, 'total': 2, 'success': 2}])
+    assert merged['missing_shards'] == [0, 2]
+    with pytest.raises(ValueError):
+        merge_reports([{'shard': {'index': 0, 'count': 2}}, {'shard': {'index': 0, 'count': 2}}])
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""统计：每张图片的内存峰值进入单文件记录和批量汇总"""
+
+import pytest
+
+from watermark_processor import WatermarkProcessor
+
+
+@pytest.mark.parametrize('mode', [{}, {'parallel': True, 'workers': 2}, {'pipeline': True}],
+                         ids=['sequential', 'parallel', 'pipeline'])
+def test_peak_bytes_reach_records_and_summary(mode, make_sources, watermark, tmp_path):
+    records = []
+    processor = WatermarkProcessor(stats_hook=records.append)
+    success, total, errors, summary = processor.batch_process(
+        make_sources(4), watermark, tmp_path / 'out', collect_stats=True, **mode
+    )
+    assert (success, total, errors) == (4, 4, [])
+    assert len(records) == 4
+    assert all(record['peak_bytes'] > 0 for record in records)
+    assert summary['peak_bytes']['count'] == 4
+    assert summary['peak_bytes']['max'] == max(record['peak_bytes'] for record in records)
+    assert summary['peak_bytes']['p50'] <= summary['peak_bytes']['max']
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+动图处理模块
+逐帧为动图（GIF、APNG、WebP）添加水印，保留每帧时长、循环次数和帧处置方式；
+GIF 采用流式写出，内存中只保留当前帧，适合上千帧的动图
+"""
+
+from PIL import Image, GifImagePlugin
+
+from watermark_encoder import encoder_params
+
+# 支持保存为动图的格式
+ANIMATED_FORMATS = {'GIF', 'PNG', 'WEBP'}
+
+# GIF 中 alpha 低于该值的像素视为透明
+GIF_ALPHA_THRESHOLD = 128
+
+
+def is_animated(img):
+    """判断打开的图片是否为多帧动图"""
+    return getattr(img, 'is_animated', False) and getattr(img, 'n_frames', 1) > 1
+
+
+def frame_duration(img):
+    """获取当前帧时长（毫秒）"""
+    return int(img.info.get('duration', 0) or 0)
+
+
+def frame_disposal(img):
+    """获取当前帧的处置方式（统一为 GIF 的取值：0 未指定，1 保留，2 恢复背景，3 恢复上一帧）"""
+    if img.format == 'GIF':
+        return int(getattr(img, 'disposal_method', 0) or 0)
+    if img.format == 'PNG':
+        # APNG 的取值：0 保留，1 恢复背景，2 恢复上一帧
+        return int(img.info.get('disposal', 0) or 0) + 1
+    return 0
+
+
+def iter_frames(img):
+    """
+    逐帧遍历动图
+
+    Yields:
+        (帧图片, 时长, 处置方式)；帧图片在下一次迭代时会被改变，需要保留时请复制
+    """
+    for index in range(img.n_frames):
+        img.seek(index)
+        # WebP 等格式在解码后才会更新当前帧的时长
+        img.load()
+        yield img, frame_duration(img), frame_disposal(img)
+
+
+def composite_rgba(frame, overlay, position_coords):
+    """
+    将水印合成到 RGBA 帧上（原地修改，保留帧本身的透明度）
+
+    水印超出帧边界时自动裁剪
+    """
+    x, y = position_coords
+    source_box = (max(-x, 0), max(-y, 0))
+    dest = (max(x, 0), max(y, 0))
+    if source_box[0] >= overlay.width or source_box[1] >= overlay.height:
+        return frame
+    frame.alpha_composite(overlay, dest=dest, source=source_box)
+    return frame
+
+
+def _to_palette_frame(frame):
+    """
+    将 RGBA 帧量化为 256 色调色板图片
+
+    Returns:
+        (P 模式图片, GIF 帧参数)
+    """
+    alpha = frame.getchannel('A')
+    has_transparency = alpha.getextrema()[0] < GIF_ALPHA_THRESHOLD
+
+    # 有透明像素时保留最后一个调色板索引作为透明色
+    colors = 255 if has_transparency else 256
+    paletted = frame.convert('RGB').quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
+    palette = paletted.getpalette()[:colors * 3]
+    paletted.putpalette(palette + [0] * (768 - len(palette)))
+
+    params = {}
+    if has_transparency:
+        mask = alpha.point(lambda a: 255 if a < GIF_ALPHA_THRESHOLD else 0)
+        paletted.paste(255, mask=mask)
+        params['transparency'] = 255
+    return paletted, params
+
+
+def write_gif_stream(fp, frames, loop=None):
+    """
+    流式写出 GIF 动图，每帧写出后即释放
+
+    Args:
+        fp: 已打开的二进制文件对象
+        frames: 可迭代的 (RGBA 帧, 时长, 处置方式)
+        loop: 循环次数（0 为无限循环，None 表示不写循环信息）
+
+    Returns:
+        int: 写出的帧数
+    """
+    count = 0
+    for frame, duration, disposal in frames:
+        paletted, params = _to_palette_frame(frame)
+        if count == 0:
+            header_info = dict(params, duration=duration)
+            if loop is not None:
+                header_info['loop'] = loop
+            header, _ = GifImagePlugin.getheader(paletted, None, header_info)
+            for chunk in header:
+                fp.write(chunk)
+
+        # 每帧都写完整画面并带局部调色板，保留原帧的时长和处置方式
+        params.update(duration=duration, disposal=disposal, include_color_table=True)
+        for chunk in GifImagePlugin.getdata(paletted, (0, 0), **params):
+            fp.write(chunk)
+        count += 1
+
+    fp.write(b';')
+    return count
+
+
+def save_animation(fp, format_name, frames, loop=None, profile=None):
+    """
+    保存动图
+
+    GIF 使用流式写出；APNG 和 WebP 由 Pillow 编码，需要先收集全部帧
+
+    Args:
+        fp: 已打开的二进制文件对象
+        format_name: 输出格式（GIF、PNG、WEBP）
+        frames: 可迭代的 (RGBA 帧, 时长, 处置方式)，每帧须为独立的图片
+        loop: 循环次数
+        profile: 编码配置
+
+    Returns:
+        int: 写出的帧数
+    """
+    if format_name == 'GIF':
+        return write_gif_stream(fp, frames, loop)
+
+    if format_name not in ANIMATED_FORMATS:
+        raise ValueError(f"格式不支持动图: {format_name}")
+
+    images, durations = [], []
+    for frame, duration, _ in frames:
+        images.append(frame)
+        durations.append(duration)
+
+    params = encoder_params(format_name, profile) if profile else {}
+    params['duration'] = durations
+    params['loop'] = loop or 0
+    if format_name == 'PNG':
+        # 写出的都是完整合成后的画面，用“保留 + 覆盖”即可还原原动画，与原处置方式无关
+        params['disposal'] = 0
+        params['blend'] = 0
+    images[0].save(fp, format_name, save_all=True, append_images=images[1:], **params)
+    return len(images)
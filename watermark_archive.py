@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+压缩包读写模块
+直接从 zip / tar 压缩包中逐个读取成员、在内存中添加水印并写入输出压缩包，
+不解压到磁盘；成员路径（目录结构）保持不变，非图片成员原样复制。
+
+成员按顺序逐个处理，内存中只保留当前成员的原始数据、解码后的图片和编码结果；
+tar 以流方式读取（压缩的 tar 不需要随机访问）
+"""
+
+import io
+import posixpath
+import tarfile
+import time
+import zipfile
+from collections import namedtuple
+from pathlib import Path
+
+from watermark_encoder import FORMAT_NAMES, FORMAT_EXTENSIONS, OUTPUT_FORMATS
+
+# 支持的压缩包扩展名及写出时的 tar 模式
+TAR_WRITE_MODES = {
+    '.tar': 'w',
+    '.tar.gz': 'w:gz',
+    '.tgz': 'w:gz',
+    '.tar.bz2': 'w:bz2',
+    '.tar.xz': 'w:xz',
+}
+ARCHIVE_SUFFIXES = ('.zip',) + tuple(TAR_WRITE_MODES)
+
+# 单个图片成员的大小上限（字节），超过时报告错误而不读入内存
+DEFAULT_MAX_MEMBER_BYTES = 512 * 1024 * 1024
+
+# 压缩包成员：name 为 / 分隔的路径，mtime 为时间戳，mode 为权限位
+ArchiveMember = namedtuple('ArchiveMember', ['name', 'size', 'is_dir', 'mtime', 'mode'])
+
+
+def archive_suffix(path):
+    """返回压缩包扩展名（如 '.zip', '.tar.gz'），不是支持的压缩包时返回 None"""
+    name = Path(path).name.lower()
+    # 先匹配较长的扩展名（.tar.gz 优先于 .gz）
+    for suffix in sorted(ARCHIVE_SUFFIXES, key=len, reverse=True):
+        if name.endswith(suffix):
+            return suffix
+    return None
+
+
+def is_archive(path):
+    """是否为支持的压缩包文件"""
+    return archive_suffix(path) is not None and Path(path).is_file()
+
+
+def default_archive_output(path):
+    """默认输出压缩包路径：photos.zip -> photos_watermarked.zip（同一目录）"""
+    path = Path(path)
+    suffix = archive_suffix(path)
+    return str(path.with_name(path.name[:-len(suffix)] + '_watermarked' + suffix))
+
+
+def member_output_name(name, output_format='keep', taken=()):
+    """
+    按输出格式确定成员在输出压缩包中的路径（只替换扩展名，目录结构不变）
+
+    Args:
+        name: 成员路径
+        output_format: 输出格式
+        taken: 输出压缩包中已写入的成员路径；替换扩展名后与其重名时保留原扩展名
+            （如 a.png 和 a.jpg 都输出为 webp 时，后一个为 a.jpg.webp）
+
+    Raises:
+        ValueError: 输出格式不支持，或保留原扩展名后仍与已写入的成员重名
+    """
+    if output_format == 'keep':
+        output_name = name
+    elif output_format not in FORMAT_NAMES:
+        raise ValueError(f"不支持的输出格式: {output_format}（可选: {', '.join(OUTPUT_FORMATS)}）")
+    else:
+        extension = FORMAT_EXTENSIONS[FORMAT_NAMES[output_format]]
+        output_name = posixpath.splitext(name)[0] + extension
+        if output_name in taken and name != output_name:
+            output_name = name + extension
+    if output_name in taken:
+        raise ValueError(f"输出压缩包中已有同名成员: {output_name}")
+    return output_name
+
+
+def iter_members(source):
+    """
+    按顺序读取压缩包成员
+
+    Args:
+        source: 压缩包路径
+
+    Yields:
+        (ArchiveMember, 读取函数)：读取函数返回成员内容的二进制流；
+        tar 为流式读取，必须在取下一个成员之前使用
+    """
+    if archive_suffix(source) == '.zip':
+        with zipfile.ZipFile(source) as zf:
+            for info in zf.infolist():
+                member = ArchiveMember(
+                    info.filename, info.file_size, info.is_dir(),
+                    _zip_timestamp(info.date_time), (info.external_attr >> 16) & 0o7777
+                )
+                yield member, (lambda info=info: zf.open(info))
+        return
+
+    with tarfile.open(source, 'r|*') as tf:
+        for info in tf:
+            if not (info.isfile() or info.isdir()):
+                # 链接、设备文件等不处理
+                continue
+            member = ArchiveMember(info.name, info.size, info.isdir(), info.mtime, info.mode)
+            yield member, (lambda info=info: tf.extractfile(info))
+
+
+def _zip_timestamp(date_time):
+    return time.mktime(tuple(date_time) + (0, 0, -1))
+
+
+class ArchiveWriter:
+    """
+    输出压缩包（zip 或 tar），格式按扩展名确定
+
+    图片已经是压缩格式，zip 中的图片成员不再压缩（ZIP_STORED），原样复制的其他成员使用 deflate 压缩
+    """
+
+    def __init__(self, fp, suffix):
+        """
+        Args:
+            fp: 以二进制写方式打开的输出文件
+            suffix: 压缩包扩展名（archive_suffix 的返回值）
+        """
+        self.suffix = suffix
+        if suffix == '.zip':
+            self._zip = zipfile.ZipFile(fp, 'w', allowZip64=True)
+            self._tar = None
+        elif suffix in TAR_WRITE_MODES:
+            self._zip = None
+            self._tar = tarfile.open(fileobj=fp, mode=TAR_WRITE_MODES[suffix])
+        else:
+            raise ValueError(f"不支持的压缩包格式: {suffix}")
+
+    def add_dir(self, member):
+        """添加目录成员"""
+        name = member.name.rstrip('/') + '/'
+        if self._zip is not None:
+            self._zip.writestr(self._zip_info(name, member), b'')
+        else:
+            info = self._tar_info(name.rstrip('/'), member)
+            info.type = tarfile.DIRTYPE
+            self._tar.addfile(info)
+
+    def add_bytes(self, name, data, member):
+        """添加内存中的成员内容（添加水印后的图片）"""
+        if self._zip is not None:
+            self._zip.writestr(self._zip_info(name, member), data,
+                               compress_type=zipfile.ZIP_STORED)
+        else:
+            info = self._tar_info(name, member)
+            info.size = len(data)
+            self._tar.addfile(info, io.BytesIO(data))
+
+    def add_stream(self, member, stream):
+        """原样复制成员（流式复制，不整个读入内存）"""
+        if self._zip is not None:
+            info = self._zip_info(member.name, member)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.file_size = member.size
+            with self._zip.open(info, 'w') as dst:
+                while True:
+                    chunk = stream.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+        else:
+            info = self._tar_info(member.name, member)
+            info.size = member.size
+            self._tar.addfile(info, stream)
+
+    def _zip_info(self, name, member):
+        # zip 不能表示 1980 年以前的时间
+        date_time = max(time.localtime(member.mtime)[:6], (1980, 1, 1, 0, 0, 0))
+        info = zipfile.ZipInfo(name, date_time=date_time)
+        if member.mode:
+            info.external_attr = (member.mode & 0o7777) << 16
+        return info
+
+    def _tar_info(self, name, member):
+        info = tarfile.TarInfo(name)
+        info.mtime = member.mtime
+        info.mode = member.mode or 0o644
+        return info
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        else:
+            self._tar.close()
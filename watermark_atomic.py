@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+原子写出模块
+输出先写到同一目录下的临时文件，完整写完并写入磁盘（fsync）后再改名为最终文件名，
+改名后再同步所在目录，处理中途崩溃、被终止或断电时不会留下被截断的输出（只可能留下以 . 开头、
+.tmp 结尾的临时文件），批处理日志和处理清单记录完成时输出已经落盘；
+输出目录按目录记录，每个目录只创建一次
+"""
+
+import contextlib
+import glob
+import os
+import uuid
+
+# 临时文件后缀（不是图片扩展名，扫描图片时不会被当作图片）
+TEMP_SUFFIX = '.tmp'
+
+
+class DirectoryCache:
+    """已确认存在的输出目录，同一目录只调用一次 os.makedirs"""
+
+    def __init__(self):
+        self._known = set()
+
+    def ensure(self, directory):
+        """确保目录存在"""
+        if not directory or directory in self._known:
+            return
+        os.makedirs(directory, exist_ok=True)
+        self._known.add(directory)
+
+    def forget(self, directory):
+        """目录可能已被删除时移除记录，下次重新创建"""
+        self._known.discard(directory)
+
+
+def _temp_prefix(path):
+    """输出文件对应的临时文件名前缀"""
+    return f".{os.path.basename(path)}."
+
+
+def temp_path_for(path):
+    """输出文件在同一目录下的一个新临时文件路径"""
+    directory = os.path.dirname(path)
+    return os.path.join(directory, f"{_temp_prefix(path)}{uuid.uuid4().hex[:12]}{TEMP_SUFFIX}")
+
+
+def fsync_file(path):
+    """将已写完的文件内容写入磁盘"""
+    with open(path, 'rb+') as f:
+        os.fsync(f.fileno())
+
+
+def fsync_directory(directory):
+    """
+    将目录项（新建、改名的文件）写入磁盘
+
+    不支持打开目录的平台（Windows）跳过，这些平台的改名由文件系统自身保证
+    """
+    try:
+        fd = os.open(directory or os.curdir, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _open_temp(path):
+    """在输出文件所在目录创建临时文件（权限与直接创建输出文件相同）"""
+    temp_path = temp_path_for(path)
+    return temp_path, open(temp_path, 'xb')
+
+
+@contextlib.contextmanager
+def atomic_output(path, directories=None):
+    """
+    以原子方式写出文件：在 with 块中写入返回的文件对象，正常结束后写入磁盘并改名为 path，
+    再同步所在目录；出错时删除临时文件，原有的 path 保持不变
+
+    Args:
+        path: 输出文件路径
+        directories: DirectoryCache，为空时每次都检查目录
+    """
+    path = os.fspath(path)
+    directories = directories or DirectoryCache()
+    directory = os.path.dirname(path)
+    directories.ensure(directory)
+    try:
+        temp_path, fp = _open_temp(path)
+    except FileNotFoundError:
+        # 目录在处理期间被删除，重新创建
+        directories.forget(directory)
+        directories.ensure(directory)
+        temp_path, fp = _open_temp(path)
+
+    try:
+        with fp:
+            yield fp
+            # 先让数据落盘再改名，断电后不会出现已改名但内容不完整的输出
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(temp_path)
+        raise
+    fsync_directory(directory)
+
+
+def write_atomic(path, data, directories=None):
+    """以原子方式将二进制数据写入文件"""
+    with atomic_output(path, directories) as fp:
+        fp.write(data)
+
+
+def remove_temp_files(path):
+    """
+    删除输出文件遗留的临时文件（处理被强制终止时产生）
+
+    Returns:
+        int: 删除的临时文件数
+    """
+    path = os.fspath(path)
+    pattern = os.path.join(glob.escape(os.path.dirname(path)),
+                           glob.escape(_temp_prefix(path)) + '*' + TEMP_SUFFIX)
+    removed = 0
+    for temp_path in glob.glob(pattern):
+        with contextlib.suppress(OSError):
+            os.unlink(temp_path)
+            removed += 1
+    return removed
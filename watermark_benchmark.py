@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能基准测试
+生成可复现的合成图片集（JPEG/PNG/BMP/GIF，RGB/RGBA/L/P 模式，从缩略图到上亿像素，
+多层目录），测量 add_watermark、batch_process、文件扫描和已处理检测的吞吐量、
+各阶段耗时和内存峰值，结果保存为 JSON，可与基线结果对比
+
+用法:
+    python -m watermark_benchmark --preset quick --output bench.json
+    python -m watermark_benchmark --preset quick --baseline bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import PIL
+from PIL import Image
+
+from watermark_processor import WatermarkProcessor, WATERMARKED_DIR_NAMES
+from watermark_stats import StageTimer, BatchStats
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CORPUS_SPEC_FILENAME = '.corpus.json'
+
+# 预设图片集：尺寸列表（宽, 高, 权重）、文件数量、目录深度
+PRESETS = {
+    'quick': {
+        'files': 48,
+        'depth': 3,
+        'sizes': [(160, 120, 4), (640, 480, 4), (1280, 960, 3), (1920, 1080, 1)],
+    },
+    'full': {
+        'files': 400,
+        'depth': 5,
+        'sizes': [(160, 120, 6), (640, 480, 6), (1920, 1080, 6), (4000, 3000, 4),
+                  (6000, 4000, 2), (12000, 8400, 1)],
+    },
+}
+
+# 格式和模式组合（扩展名, 模式, 是否动图, 权重）
+VARIANTS = [
+    ('.jpg', 'RGB', False, 8),
+    ('.jpg', 'L', False, 1),
+    ('.png', 'RGBA', False, 3),
+    ('.png', 'RGB', False, 2),
+    ('.png', 'P', False, 1),
+    ('.bmp', 'RGB', False, 1),
+    ('.gif', 'P', False, 1),
+    ('.gif', 'P', True, 1),
+]
+
+# 动图及超大图片的尺寸上限，避免生成时间过长
+ANIMATED_MAX_SIZE = (640, 480)
+ANIMATED_FRAMES = 12
+
+
+def build_corpus_spec(preset, seed, max_megapixels=None):
+    """按预设生成图片集描述（只依赖随机种子，可复现）"""
+    config = PRESETS[preset]
+    rng = random.Random(seed)
+    sizes = [(w, h) for w, h, _ in config['sizes']
+             if max_megapixels is None or w * h <= max_megapixels * 1_000_000]
+    size_weights = [weight for w, h, weight in config['sizes']
+                    if max_megapixels is None or w * h <= max_megapixels * 1_000_000]
+    variant_weights = [v[3] for v in VARIANTS]
+
+    files = []
+    for index in range(config['files']):
+        ext, mode, animated, _ = rng.choices(VARIANTS, weights=variant_weights)[0]
+        width, height = rng.choices(sizes, weights=size_weights)[0]
+        if animated:
+            width, height = min(width, ANIMATED_MAX_SIZE[0]), min(height, ANIMATED_MAX_SIZE[1])
+        if rng.random() < 0.3:
+            width, height = height, width  # 竖图
+
+        depth = rng.randint(0, config['depth'])
+        parts = [f"d{rng.randint(0, 3)}" for _ in range(depth)]
+        files.append({
+            'path': '/'.join(parts + [f"img_{index:05d}{ext}"]),
+            'size': [width, height],
+            'mode': mode,
+            'animated': animated,
+        })
+
+    return {'preset': preset, 'seed': seed, 'max_megapixels': max_megapixels, 'files': files}
+
+
+def _render_image(size, mode, seed):
+    """生成带渐变和噪声的图片，使压缩结果接近真实照片"""
+    rng = random.Random(seed)
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, rng.uniform(20, 80))
+    bands = [gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)]
+    rng.shuffle(bands)
+    img = Image.merge('RGB', bands)
+
+    if mode == 'RGBA':
+        img.putalpha(gradient.transpose(Image.Transpose.ROTATE_180))
+    elif mode in ('L', 'P'):
+        img = img.convert(mode) if mode == 'L' else img.quantize(256)
+    return img
+
+
+def generate_corpus(root, spec):
+    """
+    生成图片集；目录中已有相同描述的图片集时直接复用
+
+    Returns:
+        dict: 图片集信息（路径、水印路径、文件数、总像素）
+    """
+    root = Path(root)
+    spec_path = root / CORPUS_SPEC_FILENAME
+    if spec_path.exists() and json.loads(spec_path.read_text(encoding='utf-8')) == spec:
+        return _corpus_info(root, spec)
+
+    if root.exists():
+        shutil.rmtree(root)
+    source_dir = root / 'source'
+    for index, item in enumerate(spec['files']):
+        path = source_dir / item['path']
+        path.parent.mkdir(parents=True, exist_ok=True)
+        img = _render_image(tuple(item['size']), item['mode'], spec['seed'] + index)
+        if item['animated']:
+            frames = [img.rotate(i * 30) for i in range(ANIMATED_FRAMES)]
+            frames[0].save(path, save_all=True, append_images=frames[1:], duration=80, loop=0)
+        else:
+            img.save(path)
+
+    # 水印：半透明文字块样式的 RGBA 图片
+    watermark = Image.new('RGBA', (400, 120), (255, 255, 255, 0))
+    watermark.paste((255, 255, 255, 220), (10, 10, 390, 110))
+    watermark.paste((20, 20, 20, 160), (30, 30, 370, 90))
+    watermark.save(root / 'watermark.png')
+
+    spec_path.write_text(json.dumps(spec), encoding='utf-8')
+    return _corpus_info(root, spec)
+
+
+def _corpus_info(root, spec):
+    megapixels = sum(w * h for w, h in (item['size'] for item in spec['files'])) / 1_000_000
+    return {
+        'root': str(root),
+        'source_dir': str(root / 'source'),
+        'watermark': str(root / 'watermark.png'),
+        'files': len(spec['files']),
+        'megapixels': round(megapixels, 2),
+    }
+
+
+def _peak_rss_bytes():
+    """当前进程及其子进程的内存峰值（字节，含解释器本身），不支持时返回 None"""
+    if resource is None:
+        return None
+    scale = 1 if sys.platform == 'darwin' else 1024  # Linux 单位为 KB
+    self_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return max(self_peak, children_peak)
+
+
+def bench_add_watermark(corpus, options, repeat=1):
+    """add_watermark 单张吞吐量及各阶段耗时（使用处理器的分阶段统计）"""
+    processor = WatermarkProcessor()
+    source_dir = Path(corpus['source_dir'])
+    files = processor.get_source_files_excluding_watermarked(source_dir)
+    output_dir = Path(tempfile.mkdtemp(prefix='wm_bench_single_'))
+
+    stats = BatchStats()
+    try:
+        for _ in range(repeat):
+            for path in files:
+                timer = StageTimer()
+                output_file = processor.output_file_for(output_dir, path.relative_to(source_dir),
+                                                        options)
+                processor.add_watermark(str(path), corpus['watermark'], str(output_file),
+                                        timer=timer, **options)
+                stats.add(timer.record(path, output_file,
+                                       processor.last_image_stats.get('peak_bytes')))
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    summary = stats.summary()
+    megapixels = summary['counters'].get('pixels', 0) / 1_000_000
+    return {
+        'images': summary['files'],
+        'seconds': summary['wall_time'],
+        'images_per_sec': summary['images_per_sec'],
+        'megapixels_per_sec': round(megapixels / summary['wall_time'], 3) if summary['wall_time'] else 0.0,
+        'per_file': summary['per_file'],
+        'stages': summary['stages'],
+        'peak_bytes': summary['peak_bytes'],
+        'cache': processor.get_cache_stats(),
+    }
+
+
+def bench_batch_process(corpus, options, parallel=False, workers=None):
+    """batch_process 整体吞吐量（写入临时目录）"""
+    processor = WatermarkProcessor()
+    output_dir = tempfile.mkdtemp(prefix='wm_bench_out_')
+    try:
+        start = time.perf_counter()
+        success, total, errors = processor.batch_process(
+            corpus['source_dir'], corpus['watermark'], output_dir,
+            parallel=parallel, workers=workers, record_manifest=False, **options
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    return {
+        'images': success,
+        'total': total,
+        'errors': len(errors),
+        'seconds': round(elapsed, 4),
+        'images_per_sec': round(success / elapsed, 3) if elapsed else 0.0,
+        'megapixels_per_sec': round(corpus['megapixels'] / elapsed, 3) if elapsed else 0.0,
+        'workers': (workers or os.cpu_count()) if parallel else 1,
+    }
+
+
+def bench_discovery(corpus, repeat=5):
+    """get_source_files_excluding_watermarked 扫描耗时"""
+    processor = WatermarkProcessor()
+    durations = []
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = len(processor.get_source_files_excluding_watermarked(corpus['source_dir']))
+        durations.append(time.perf_counter() - start)
+    best = min(durations)
+    return {
+        'files': count,
+        'seconds': round(best, 6),
+        'files_per_sec': round(count / best, 1) if best else 0.0,
+    }
+
+
+def bench_skip_detection(corpus, options):
+    """filter_unprocessed_files 耗时（按路径比对和按处理清单两种方式，全部已处理）"""
+    processor = WatermarkProcessor()
+    work_dir = Path(tempfile.mkdtemp(prefix='wm_bench_skip_'))
+    try:
+        legacy_dir = work_dir / 'legacy'
+        manifest_dir = work_dir / 'manifest'
+        source_files = processor.get_source_files_excluding_watermarked(corpus['source_dir'])
+
+        # 构造“已处理”的输出目录：按路径比对只需文件存在，复制源文件即可
+        for path in source_files:
+            target = legacy_dir / path.relative_to(corpus['source_dir'])
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(path, target)
+        processor.batch_process(corpus['source_dir'], corpus['watermark'], str(manifest_dir),
+                                exclude_dirs=WATERMARKED_DIR_NAMES, record_manifest=True,
+                                **options)
+
+        results = {}
+        for name, check_dir, kwargs in [
+            ('legacy', legacy_dir, {}),
+            ('manifest', manifest_dir, {'watermark_path': corpus['watermark'], 'options': options}),
+        ]:
+            start = time.perf_counter()
+            remaining = processor.filter_unprocessed_files(
+                source_files, corpus['source_dir'], str(check_dir), **kwargs
+            )
+            elapsed = time.perf_counter() - start
+            results[name] = {
+                'files': len(source_files),
+                'unprocessed': len(remaining),
+                'seconds': round(elapsed, 6),
+                'files_per_sec': round(len(source_files) / elapsed, 1) if elapsed else 0.0,
+            }
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _run_case(name, corpus, options, workers):
+    """在独立进程中运行单个测试项，以便单独统计内存峰值"""
+    if name == 'add_watermark':
+        result = bench_add_watermark(corpus, options)
+    elif name == 'batch_sequential':
+        result = bench_batch_process(corpus, options)
+    elif name == 'batch_parallel':
+        result = bench_batch_process(corpus, options, parallel=True, workers=workers)
+    elif name == 'discovery':
+        result = bench_discovery(corpus)
+    elif name == 'skip_detection':
+        result = bench_skip_detection(corpus, options)
+    else:
+        raise ValueError(f"未知的测试项: {name}")
+    result['peak_rss_bytes'] = _peak_rss_bytes()
+    return result
+
+
+CASES = ['add_watermark', 'batch_sequential', 'batch_parallel', 'discovery', 'skip_detection']
+
+
+def run_benchmarks(corpus, options, cases=None, workers=None):
+    """依次在独立子进程中运行测试项"""
+    results = {}
+    for name in cases or CASES:
+        print(f"运行 {name} ...", file=sys.stderr, flush=True)
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            results[name] = executor.submit(_run_case, name, corpus, options, workers).result()
+    return results
+
+
+# 与基线对比时使用的指标（越大越好）
+COMPARE_METRICS = ['images_per_sec', 'megapixels_per_sec', 'files_per_sec']
+
+
+def compare_results(current, baseline):
+    """
+    与基线结果对比
+
+    Returns:
+        dict: {测试项: {指标: 当前值/基线值}}
+    """
+    comparison = {}
+
+    def walk(name, cur, base):
+        for key, value in cur.items():
+            if isinstance(value, dict) and isinstance(base.get(key), dict):
+                walk(f"{name}.{key}", value, base[key])
+            elif key in COMPARE_METRICS and base.get(key):
+                comparison.setdefault(name, {})[key] = round(value / base[key], 3)
+            elif key == 'peak_rss_bytes' and value and base.get(key):
+                comparison.setdefault(name, {})[key] = round(value / base[key], 3)
+
+    for name, result in current.items():
+        if name in baseline:
+            walk(name, result, baseline[name])
+    return comparison
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='watermark_benchmark',
+                                     description='水印处理性能基准测试')
+    parser.add_argument('--preset', choices=list(PRESETS), default='quick', help='图片集预设')
+    parser.add_argument('--seed', type=int, default=20250830, help='随机种子')
+    parser.add_argument('--max-megapixels', type=float, default=None,
+                        help='限制图片集中的最大像素数（百万像素）')
+    parser.add_argument('--corpus-dir', default=None,
+                        help='图片集目录（默认为系统临时目录下按预设命名的目录，可复用）')
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=None, help='只运行指定测试项')
+    parser.add_argument('--encoder', default='default', help='编码配置')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='并行测试的进程数')
+    parser.add_argument('-o', '--output', help='结果 JSON 保存路径')
+    parser.add_argument('--baseline', help='用于对比的基线结果 JSON')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    spec = build_corpus_spec(args.preset, args.seed, args.max_megapixels)
+    corpus_dir = args.corpus_dir or os.path.join(
+        tempfile.gettempdir(), f"wm_bench_corpus_{args.preset}_{args.seed}"
+    )
+    print(f"准备图片集: {corpus_dir}", file=sys.stderr, flush=True)
+    # 在子进程中生成，避免主进程内存膨胀后被各测试子进程的内存峰值继承
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        corpus = executor.submit(generate_corpus, corpus_dir, spec).result()
+
+    options = {'position': 'bottom_right', 'opacity': 0.7, 'scale': 0.1,
+               'encoder': args.encoder, 'output_format': 'keep'}
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'preset': args.preset,
+            'seed': args.seed,
+            'options': options,
+            'corpus': corpus,
+        },
+        'results': run_benchmarks(corpus, options, args.cases, args.workers),
+    }
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        report['comparison'] = compare_results(report['results'], baseline.get('results', {}))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+水印缓存模块
+缓存解码后的水印图片以及按目标尺寸、透明度预处理好的水印叠加层，
+避免批量处理时对每张图片重复打开、缩放和处理透明度
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+
+def estimate_image_bytes(img):
+    """估算图片占用的内存字节数"""
+    if img is None:
+        return 0
+    width, height = img.size
+    # Pillow 内部对多通道图片按每像素 4 字节存储
+    bytes_per_pixel = 1 if img.mode in ('1', 'L', 'P') else 4
+    return width * height * bytes_per_pixel
+
+
+class WatermarkCache:
+    """
+    水印缓存（线程安全，按内存上限做 LRU 淘汰）
+
+    单个超过内存上限的叠加层（如大图的整张平铺叠加层）不计入上限，单独保留最近使用的一个，
+    同尺寸的图片连续处理时仍只生成一次；内存上限足够时可同时缓存多个尺寸
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """
+        Args:
+            max_bytes: 叠加层缓存的内存上限（字节），0 表示不缓存叠加层
+                （超过上限的单个叠加层另外保留最近一个，不计入上限）
+        """
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._sources = {}  # 水印路径 -> (文件签名, 解码后的图片)
+        self._overlays = OrderedDict()  # 缓存键 -> (图片, 字节数)
+        self._current_bytes = 0
+        self._oversized = None  # 最近使用的超过上限的叠加层 (缓存键, 图片, 字节数)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.source_loads = 0
+
+    def _file_signature(self, path):
+        """获取文件签名（修改时间和大小），用于判断水印文件是否变化"""
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get_source(self, watermark_path):
+        """
+        获取解码后的水印原图
+
+        水印文件的修改时间或大小变化时会重新加载，并清除该水印对应的叠加层缓存
+
+        Returns:
+            (文件签名, 水印图片)
+        """
+        key = os.path.abspath(watermark_path)
+        signature = self._file_signature(key)
+
+        with self._lock:
+            cached = self._sources.get(key)
+            if cached and cached[0] == signature:
+                return cached
+
+            with Image.open(key) as img:
+                img.load()
+                source = img.copy()
+
+            self._drop_overlays_for(key)
+            self._sources[key] = (signature, source)
+            self.source_loads += 1
+            return self._sources[key]
+
+    def get_overlay(self, key, factory):
+        """
+        获取叠加层，未命中时调用 factory() 生成并放入缓存
+
+        Args:
+            key: 缓存键（第一个元素必须是水印的绝对路径）
+            factory: 生成叠加层图片的函数
+        """
+        with self._lock:
+            cached = self._overlays.get(key)
+            if cached is not None:
+                self._overlays.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+            if self._oversized is not None and self._oversized[0] == key:
+                self.hits += 1
+                return self._oversized[1]
+            self.misses += 1
+
+        overlay = factory()
+        size = estimate_image_bytes(overlay)
+
+        with self._lock:
+            if not self.max_bytes:
+                return overlay
+            if size > self.max_bytes:
+                # 单个叠加层超过上限时不放入 LRU，替换单独保留的最近一个
+                self._oversized = (key, overlay, size)
+                return overlay
+            if key not in self._overlays:
+                self._overlays[key] = (overlay, size)
+                self._current_bytes += size
+                self._evict()
+        return overlay
+
+    def _evict(self):
+        """按 LRU 顺序淘汰，直到内存占用低于上限"""
+        while self._current_bytes > self.max_bytes and self._overlays:
+            _, (_, size) = self._overlays.popitem(last=False)
+            self._current_bytes -= size
+            self.evictions += 1
+
+    def _drop_overlays_for(self, source_key):
+        """删除某个水印文件对应的全部叠加层"""
+        for key in [k for k in self._overlays if k[0] == source_key]:
+            _, size = self._overlays.pop(key)
+            self._current_bytes -= size
+        if self._oversized is not None and self._oversized[0][0] == source_key:
+            self._oversized = None
+
+    def clear(self):
+        """清空缓存（计数器保留）"""
+        with self._lock:
+            self._sources.clear()
+            self._overlays.clear()
+            self._current_bytes = 0
+            self._oversized = None
+
+    def stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'source_loads': self.source_loads,
+                'overlays': len(self._overlays),
+                'bytes': self._current_bytes,
+                'max_bytes': self.max_bytes,
+                'oversized_bytes': self._oversized[2] if self._oversized else 0,
+            }
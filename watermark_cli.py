@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+水印添加工具 - 命令行入口
+不依赖 tkinter，适用于无图形界面的服务器和定时任务；
+处理结束后在标准输出打印 JSON 格式的汇总信息（其他日志输出到标准错误）
+
+用法:
+    python -m watermark_cli 源目录 --watermark 水印.png [选项]
+    python -m watermark_cli 照片.zip --watermark 水印.png [-o 输出.zip] [选项]
+"""
+
+import argparse
+import contextlib
+import json
+import signal
+import socket
+import sys
+import time
+from pathlib import Path
+
+from watermark_processor import WatermarkProcessor, WATERMARKED_DIR_NAMES, apply_max_image_pixels
+from watermark_options import BatchOptions
+from watermark_encoder import ENCODER_PROFILES, OUTPUT_FORMATS
+from watermark_watch import HotFolder, DEFAULT_SETTLE_SECONDS, DEFAULT_POLL_INTERVAL
+from watermark_tiling import (POSITIONS, TILED_POSITION, DEFAULT_TILE_SPACING, DEFAULT_TILE_ANGLE,
+                              validate_tiling)
+from watermark_text import TextWatermark, TEMPLATE_FIELDS
+from watermark_dedup import LINK_MODES
+from watermark_shard import validate_shard
+from watermark_atomic import write_atomic
+from watermark_archive import is_archive, archive_suffix, default_archive_output
+from watermark_planner import plan_batch, DEFAULT_SAMPLE_SIZE
+from watermark_renditions import load_renditions, normalize_renditions
+
+
+def build_parser():
+    """创建命令行参数解析器"""
+    parser = argparse.ArgumentParser(
+        prog='watermark_cli',
+        description='批量给目录下所有图片文件添加水印（命令行版本）'
+    )
+    parser.add_argument('source_dir', help='源图片目录，或 zip / tar 压缩包（直接处理压缩包中的图片）')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-w', '--watermark', help='水印图片路径')
+    fields = '、'.join(f'{{{name}}}' for name in TEMPLATE_FIELDS)
+    source.add_argument('--text',
+                        help=f'文字水印，可使用模板字段 {fields}（如 "© {{year}} 客户名 {{filename}}"）；'
+                             '文字的字号为图片最大边 × --scale')
+    parser.add_argument('--font', help='文字水印的字体文件（默认 Pillow 内置字体，不含中文字形）')
+    parser.add_argument('--text-color', default='white', help='文字颜色（默认 white，可用 #RRGGBBAA）')
+    parser.add_argument('--stroke-width', type=float, default=0.0,
+                        help='文字描边宽度，相对于字号的比例（默认 0 不描边）')
+    parser.add_argument('--stroke-color', default='black', help='文字描边颜色（默认 black）')
+    parser.add_argument('--position', choices=POSITIONS, default='bottom_right',
+                        help='水印位置（默认 bottom_right；tiled 为旋转后错行平铺满整张图片）')
+    parser.add_argument('--opacity', type=float, default=0.7,
+                        help='透明度 0.0-1.0（默认 0.7）')
+    parser.add_argument('--scale', type=float, default=0.1,
+                        help='水印大小，相对于图片最大边的比例（默认 0.1）')
+    parser.add_argument('--tile-spacing', type=float, default=DEFAULT_TILE_SPACING,
+                        help=f'平铺时相邻水印之间的空白占水印尺寸的比例（默认 {DEFAULT_TILE_SPACING}）')
+    parser.add_argument('--tile-angle', type=float, default=DEFAULT_TILE_ANGLE,
+                        help=f'平铺时水印的旋转角度，逆时针（默认 {DEFAULT_TILE_ANGLE}）')
+    parser.add_argument('--cache-mb', type=int, default=64,
+                        help='水印叠加层缓存上限（MB，默认 64）；平铺的叠加层与图片同样大，'
+                             '超过上限时只保留最近一个（同尺寸图片连续处理时复用），'
+                             '调大后可同时缓存多种尺寸的平铺叠加层')
+    parser.add_argument('--group-by-size', action='store_true',
+                        help='顺序处理时先按图片尺寸分组，同尺寸图片连续处理以复用水印叠加层')
+    parser.add_argument('--dedup', action='store_true',
+                        help='按内容去重：字节相同的源图片只处理一次，其余输出由第一份生成')
+    parser.add_argument('--dedup-link', choices=LINK_MODES, default='auto',
+                        help='去重时生成重复输出的方式（默认 auto：依次尝试硬链接、reflink、复制）')
+    parser.add_argument('--renditions', metavar='JSON',
+                        help='多规格输出的规格文件：每张源图片只解码一次，按每个规格（最大边长、水印、位置、'
+                             '透明度、大小、编码配置、输出格式）写入输出目录下的子目录')
+    parser.add_argument('--output-mode', choices=['watermarked', 'watermarked_new', 'custom'],
+                        default='watermarked',
+                        help='输出模式：源目录/watermarked、源目录/watermarked_new 或自定义目录')
+    parser.add_argument('-o', '--output-dir', help='自定义输出目录（custom 模式必填）；源为压缩包时为输出压缩包路径')
+    parser.add_argument('--encoder', choices=list(ENCODER_PROFILES), default='default',
+                        help='编码配置（默认 default：JPEG 质量 95 + optimize）')
+    parser.add_argument('--output-format', choices=list(OUTPUT_FORMATS), default='keep',
+                        help='输出格式（默认 keep：保持源文件格式）')
+    parser.add_argument('--jpeg-quality', type=int, help='覆盖编码配置中的 JPEG 质量 (1-100)')
+    parser.add_argument('--png-compress-level', type=int, help='覆盖编码配置中的 PNG 压缩级别 (0-9)')
+    parser.add_argument('--no-skip-processed', dest='skip_processed', action='store_false',
+                        help='不跳过已添加水印的图片（默认跳过，检测 源目录/watermarked）')
+    parser.add_argument('--no-resume', dest='resume', action='store_false',
+                        help='不从上次中断处继续（默认输出目录中有相同设置的中断日志时继续）')
+    parser.add_argument('--verify-hash', action='store_true',
+                        help='智能检测时对仅修改时间变化的文件比对内容哈希')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='并行工作进程数（默认 CPU 核心数，1 表示单进程顺序处理）')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='使用读取 / 计算 / 写出流水线（线程），适合源目录位于 NFS 等网络存储；'
+                             '此时 -j 为计算线程数')
+    parser.add_argument('--readers', type=int, default=2,
+                        help='流水线模式的读取线程数（默认 2）')
+    parser.add_argument('--memory-budget', type=int, metavar='MB',
+                        help='并行处理时同时处理的图片的估算内存上限（MB），大图会减少并发')
+    parser.add_argument('--max-image-pixels', type=int,
+                        help='覆盖 Pillow 的解压炸弹保护像素上限，处理超大图片时使用（0 表示不限制）')
+    parser.add_argument('--shard-index', type=int, default=0,
+                        help='分片序号（0 起），与 --shard-count 一起在多个进程或机器间分配文件')
+    parser.add_argument('--shard-count', type=int, default=1,
+                        help='分片数，每个分片按相对路径哈希只处理其中一部分文件（默认 1 不分片）')
+    parser.add_argument('--report', help='将 JSON 汇总同时写入此文件（分片运行后用 watermark_shard merge 合并）')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='只预估不处理：读取文件头统计待处理文件的格式、像素数、会跳过的文件数，'
+                             '并按少量样本的实测耗时估算总耗时和输出大小')
+    parser.add_argument('--sample', type=int, default=DEFAULT_SAMPLE_SIZE,
+                        help=f'预估时实测添加水印的样本数（默认 {DEFAULT_SAMPLE_SIZE}，0 表示不实测）')
+    parser.add_argument('--watch', action='store_true',
+                        help='持续监视源目录，新增或修改的图片写入完成后立即处理（Ctrl+C 结束），'
+                             '每处理一个文件在标准输出打印一行 JSON')
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help=f'监视模式下文件保持不变多少秒后才处理（默认 {DEFAULT_SETTLE_SECONDS}）')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help=f'inotify 不可用时的目录扫描间隔秒数（默认 {DEFAULT_POLL_INTERVAL}）')
+    parser.add_argument('--progress', action='store_true',
+                        help='在标准错误输出处理进度')
+    parser.add_argument('--stats', action='store_true',
+                        help='在 JSON 汇总中加入各阶段耗时统计（含分位数）')
+    parser.add_argument('--stats-log', help='将每个文件的分阶段统计记录写入 JSON Lines 文件')
+    return parser
+
+
+def _validate(parser, args):
+    """校验参数"""
+    archive = is_archive(args.source_dir)
+    if not archive and not Path(args.source_dir).is_dir():
+        parser.error(f"源目录不存在: {args.source_dir}")
+    if archive and (args.watch or args.shard_count > 1):
+        parser.error("处理压缩包时不支持 --watch 和分片")
+    if archive and args.output_dir and archive_suffix(args.output_dir) is None:
+        parser.error(f"不支持的输出压缩包格式: {args.output_dir}")
+    if args.watermark and not Path(args.watermark).is_file():
+        parser.error(f"水印文件不存在: {args.watermark}")
+    if args.text:
+        try:
+            _watermark_from_args(args)
+        except (ValueError, OSError) as e:
+            parser.error(f"文字水印设置无效: {e}")
+    if args.output_mode == 'custom' and not args.output_dir:
+        parser.error("custom 输出模式需要指定 --output-dir")
+    if not 0.0 <= args.opacity <= 1.0:
+        parser.error("--opacity 必须在 0.0 到 1.0 之间")
+    if not 0.0 < args.scale <= 1.0:
+        parser.error("--scale 必须在 0.0 到 1.0 之间")
+    if args.tile_spacing < 0:
+        parser.error("--tile-spacing 不能为负数")
+    if args.cache_mb < 0:
+        parser.error("--cache-mb 不能为负数")
+    if args.jpeg_quality is not None and not 1 <= args.jpeg_quality <= 100:
+        parser.error("--jpeg-quality 必须在 1 到 100 之间")
+    if args.png_compress_level is not None and not 0 <= args.png_compress_level <= 9:
+        parser.error("--png-compress-level 必须在 0 到 9 之间")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers 必须大于 0")
+    if args.settle < 0 or args.poll_interval <= 0:
+        parser.error("--settle 不能为负数，--poll-interval 必须大于 0")
+    if args.readers < 1:
+        parser.error("--readers 必须大于 0")
+    if args.memory_budget is not None and args.memory_budget < 1:
+        parser.error("--memory-budget 必须大于 0")
+    if args.max_image_pixels is not None and args.max_image_pixels < 0:
+        parser.error("--max-image-pixels 不能为负数")
+    try:
+        validate_shard(args.shard_index, args.shard_count)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.watch and args.shard_count > 1:
+        parser.error("--watch 不支持分片")
+    if args.dry_run and (args.watch or archive):
+        parser.error("--dry-run 不支持 --watch 和压缩包")
+    if args.sample < 0:
+        parser.error("--sample 不能为负数")
+    if args.renditions:
+        if args.pipeline or args.watch or args.dry_run or archive:
+            parser.error("--renditions 不支持 --pipeline、--watch、--dry-run 和压缩包")
+        try:
+            normalize_renditions(load_renditions(args.renditions), _watermark_from_args(args))
+        except (ValueError, OSError) as e:
+            parser.error(f"输出规格无效: {e}")
+
+
+def _encoder_from_args(args):
+    """根据编码配置和覆盖参数生成 encoder 参数"""
+    overrides = {}
+    if args.jpeg_quality is not None:
+        overrides['jpeg_quality'] = args.jpeg_quality
+    if args.png_compress_level is not None:
+        overrides['png_compress_level'] = args.png_compress_level
+    if not overrides:
+        return args.encoder
+    return dict(overrides, profile=args.encoder)
+
+
+def _watermark_from_args(args):
+    """根据参数获取水印：水印图片路径或文字水印"""
+    if not args.text:
+        return args.watermark
+    return TextWatermark(args.text, font_path=args.font, color=args.text_color,
+                         stroke_width=args.stroke_width, stroke_color=args.stroke_color)
+
+
+def _create_processor(args):
+    """按命令行参数创建处理器"""
+    return WatermarkProcessor(cache_max_bytes=args.cache_mb * 1024 * 1024,
+                              max_image_pixels=args.max_image_pixels)
+
+
+def _batch_options_from_args(args):
+    """按命令行参数生成批量处理选项（命令行总是记录处理清单和批处理日志）"""
+    return BatchOptions(
+        parallel=args.workers != 1 and not args.pipeline,
+        workers=args.workers,
+        pipeline=args.pipeline,
+        readers=args.readers,
+        memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget else None,
+        skip_processed=args.skip_processed,
+        watermarked_dir=str(Path(args.source_dir) / 'watermarked'),
+        verify_hash=args.verify_hash,
+        record_manifest=True,
+        journal=True,
+        resume=args.resume,
+        exclude_dirs=WATERMARKED_DIR_NAMES,
+        encoder=_encoder_from_args(args),
+        output_format=args.output_format,
+        tile_spacing=args.tile_spacing,
+        tile_angle=args.tile_angle,
+        renditions=load_renditions(args.renditions) if args.renditions else None,
+        group_by_size=args.group_by_size,
+        collect_stats=args.stats,
+        stats_log=args.stats_log,
+        dedup=args.dedup,
+        dedup_link=args.dedup_link,
+        shard_index=args.shard_index,
+        shard_count=args.shard_count,
+    )
+
+
+def _progress_printer():
+    """创建输出到标准错误的进度回调"""
+    def callback(current, total, filename):
+        print(f"[{current}/{total}] {filename}", file=sys.stderr, flush=True)
+    return callback
+
+
+def run(args, processor=None):
+    """
+    按命令行参数执行批量处理
+
+    Returns:
+        dict: 处理汇总信息
+    """
+    processor = processor or _create_processor(args)
+    output_dir = processor.resolve_output_dir(args.source_dir, args.output_mode, args.output_dir)
+
+    start = time.perf_counter()
+    result = processor.batch_process(
+        args.source_dir,
+        _watermark_from_args(args),
+        output_dir,
+        position=args.position,
+        opacity=args.opacity,
+        scale=args.scale,
+        progress_callback=_progress_printer() if args.progress else None,
+        options=_batch_options_from_args(args),
+    )
+    wall_time = time.perf_counter() - start
+    success, total, errors = result[:3]
+
+    summary = {
+        'source_dir': str(args.source_dir),
+        'output_dir': output_dir,
+        'total': total,
+        'success': success,
+        'failed': len(errors),
+        'errors': errors,
+        'wall_time': round(wall_time, 3),
+        'images_per_sec': round(success / wall_time, 3) if wall_time > 0 else 0.0,
+    }
+    if args.stats:
+        summary['stats'] = result[3]
+    if args.pipeline:
+        summary['pipeline'] = processor.last_pipeline_metrics
+    if processor.last_dedup_stats is not None:
+        summary['dedup'] = processor.last_dedup_stats
+    if args.shard_count > 1:
+        summary['shard'] = {'index': args.shard_index, 'count': args.shard_count}
+        summary['host'] = socket.gethostname()
+    return summary
+
+
+def run_plan(args, processor=None):
+    """
+    按命令行参数预估批量处理（不写输出目录）
+
+    Returns:
+        dict: 预估结果
+    """
+    processor = processor or _create_processor(args)
+    output_dir = processor.resolve_output_dir(args.source_dir, args.output_mode, args.output_dir)
+    return plan_batch(
+        processor,
+        args.source_dir,
+        _watermark_from_args(args),
+        output_dir,
+        position=args.position,
+        opacity=args.opacity,
+        scale=args.scale,
+        options=_batch_options_from_args(args),
+        sample_size=args.sample,
+    )
+
+
+def run_archive(args, processor=None):
+    """
+    处理压缩包：结果写入 -o 指定的压缩包，默认为源压缩包同目录下的“名称_watermarked.扩展名”
+
+    Returns:
+        dict: 处理汇总信息
+    """
+    processor = processor or _create_processor(args)
+    
+    start = time.perf_counter()
+    success, total, errors = processor.process_archive(
+        args.source_dir,
+        _watermark_from_args(args),
+        args.output_dir,
+        position=args.position,
+        opacity=args.opacity,
+        scale=args.scale,
+        progress_callback=_progress_printer() if args.progress else None,
+        encoder=_encoder_from_args(args),
+        output_format=args.output_format,
+        tile_spacing=args.tile_spacing,
+        tile_angle=args.tile_angle,
+    )
+    wall_time = time.perf_counter() - start
+    
+    return {
+        'source_archive': str(args.source_dir),
+        'output_archive': args.output_dir or default_archive_output(args.source_dir),
+        'total': total,
+        'success': success,
+        'failed': len(errors),
+        'errors': errors,
+        'wall_time': round(wall_time, 3),
+        'images_per_sec': round(success / wall_time, 3) if wall_time > 0 else 0.0,
+    }
+
+
+def run_watch(args, processor=None, out=None):
+    """
+    按命令行参数持续监视源目录，直到收到中断或终止信号
+    
+    Args:
+        out: 输出每个文件处理结果（JSON 行）的流
+    
+    Returns:
+        dict: 监视期间的处理汇总
+    """
+    out = out or sys.stdout
+    processor = processor or _create_processor(args)
+    output_dir = processor.resolve_output_dir(args.source_dir, args.output_mode, args.output_dir)
+    options = {
+        'position': args.position,
+        'opacity': args.opacity,
+        'scale': args.scale,
+        'encoder': _encoder_from_args(args),
+        'output_format': args.output_format,
+    }
+    if args.position == TILED_POSITION:
+        options['tile_spacing'], options['tile_angle'] = validate_tiling(args.tile_spacing,
+                                                                         args.tile_angle)
+    
+    def on_result(result):
+        print(json.dumps(result, ensure_ascii=False), file=out, flush=True)
+    
+    hot_folder = HotFolder(processor, args.source_dir, _watermark_from_args(args), output_dir,
+                           options, settle_seconds=args.settle,
+                           poll_interval=args.poll_interval, on_result=on_result)
+    signal.signal(signal.SIGTERM, lambda signum, frame: hot_folder.stop())
+    
+    start = time.perf_counter()
+    try:
+        hot_folder.run()
+    except KeyboardInterrupt:
+        pass
+    
+    return {
+        'source_dir': str(args.source_dir),
+        'output_dir': output_dir,
+        'success': hot_folder.processed,
+        'failed': hot_folder.failed,
+        'wall_time': round(time.perf_counter() - start, 3),
+    }
+
+
+def main(argv=None):
+    """命令行主函数，返回进程退出码（0 成功，1 有文件处理失败，2 执行出错）"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    _validate(parser, args)
+    # 像素上限是进程内的全局设置，只在程序入口设置一次（并行工作进程按此初始化）
+    apply_max_image_pixels(args.max_image_pixels)
+
+    out = sys.stdout
+    try:
+        # 处理过程中的日志输出到标准错误，标准输出只保留 JSON 汇总
+        with contextlib.redirect_stdout(sys.stderr):
+            if args.watch:
+                summary = run_watch(args, out=out)
+            elif args.dry_run:
+                summary = run_plan(args)
+            elif is_archive(args.source_dir):
+                summary = run_archive(args)
+            else:
+                summary = run(args)
+    except Exception as e:
+        print(json.dumps({'error': str(e)}, ensure_ascii=False))
+        return 2
+
+    text = json.dumps(summary, ensure_ascii=False, indent=2)
+    if args.report:
+        write_atomic(args.report, (text + '\n').encode('utf-8'))
+    print(text)
+    return 1 if summary.get('failed') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量处理控制模块
+BatchControl 在文件之间暂停、继续或取消批量处理（正在处理的文件总会完成，不会留下半个输出）；
+ProgressMonitor 记录最新进度并计算吞吐量和剩余时间，供界面按固定频率读取，
+避免每处理一个文件就刷新一次界面
+"""
+
+import threading
+import time
+from collections import deque
+
+# 暂停时检查是否已取消的间隔（秒）
+_PAUSE_POLL_INTERVAL = 0.2
+
+
+class BatchControl:
+    """批量处理的暂停 / 取消控制（线程安全，可在界面线程中调用）"""
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def pause(self):
+        """暂停：正在处理的文件完成后不再开始新文件"""
+        self._running.clear()
+
+    def resume(self):
+        """继续处理"""
+        self._running.set()
+
+    def cancel(self):
+        """取消：正在处理的文件完成后结束，剩余文件不再处理"""
+        self._cancelled.set()
+        self._running.set()
+
+    def wait_if_paused(self):
+        """
+        处理下一个文件前调用：暂停时等待继续或取消
+
+        Returns:
+            bool: 可以继续处理返回 True，已取消返回 False
+        """
+        while not self._running.wait(_PAUSE_POLL_INTERVAL):
+            if self._cancelled.is_set():
+                return False
+        return not self._cancelled.is_set()
+
+
+class ProgressMonitor:
+    """
+    进度记录，可直接作为 batch_process 的 progress_callback
+
+    回调只记录数据，界面线程定期调用 snapshot() 获取进度、吞吐量和剩余时间
+    """
+
+    def __init__(self, window=10.0):
+        """
+        Args:
+            window: 计算吞吐量的时间窗口（秒），反映最近的处理速度
+        """
+        self.window = window
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.current = 0
+        self.total = 0
+        self.filename = ''
+        self._samples = deque()  # (时间, 已处理数)
+
+    def __call__(self, current, total, filename):
+        now = time.monotonic()
+        with self._lock:
+            self.current = current
+            self.total = total
+            self.filename = filename
+            self._samples.append((now, current))
+            while len(self._samples) > 2 and now - self._samples[0][0] > self.window:
+                self._samples.popleft()
+
+    def snapshot(self):
+        """
+        获取当前进度
+
+        Returns:
+            dict: current、total、filename、elapsed（秒）、rate（张/秒）、
+                eta（预计剩余秒数，无法估计时为 None）
+        """
+        now = time.monotonic()
+        with self._lock:
+            current, total, filename = self.current, self.total, self.filename
+            first = self._samples[0] if self._samples else (self.started, 0)
+
+        rate = 0.0
+        if now > first[0] and current > first[1]:
+            rate = (current - first[1]) / (now - first[0])
+        eta = (total - current) / rate if rate > 0 and total >= current else None
+        return {
+            'current': current,
+            'total': total,
+            'filename': filename,
+            'elapsed': now - self.started,
+            'rate': rate,
+            'eta': eta,
+        }
+
+
+def format_duration(seconds):
+    """将秒数格式化为 H:MM:SS 或 MM:SS"""
+    seconds = int(round(seconds))
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
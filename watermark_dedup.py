@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内容去重模块
+批量处理时按内容识别字节完全相同的源图片：每份内容只解码、添加水印和编码一次，
+其余相同内容的输出直接由第一份的输出生成（硬链接、reflink 或复制）。
+
+只有大小相同的文件才需要计算内容哈希（流式 BLAKE2b），大小唯一的文件不读取内容；
+输出格式不同的相同内容分别处理
+"""
+
+import os
+import shutil
+from collections import Counter
+
+from watermark_atomic import DirectoryCache, temp_path_for, fsync_file, fsync_directory
+from watermark_manifest import file_content_hash
+
+# 生成重复输出的方式；'auto' 依次尝试硬链接、reflink、复制
+LINK_MODES = ('auto', 'hardlink', 'reflink', 'copy')
+
+# Linux 的 FICLONE ioctl（btrfs、XFS 等支持写时复制的文件系统）
+_FICLONE = 0x40049409
+
+
+def _reflink(source, target):
+    """创建写时复制的副本（不支持时抛出 OSError）"""
+    import fcntl
+    with open(source, 'rb') as src, open(target, 'xb') as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+
+def materialize(source, target, mode='auto', directories=None):
+    """
+    用已生成的输出文件生成另一个相同内容的输出（先生成临时文件，复制的内容落盘后再改名，
+    改名后同步所在目录，不会留下不完整的文件）
+
+    Args:
+        source: 已生成的输出文件
+        target: 需要生成的输出文件
+        mode: 'auto', 'hardlink', 'reflink' 或 'copy'
+        directories: DirectoryCache，用于只创建一次输出目录
+
+    Returns:
+        str: 实际使用的方式（'hardlink', 'reflink', 'copy'）
+    """
+    if mode not in LINK_MODES:
+        raise ValueError(f"不支持的去重输出方式: {mode}")
+    methods = ('hardlink', 'reflink', 'copy') if mode == 'auto' else (mode,)
+
+    target = os.fspath(target)
+    (directories or DirectoryCache()).ensure(os.path.dirname(target))
+    error = None
+    for method in methods:
+        temp_path = temp_path_for(target)
+        try:
+            if method == 'hardlink':
+                os.link(source, temp_path)
+            elif method == 'reflink':
+                _reflink(source, temp_path)
+            else:
+                shutil.copyfile(source, temp_path)
+            if method != 'hardlink':
+                # 硬链接与已落盘的输出共用数据，复制的数据需要先写入磁盘
+                fsync_file(temp_path)
+            os.replace(temp_path, target)
+            fsync_directory(os.path.dirname(target))
+            return method
+        except OSError as e:
+            error = e
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+    raise error
+
+
+class Deduplicator:
+    """
+    一次批量处理中的内容去重状态
+
+    discover() 判断新发现的文件是否与已发现的文件内容相同；重复文件等到第一份
+    （primary）处理完成后再生成输出
+    """
+
+    def __init__(self, link_mode='auto'):
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"不支持的去重输出方式: {link_mode}")
+        self.link_mode = link_mode
+        self._sizes = set()  # 已出现的 (大小, 输出格式)
+        self._unhashed = {}  # (大小, 输出格式) -> 尚未计算哈希的第一个文件
+        self._primaries = {}  # (内容哈希, 输出格式) -> 第一个文件
+        self._waiting = {}  # 第一个文件 -> [(重复文件, 源文件状态)]
+        self._results = {}  # 第一个文件 -> ('ok', 输出文件) 或 ('error', 错误信息)
+        self.hashed_files = 0
+        self.hashed_bytes = 0
+        self.unique = 0
+        self.duplicates = 0
+        self.materialized = 0
+        self.methods = Counter()
+        self.errors = []
+
+    def _hash(self, path, size):
+        self.hashed_files += 1
+        self.hashed_bytes += size
+        return file_content_hash(path)
+
+    def discover(self, path, size, output_format):
+        """
+        登记新发现的文件
+
+        Args:
+            path: 源文件路径
+            size: 源文件大小
+            output_format: 输出格式（Pillow 格式名）
+
+        Returns:
+            内容相同的第一个文件；该文件是第一份时返回 None
+        """
+        size_key = (size, output_format)
+        if size_key not in self._sizes:
+            # 大小唯一的文件先不计算哈希
+            self._sizes.add(size_key)
+            self._unhashed[size_key] = path
+            self.unique += 1
+            return None
+
+        first = self._unhashed.pop(size_key, None)
+        if first is not None:
+            # 出现第二个同样大小的文件时才计算第一个文件的哈希
+            self._primaries[(self._hash(first, size), output_format)] = first
+
+        key = (self._hash(path, size), output_format)
+        primary = self._primaries.get(key)
+        if primary is None:
+            self._primaries[key] = path
+            self.unique += 1
+            return None
+        self.duplicates += 1
+        return primary
+
+    def add_duplicate(self, primary, path, stat):
+        """登记等待第一份处理完成的重复文件（stat 为发现时的源文件状态）"""
+        self._waiting.setdefault(primary, []).append((path, stat))
+
+    def primary_done(self, primary, output_file):
+        """第一份处理成功"""
+        self._results[primary] = ('ok', output_file)
+
+    def primary_failed(self, primary, error):
+        """第一份处理失败，相同内容的文件也视为失败"""
+        self._results[primary] = ('error', error)
+
+    def take_ready(self, primary):
+        """
+        取出第一份已处理完成、可以生成输出的重复文件
+
+        Returns:
+            (处理结果, [(重复文件, 源文件状态)])；第一份尚未完成时为 (None, [])
+        """
+        result = self._results.get(primary)
+        if result is None:
+            return None, []
+        return result, self._waiting.pop(primary, [])
+
+    def waiting(self):
+        """仍在等待第一份处理完成的重复文件数（取消时这些文件不会生成输出）"""
+        return sum(len(files) for files in self._waiting.values())
+
+    def add_materialized(self, method):
+        """记录一次由第一份的输出生成的重复输出（节省一次解码和编码）"""
+        self.materialized += 1
+        self.methods[method] += 1
+
+    def summary(self):
+        """去重统计"""
+        return {
+            'unique': self.unique,
+            'duplicates': self.duplicates,
+            'saved_cycles': self.materialized,
+            'methods': dict(self.methods),
+            'hashed_files': self.hashed_files,
+            'hashed_bytes': self.hashed_bytes,
+            'failed': len(self.errors),
+            'cancelled': self.waiting(),
+        }
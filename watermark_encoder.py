@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片编码模块
+提供命名的编码配置（fast / balanced / archival 等）以及按输出格式保存图片，
+编码通常是批量处理中最耗时的环节，可按任务在输出体积和处理速度之间取舍
+"""
+
+from pathlib import Path
+
+from PIL import Image
+
+# 编码配置
+# default 与早期版本的固定参数一致（JPEG 质量 95 + optimize，PNG optimize）
+ENCODER_PROFILES = {
+    'default': {
+        'jpeg_quality': 95,
+        'jpeg_optimize': True,
+        'jpeg_progressive': False,
+        'jpeg_subsampling': None,
+        'png_compress_level': 9,
+        'png_optimize': True,
+        'webp_quality': 90,
+        'webp_method': 4,
+        'webp_lossless': False,
+    },
+    'fast': {
+        'jpeg_quality': 85,
+        'jpeg_optimize': False,
+        'jpeg_progressive': False,
+        'jpeg_subsampling': '4:2:0',
+        'png_compress_level': 1,
+        'png_optimize': False,
+        'webp_quality': 80,
+        'webp_method': 0,
+        'webp_lossless': False,
+    },
+    'balanced': {
+        'jpeg_quality': 90,
+        'jpeg_optimize': False,
+        'jpeg_progressive': False,
+        'jpeg_subsampling': '4:2:0',
+        'png_compress_level': 6,
+        'png_optimize': False,
+        'webp_quality': 85,
+        'webp_method': 4,
+        'webp_lossless': False,
+    },
+    'archival': {
+        'jpeg_quality': 95,
+        'jpeg_optimize': True,
+        'jpeg_progressive': True,
+        'jpeg_subsampling': '4:4:4',
+        'png_compress_level': 9,
+        'png_optimize': True,
+        'webp_quality': 100,
+        'webp_method': 6,
+        'webp_lossless': True,
+    },
+}
+
+# 输出格式策略：keep 表示保持源文件格式（按输出文件扩展名）
+OUTPUT_FORMATS = ('keep', 'jpeg', 'png', 'webp')
+
+# 输出格式对应的 Pillow 格式名和扩展名
+FORMAT_NAMES = {'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'BMP': '.bmp', 'GIF': '.gif'}
+
+
+def resolve_profile(encoder='default'):
+    """
+    获取编码配置
+
+    Args:
+        encoder: 配置名称，或包含覆盖项的字典（可用 'profile' 键指定基础配置）
+
+    Returns:
+        dict: 完整的编码配置
+    """
+    if isinstance(encoder, dict):
+        overrides = dict(encoder)
+        base = overrides.pop('profile', 'default')
+    else:
+        overrides = {}
+        base = encoder or 'default'
+
+    if base not in ENCODER_PROFILES:
+        raise ValueError(f"未知的编码配置: {base}（可选: {', '.join(ENCODER_PROFILES)}）")
+
+    unknown = set(overrides) - set(ENCODER_PROFILES[base])
+    if unknown:
+        raise ValueError(f"未知的编码参数: {', '.join(sorted(unknown))}")
+
+    profile = dict(ENCODER_PROFILES[base])
+    profile.update(overrides)
+    return profile
+
+
+def output_path_for(output_path, output_format='keep'):
+    """
+    按输出格式策略确定实际输出路径
+
+    keep 时保持原扩展名（没有扩展名时补 .jpg），其他格式替换为对应扩展名
+    """
+    path = Path(output_path)
+    if output_format == 'keep':
+        if not path.suffix:
+            return str(path) + '.jpg'
+        return str(output_path)
+
+    if output_format not in FORMAT_NAMES:
+        raise ValueError(f"不支持的输出格式: {output_format}（可选: {', '.join(OUTPUT_FORMATS)}）")
+    return str(path.with_suffix(FORMAT_EXTENSIONS[FORMAT_NAMES[output_format]]))
+
+
+def format_for_path(output_path):
+    """根据输出文件扩展名确定 Pillow 保存格式，无法识别时使用 JPEG"""
+    ext = Path(output_path).suffix.lower()
+    format_name = Image.registered_extensions().get(ext)
+    if format_name and format_name in Image.SAVE:
+        return format_name
+    return 'JPEG'
+
+
+def encoder_params(format_name, profile):
+    """获取指定格式的 Pillow 保存参数"""
+    if format_name == 'JPEG':
+        params = {
+            'quality': profile['jpeg_quality'],
+            'optimize': profile['jpeg_optimize'],
+            'progressive': profile['jpeg_progressive'],
+        }
+        if profile['jpeg_subsampling'] is not None:
+            params['subsampling'] = profile['jpeg_subsampling']
+        return params
+    if format_name == 'PNG':
+        return {
+            'compress_level': profile['png_compress_level'],
+            'optimize': profile['png_optimize'],
+        }
+    if format_name == 'WEBP':
+        return {
+            'quality': profile['webp_quality'],
+            'method': profile['webp_method'],
+            'lossless': profile['webp_lossless'],
+        }
+    return {}
+
+
+def save_image(img, fp, format_name, profile):
+    """
+    按编码配置保存图片
+
+    Args:
+        img: 要保存的图片
+        fp: 文件路径或文件对象
+        format_name: Pillow 格式名（JPEG、PNG、WEBP、BMP、GIF 等）
+        profile: resolve_profile 返回的编码配置
+    """
+    img.save(fp, format_name, **encoder_params(format_name, profile))
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批处理日志模块
+批量处理期间在输出目录中逐行追加每个文件的开始和完成记录（JSON Lines），
+完成记录在对应输出落盘之后写入并同步到磁盘（fsync），断电后也不会把内容不完整的输出记为完成；
+批处理正常结束后删除；处理被中断（崩溃、终止、断电或取消）时日志保留，
+下次以相同的输入目录和水印设置继续处理时跳过已完成且未变化的文件，
+并清理中断时正在写出的文件遗留的临时文件
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+
+from watermark_atomic import fsync_directory
+
+JOURNAL_FILENAME = '.watermark_journal.jsonl'
+
+
+def journal_path(output_dir, filename=JOURNAL_FILENAME):
+    """获取输出目录对应的批处理日志路径"""
+    return os.path.join(output_dir, filename)
+
+
+class BatchJournal:
+    """批处理日志"""
+
+    def __init__(self, output_dir, input_dir, fingerprint, filename=JOURNAL_FILENAME):
+        """
+        Args:
+            output_dir: 输出目录，日志文件保存在其中
+            input_dir: 输入目录
+            fingerprint: 水印设置指纹，设置不同的日志不会被继续使用
+            filename: 日志文件名（分片处理时每个分片使用单独的日志）
+        """
+        self.path = journal_path(output_dir, filename)
+        self.input_dir = str(Path(input_dir).resolve())
+        self.fingerprint = fingerprint
+        self.done = {}  # 相对路径 -> (大小, 修改时间)
+        self.started = set()
+        self._file = None
+
+    def _key(self, relative_path):
+        """统一使用 / 分隔的相对路径作为键"""
+        return Path(relative_path).as_posix()
+
+    def load(self):
+        """
+        读取已有日志
+
+        Returns:
+            bool: 日志存在且输入目录和水印设置都相同时返回 True
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                if header.get('input_dir') != self.input_dir or \
+                        header.get('fingerprint') != self.fingerprint:
+                    return False
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 中断时写了一半的行
+                        continue
+                    if entry[0] == 'start':
+                        self.started.add(entry[1])
+                    elif entry[0] == 'done':
+                        self.done[entry[1]] = (entry[2], entry[3])
+        except (OSError, ValueError, AttributeError, IndexError, KeyError, TypeError):
+            return False
+        return True
+
+    def open(self, resume=False):
+        """
+        开始记录
+
+        Args:
+            resume: 是否继续使用已有的日志；为 False 或日志不匹配时重新开始
+
+        Returns:
+            bool: 是否从已有日志继续
+        """
+        resumed = resume and self.load()
+        if not resumed:
+            self.done.clear()
+            self.started.clear()
+        self._file = open(self.path, 'a' if resumed else 'w', encoding='utf-8')
+        if resumed and self._file.tell() and not self._ends_with_newline():
+            # 上次中断在一行的中间，从新的一行继续
+            self._file.write('\n')
+        if not resumed:
+            self._write({'input_dir': self.input_dir, 'fingerprint': self.fingerprint,
+                         'started_at': time.time()}, sync=True)
+            fsync_directory(os.path.dirname(self.path))
+        return resumed
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def _write(self, entry, sync=False):
+        # 每条记录立即交给操作系统，进程被终止时不会丢失；
+        # sync 时再写入磁盘，断电后也不会丢失
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def is_done(self, relative_path, stat):
+        """文件是否已在本批次中完成且之后未变化"""
+        entry = self.done.get(self._key(relative_path))
+        return entry is not None and entry == (stat.st_size, stat.st_mtime_ns)
+
+    def interrupted(self):
+        """上次中断时已开始但未完成的文件（相对路径）"""
+        return sorted(self.started - set(self.done))
+
+    def start(self, relative_path):
+        """记录开始处理一个文件"""
+        self._write(['start', self._key(relative_path)])
+
+    def finish(self, relative_path, stat):
+        """记录一个文件处理成功（stat 为处理前的源文件状态）"""
+        key = self._key(relative_path)
+        self.done[key] = (stat.st_size, stat.st_mtime_ns)
+        self._write(['done', key, stat.st_size, stat.st_mtime_ns], sync=True)
+
+    def close(self):
+        """关闭日志并保留，供下次继续"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def complete(self):
+        """批处理全部结束：关闭并删除日志"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+处理记录清单模块
+在输出目录中用 SQLite 文件记录每个源文件的大小、修改时间、可选的内容哈希
+以及水印设置指纹，增量处理时只需按文件查表，无需遍历整个输出目录；
+源文件或水印设置变化后，对应的输出会被自动重新生成
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+MANIFEST_FILENAME = '.watermark_manifest.sqlite'
+
+
+def file_content_hash(file_path, chunk_size=1024 * 1024):
+    """流式计算文件内容哈希（BLAKE2b）"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def settings_fingerprint(watermark_path, options):
+    """
+    计算水印设置指纹
+
+    Args:
+        watermark_path: 水印文件路径（按内容参与计算），或文字水印（按文字、字体和样式计算）
+        options: add_watermark 的其他参数（位置、透明度、缩放比例等）
+
+    Returns:
+        str: 设置指纹
+    """
+    describe = getattr(watermark_path, 'describe', None)
+    payload = {
+        'watermark': describe() if describe else file_content_hash(watermark_path),
+        'options': options,
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def manifest_path(output_dir, filename=MANIFEST_FILENAME):
+    """获取输出目录对应的清单文件路径"""
+    return os.path.join(output_dir, filename)
+
+
+def manifest_exists(output_dir, filename=MANIFEST_FILENAME):
+    """检查输出目录中是否已有清单"""
+    return os.path.isfile(manifest_path(output_dir, filename))
+
+
+class ProcessedManifest:
+    """已处理文件清单"""
+
+    def __init__(self, output_dir, commit_interval=200, filename=MANIFEST_FILENAME):
+        """
+        Args:
+            output_dir: 输出目录，清单文件保存在其中
+            commit_interval: 每记录多少条提交一次
+            filename: 清单文件名（分片处理时每个分片使用单独的清单）
+        """
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.commit_interval = commit_interval
+        self._pending = 0
+
+        self._conn = sqlite3.connect(manifest_path(output_dir, filename))
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS processed (
+                relative_path TEXT PRIMARY KEY,
+                output_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT,
+                fingerprint TEXT NOT NULL,
+                processed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def _key(self, relative_path):
+        """统一使用 / 分隔的相对路径作为键"""
+        return Path(relative_path).as_posix()
+
+    def is_current(self, relative_path, source_path, fingerprint, stat=None, verify_hash=False):
+        """
+        判断源文件的输出是否仍然有效
+
+        Args:
+            relative_path: 源文件相对路径
+            source_path: 源文件路径
+            fingerprint: 当前水印设置指纹
+            stat: 源文件的 os.stat 结果（为空时自动获取）
+            verify_hash: 大小未变但修改时间变化时，是否通过内容哈希确认
+
+        Returns:
+            bool: 输出有效返回 True，需要（重新）处理返回 False
+        """
+        row = self._conn.execute(
+            "SELECT output_path, size, mtime_ns, content_hash, fingerprint "
+            "FROM processed WHERE relative_path = ?",
+            (self._key(relative_path),)
+        ).fetchone()
+        if row is None:
+            return False
+
+        output_rel, size, mtime_ns, content_hash, recorded_fingerprint = row
+        if recorded_fingerprint != fingerprint:
+            return False
+        if not (self.output_dir / output_rel).exists():
+            return False
+
+        stat = stat or os.stat(source_path)
+        if stat.st_size != size:
+            return False
+        if stat.st_mtime_ns == mtime_ns:
+            return True
+
+        # 仅修改时间变化：可选地用内容哈希确认文件是否真的改变
+        if verify_hash and content_hash and file_content_hash(source_path) == content_hash:
+            self._conn.execute(
+                "UPDATE processed SET mtime_ns = ? WHERE relative_path = ?",
+                (stat.st_mtime_ns, self._key(relative_path))
+            )
+            self._mark_dirty()
+            return True
+        return False
+
+    def record(self, relative_path, source_path, output_path, fingerprint, stat=None,
+               with_hash=False):
+        """
+        记录一个已成功处理的文件
+
+        Args:
+            relative_path: 源文件相对路径
+            source_path: 源文件路径
+            output_path: 输出文件路径
+            fingerprint: 水印设置指纹
+            stat: 处理前获取的源文件 os.stat 结果（为空时自动获取）
+            with_hash: 是否同时记录内容哈希
+        """
+        stat = stat or os.stat(source_path)
+        content_hash = file_content_hash(source_path) if with_hash else None
+        output_rel = Path(os.path.relpath(os.path.abspath(output_path),
+                                          os.path.abspath(self.output_dir))).as_posix()
+
+        self._conn.execute(
+            "INSERT OR REPLACE INTO processed "
+            "(relative_path, output_path, size, mtime_ns, content_hash, fingerprint, processed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self._key(relative_path), output_rel, stat.st_size, stat.st_mtime_ns,
+             content_hash, fingerprint, time.time())
+        )
+        self._mark_dirty()
+
+    def merge_from(self, other_path):
+        """
+        合并另一个清单文件中的记录，同一源文件保留处理时间较新的记录
+
+        Returns:
+            int: 合并的记录数
+        """
+        self.commit()
+        self._conn.execute("ATTACH DATABASE ? AS other", (str(other_path),))
+        try:
+            cursor = self._conn.execute(
+                "INSERT OR REPLACE INTO processed "
+                "(relative_path, output_path, size, mtime_ns, content_hash, fingerprint, processed_at) "
+                "SELECT o.relative_path, o.output_path, o.size, o.mtime_ns, o.content_hash, "
+                "o.fingerprint, o.processed_at FROM other.processed AS o "
+                "LEFT JOIN processed AS m ON m.relative_path = o.relative_path "
+                "WHERE m.relative_path IS NULL OR o.processed_at >= m.processed_at"
+            )
+            merged = cursor.rowcount
+            self._conn.commit()
+        finally:
+            self._conn.execute("DETACH DATABASE other")
+        return merged
+
+    def is_empty(self):
+        """清单中是否还没有任何记录"""
+        return self._conn.execute("SELECT 1 FROM processed LIMIT 1").fetchone() is None
+
+    def _mark_dirty(self):
+        self._pending += 1
+        if self._pending >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        """提交未保存的记录"""
+        self._conn.commit()
+        self._pending = 0
+
+    def close(self):
+        """提交并关闭清单"""
+        self.commit()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
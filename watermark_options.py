@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量处理选项
+BatchOptions 汇集 batch_process 除水印位置、透明度、大小和进度回调以外的全部设置
+（执行方式、跳过检测、处理清单和批处理日志、输出编码、统计、去重、分片、多规格输出），
+命令行、图形界面和预估（dry run）使用同一个选项对象，新增设置只需加在这里
+
+处理清单和批处理日志默认不写：只有明确启用时才会在输出目录中生成
+.watermark_manifest.sqlite 和 .watermark_journal.jsonl
+"""
+
+from watermark_tiling import DEFAULT_TILE_SPACING, DEFAULT_TILE_ANGLE
+
+
+class BatchOptions:
+    """batch_process 的处理选项（创建后可用 replace 生成修改了部分设置的副本）"""
+
+    def __init__(self, *, parallel=False, workers=None, max_in_flight=None, memory_budget=None,
+                 pipeline=False, readers=2, writers=1, queue_size=None,
+                 skip_processed=False, watermarked_dir=None, verify_hash=False,
+                 record_manifest=False, journal=False, resume=False, exclude_dirs=(),
+                 encoder='default', output_format='keep', tile_spacing=DEFAULT_TILE_SPACING,
+                 tile_angle=DEFAULT_TILE_ANGLE, renditions=None, group_by_size=False,
+                 control=None, collect_stats=False, stats_log=None, dedup=False,
+                 dedup_link='auto', shard_index=0, shard_count=1):
+        """
+        Args:
+            parallel: 是否使用多进程并行处理
+            workers: 并行工作进程数（流水线时为计算线程数），默认为 CPU 核心数
+            max_in_flight: 并行时同时提交的最大任务数，默认为工作进程数的 2 倍
+            memory_budget: 并行时所有同时处理的图片的估算内存上限（字节），按文件头中的尺寸
+                估算，大图运行时同时处理的图片数会减少；为空时只按任务数量限制
+            pipeline: 是否使用读取 / 计算 / 写出三阶段流水线（线程），适合源文件位于网络存储
+                等高延迟环境；与 parallel 不能同时使用
+            readers: 流水线的读取线程数
+            writers: 流水线的写出线程数
+            queue_size: 流水线各阶段之间队列的容量，默认为计算线程数的 2 倍
+            skip_processed: 是否跳过已处理且未变化的文件
+            watermarked_dir: 检测已处理文件的目录，默认为输出目录
+            verify_hash: 检测时是否用内容哈希确认仅修改时间变化的文件
+            record_manifest: 是否将处理结果记录到输出目录的处理清单（.watermark_manifest.sqlite）
+            journal: 是否在输出目录中记录批处理日志（.watermark_journal.jsonl，正常结束后删除，
+                中断时保留）
+            resume: 存在输入目录和水印设置都相同的中断日志时，从中断处继续：
+                跳过日志中已完成且之后未变化的文件，并清理中断时遗留的临时文件
+                （继续处理时总会记录批处理日志）
+            exclude_dirs: 扫描输入目录时需要排除的目录名（如 watermarked、watermarked_new）
+            encoder: 编码配置名称（'default', 'fast', 'balanced', 'archival'）或覆盖参数字典
+            output_format: 输出格式（'keep', 'jpeg', 'png', 'webp'）
+            tile_spacing: 平铺水印（position 为 'tiled'）时的间距比例
+            tile_angle: 平铺水印时的旋转角度
+            renditions: 输出规格列表（见 watermark_renditions.normalize_renditions），指定时
+                每个源文件只解码一次，按每个规格写入 输出目录/子目录/相对路径；规格中未指定的
+                水印使用 watermark_path，position 等单一输出的参数不再使用。不支持流水线和去重，
+                处理清单记录第一个规格的输出
+            group_by_size: 顺序处理时是否先按图片尺寸分组，同尺寸图片连续处理以复用叠加层
+                （需要预先读取全部文件头，不再边扫描边处理）
+            control: 暂停 / 取消控制（watermark_control.BatchControl），在文件之间生效：
+                暂停或取消后不再开始新文件，已开始的文件处理完成并正常记录
+            collect_stats: 是否汇总分阶段耗时统计，为 True 时返回值增加统计结果
+            stats_log: 每个文件统计记录的 JSON Lines 日志路径
+            dedup: 是否按内容去重：字节相同（且输出格式相同）的源图片只处理一次，
+                其余输出由第一份的输出生成；文字水印使用文件名等模板字段时不去重
+            dedup_link: 去重时生成重复输出的方式（'auto', 'hardlink', 'reflink', 'copy'）
+            shard_index: 分片序号（0 到 shard_count - 1）
+            shard_count: 分片数；大于 1 时只处理按相对路径哈希分配到本分片的文件，
+                处理清单和批处理日志写入本分片单独的文件（由 watermark_shard merge 合并），
+                已在输出目录主清单中记录的文件仍会被跳过；去重只在分片内进行
+        """
+        self.parallel = parallel
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.memory_budget = memory_budget
+        self.pipeline = pipeline
+        self.readers = readers
+        self.writers = writers
+        self.queue_size = queue_size
+        self.skip_processed = skip_processed
+        self.watermarked_dir = watermarked_dir
+        self.verify_hash = verify_hash
+        self.record_manifest = record_manifest
+        self.journal = journal
+        self.resume = resume
+        self.exclude_dirs = exclude_dirs
+        self.encoder = encoder
+        self.output_format = output_format
+        self.tile_spacing = tile_spacing
+        self.tile_angle = tile_angle
+        self.renditions = renditions
+        self.group_by_size = group_by_size
+        self.control = control
+        self.collect_stats = collect_stats
+        self.stats_log = stats_log
+        self.dedup = dedup
+        self.dedup_link = dedup_link
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+
+    def replace(self, **changes):
+        """
+        生成修改了部分设置的副本
+
+        Raises:
+            TypeError: 包含不存在的设置
+        """
+        settings = dict(vars(self))
+        settings.update(changes)
+        return BatchOptions(**settings)
+
+    @property
+    def uses_journal(self):
+        """是否记录批处理日志（从中断处继续时总会记录）"""
+        return self.journal or self.resume
+
+    def __repr__(self):
+        settings = ', '.join(f"{key}={value!r}" for key, value in vars(self).items())
+        return f"BatchOptions({settings})"
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+并行处理模块
+基于进程池的批量水印执行引擎，限制同时提交的任务数量以保持内存占用平稳；
+设置内存预算时按每个任务的估算内存准入，大图运行时减少同时运行的任务
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from PIL import Image
+
+from watermark_processor import WatermarkProcessor, apply_max_image_pixels
+from watermark_scheduler import MemoryBudget
+from watermark_stats import StageTimer
+
+# 每个工作进程内常驻的水印处理器（保留水印缓存）
+_worker_processor = None
+
+
+def _init_worker(processor_kwargs, max_image_pixels):
+    """
+    工作进程初始化：使用与主进程相同的 Pillow 像素上限（以 spawn 方式启动的进程不会继承），
+    并创建常驻的水印处理器
+    """
+    global _worker_processor
+    apply_max_image_pixels(max_image_pixels or 0)
+    _worker_processor = WatermarkProcessor(**processor_kwargs)
+
+
+def _run_job(job):
+    """
+    在工作进程中处理单个文件
+
+    Args:
+        job: (输入路径, 输出路径, 水印路径, add_watermark 的其他参数[, 是否分阶段统计])；
+            多规格输出时输出路径为列表，参数中包含 renditions（见 process_file）
+
+    Returns:
+        dict: {'source': 输入路径, 'output': 输出路径, 'error': 错误信息或 None,
+               'peak_bytes': 处理该图片时的内存峰值, 'stats': 分阶段统计记录或 None}
+    """
+    input_path, output_path, watermark_path, options = job[:4]
+    timer = StageTimer() if len(job) > 4 and job[4] else None
+    result = {'source': input_path, 'output': output_path, 'error': None, 'peak_bytes': None,
+              'stats': None}
+    try:
+        _worker_processor.process_file(input_path, watermark_path, output_path,
+                                       timer=timer, **options)
+        result['peak_bytes'] = _worker_processor.last_image_stats.get('peak_bytes')
+    except Exception as e:
+        result['error'] = str(e)
+    if timer is not None:
+        result['stats'] = timer.record(input_path, output_path, result['error'],
+                                       result['peak_bytes'])
+    return result
+
+
+class ParallelExecutor:
+    """进程池执行器"""
+
+    def __init__(self, workers=None, max_in_flight=None, processor_kwargs=None,
+                 memory_budget=None):
+        """
+        Args:
+            workers: 工作进程数，默认为 CPU 核心数
+            max_in_flight: 同时提交的最大任务数，默认为工作进程数的 2 倍
+            processor_kwargs: 创建工作进程内 WatermarkProcessor 的参数
+            memory_budget: 所有已提交任务的估算内存上限（字节），为空时不限制
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or self.workers * 2
+        self.processor_kwargs = processor_kwargs or {}
+        self.budget = MemoryBudget(memory_budget) if memory_budget else None
+
+    def run(self, jobs, cost=None):
+        """
+        执行任务并按完成顺序逐个返回结果
+
+        Args:
+            jobs: 可迭代的任务，元素格式同 _run_job 的参数；按需消费，不会一次性展开
+            cost: 估算任务内存的函数 cost(job)，设置了内存预算时使用；
+                预算不足时后续任务按顺序等待，不会被较小的任务插队
+
+        Yields:
+            dict: 单个任务的处理结果
+        """
+        jobs = iter(jobs)
+        budget = self.budget if cost is not None else None
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 initializer=_init_worker,
+                                 initargs=(self.processor_kwargs,
+                                           Image.MAX_IMAGE_PIXELS)) as executor:
+            pending = {}  # future -> 占用的预算
+            held = None  # 预算不足暂缓提交的 (任务, 估算内存)
+            exhausted = False
+            while True:
+                # 补充任务直到达到提交窗口上限或内存预算
+                while len(pending) < self.max_in_flight:
+                    if held is None:
+                        job = None if exhausted else next(jobs, None)
+                        if job is None:
+                            exhausted = True
+                            break
+                        held = (job, cost(job) if budget else 0)
+                    job, job_cost = held
+                    if budget and not budget.try_acquire(job_cost):
+                        break
+                    pending[executor.submit(_run_job, job)] = job_cost
+                    held = None
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_cost = pending.pop(future)
+                    if budget:
+                        budget.release(job_cost)
+                    yield future.result()
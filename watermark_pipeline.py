@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流水线处理模块
+将批量处理拆分为读取、计算、写出三个阶段，各阶段由独立线程执行，之间用有界队列衔接：
+读取线程预先读入源文件内容，计算线程解码、添加水印并在内存中编码，写出线程写入磁盘；
+任务的生成（目录扫描、处理清单查询）和结果处理仍在调用方线程中进行。
+源文件位于 NFS 等高延迟存储时，读写等待可以与计算重叠
+（Pillow 解码和编码时会释放 GIL，计算线程可以并行）
+"""
+
+import os
+import queue
+import threading
+import time
+
+from watermark_atomic import DirectoryCache, write_atomic
+from watermark_encoder import format_for_path
+from watermark_stats import StageTimer, NULL_TIMER
+
+# 队列结束标记
+_DONE = object()
+
+# 阻塞的队列操作每隔该时间检查一次是否已停止（秒）
+_POLL_INTERVAL = 0.1
+
+
+class MeteredQueue:
+    """带统计的有界队列：记录深度分布以及放入、取出时的等待时间"""
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self.max_depth = 0
+        self.depth_total = 0
+        self.puts = 0
+        self.put_wait = 0.0  # 队列满时生产方等待的总时间
+        self.put_stalls = 0
+        self.get_wait = 0.0  # 队列空时消费方等待的总时间
+        self.get_stalls = 0
+
+    def put(self, item, stop_event):
+        """放入元素，队列满时等待；已停止时返回 False"""
+        try:
+            self._queue.put_nowait(item)
+            waited = 0.0
+        except queue.Full:
+            started = time.perf_counter()
+            while True:
+                if stop_event.is_set():
+                    return False
+                try:
+                    self._queue.put(item, timeout=_POLL_INTERVAL)
+                    break
+                except queue.Full:
+                    continue
+            waited = time.perf_counter() - started
+
+        if item is _DONE:
+            return True
+        depth = self._queue.qsize()
+        with self._lock:
+            self.puts += 1
+            self.depth_total += depth
+            self.max_depth = max(self.max_depth, depth)
+            if waited:
+                self.put_wait += waited
+                self.put_stalls += 1
+        return True
+
+    def get(self, stop_event):
+        """取出元素，队列空时等待；已停止时返回 _DONE"""
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+        started = time.perf_counter()
+        while not stop_event.is_set():
+            try:
+                item = self._queue.get(timeout=_POLL_INTERVAL)
+                break
+            except queue.Empty:
+                continue
+        else:
+            return _DONE
+        with self._lock:
+            self.get_wait += time.perf_counter() - started
+            self.get_stalls += 1
+        return item
+
+    def full(self):
+        return self._queue.full()
+
+    def metrics(self):
+        """获取队列统计"""
+        with self._lock:
+            return {
+                'capacity': self.maxsize,
+                'max_depth': self.max_depth,
+                'mean_depth': round(self.depth_total / self.puts, 3) if self.puts else 0.0,
+                'items': self.puts,
+                'put_stalls': self.put_stalls,
+                'put_wait': round(self.put_wait, 4),
+                'get_stalls': self.get_stalls,
+                'get_wait': round(self.get_wait, 4),
+            }
+
+
+class PipelineExecutor:
+    """读取 / 计算 / 写出三阶段流水线执行器，接口与 ParallelExecutor 相同"""
+
+    def __init__(self, processor_kwargs=None, readers=2, workers=None, writers=1,
+                 queue_size=None):
+        """
+        Args:
+            processor_kwargs: 创建计算线程内 WatermarkProcessor 的参数
+            readers: 读取线程数（源文件所在存储延迟越高，需要的读取线程越多）
+            workers: 计算线程数，默认为 CPU 核心数
+            writers: 写出线程数
+            queue_size: 每个队列的容量，默认为计算线程数的 2 倍；
+                读取队列中是源文件内容，写出队列中是编码后的数据，容量决定了内存上限
+        """
+        self.processor_kwargs = processor_kwargs or {}
+        self.readers = max(1, readers)
+        self.workers = workers or os.cpu_count() or 1
+        self.writers = max(1, writers)
+        self.queue_size = queue_size or self.workers * 2
+        self.job_queue = MeteredQueue('jobs', self.queue_size)
+        self.read_queue = MeteredQueue('read', self.queue_size)
+        self.write_queue = MeteredQueue('write', self.queue_size)
+        self.started = None
+        self.finished = None
+
+    def run(self, jobs, cost=None):
+        """
+        执行任务并按完成顺序逐个返回结果
+
+        Args:
+            jobs: 可迭代的任务，元素格式为
+                (输入路径, 输出路径, 水印路径, add_watermark 的其他参数[, 是否分阶段统计])；
+                在调用方线程中按需消费，不会一次性展开
+            cost: 为与 ParallelExecutor 接口一致而保留，流水线的内存由队列容量限制
+
+        Yields:
+            dict: 单个任务的处理结果，格式同 watermark_parallel._run_job 的返回值
+        """
+        from watermark_processor import WatermarkProcessor, read_source
+
+        jobs = iter(jobs)
+        results = queue.Queue()
+        stop = threading.Event()
+        self.started = time.perf_counter()
+
+        def finish(job, timer, error=None, peak_bytes=None):
+            input_path, output_path = job[0], job[1]
+            results.put({
+                'source': input_path,
+                'output': output_path,
+                'error': error,
+                'peak_bytes': peak_bytes,
+                'stats': timer.record(input_path, output_path, error, peak_bytes) if timer else None,
+            })
+
+        def reader():
+            while True:
+                job = self.job_queue.get(stop)
+                if job is _DONE:
+                    return
+                timer = StageTimer() if len(job) > 4 and job[4] else None
+                try:
+                    with (timer or NULL_TIMER).stage('read'):
+                        data = read_source(job[0])
+                except Exception as e:
+                    finish(job, timer, str(e))
+                    continue
+                if not self.read_queue.put((job, timer, data), stop):
+                    return
+
+        def worker():
+            processor = WatermarkProcessor(**self.processor_kwargs)
+            while True:
+                item = self.read_queue.get(stop)
+                if item is _DONE:
+                    return
+                job, timer, data = item
+                _, output_path, watermark_path, options = job[:4]
+                options = {k: v for k, v in options.items() if k != 'output_format'}
+                try:
+                    encoded = processor.watermark_bytes(
+                        data, watermark_path, format_for_path(output_path), timer=timer,
+                        source_name=job[0], **options
+                    )
+                except Exception as e:
+                    finish(job, timer, str(e))
+                    continue
+                del item, data
+                peak_bytes = processor.last_image_stats.get('peak_bytes')
+                if not self.write_queue.put((job, timer, encoded, peak_bytes), stop):
+                    return
+
+        # 写出线程共用，每个输出目录只创建一次
+        directories = DirectoryCache()
+
+        def writer():
+            while True:
+                item = self.write_queue.get(stop)
+                if item is _DONE:
+                    return
+                job, timer, encoded, peak_bytes = item
+                try:
+                    with (timer or NULL_TIMER).stage('write'):
+                        write_atomic(job[1], encoded, directories)
+                except Exception as e:
+                    finish(job, timer, f"添加水印时出错: {e}")
+                    continue
+                finish(job, timer, peak_bytes=peak_bytes)
+
+        def coordinator():
+            # 上一阶段的线程全部结束后，向下一阶段发送结束标记
+            for threads, next_queue, consumers in (
+                (reader_threads, self.read_queue, self.workers),
+                (worker_threads, self.write_queue, self.writers),
+            ):
+                for thread in threads:
+                    thread.join()
+                for _ in range(consumers):
+                    if not next_queue.put(_DONE, stop):
+                        break
+            for thread in writer_threads:
+                thread.join()
+            results.put(_DONE)
+
+        reader_threads = [threading.Thread(target=reader, name=f'wm-reader-{i}', daemon=True)
+                          for i in range(self.readers)]
+        worker_threads = [threading.Thread(target=worker, name=f'wm-worker-{i}', daemon=True)
+                          for i in range(self.workers)]
+        writer_threads = [threading.Thread(target=writer, name=f'wm-writer-{i}', daemon=True)
+                          for i in range(self.writers)]
+        coordinator_thread = threading.Thread(target=coordinator, name='wm-pipeline', daemon=True)
+        for thread in reader_threads + worker_threads + writer_threads + [coordinator_thread]:
+            thread.start()
+
+        try:
+            exhausted = False
+            while True:
+                # 在当前线程中补充任务队列，然后等待结果
+                while not exhausted and not self.job_queue.full():
+                    job = next(jobs, None)
+                    if job is None:
+                        exhausted = True
+                        for _ in range(self.readers):
+                            self.job_queue.put(_DONE, stop)
+                        break
+                    self.job_queue.put(job, stop)
+                try:
+                    result = results.get(timeout=None if exhausted else _POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                if result is _DONE:
+                    break
+                yield result
+        finally:
+            # 调用方提前结束迭代时通知各线程退出
+            stop.set()
+            coordinator_thread.join()
+            self.finished = time.perf_counter()
+
+    def metrics(self):
+        """
+        获取流水线统计
+
+        任务队列 get_wait 较大说明目录扫描跟不上；读取队列 put_wait 较大说明计算跟不上读取，
+        get_wait 较大说明计算线程在等待读取（I/O 瓶颈）；写出队列 put_wait 较大说明写出跟不上
+        """
+        end = self.finished or time.perf_counter()
+        return {
+            'readers': self.readers,
+            'workers': self.workers,
+            'writers': self.writers,
+            'wall_time': round(end - self.started, 3) if self.started else 0.0,
+            'queues': {
+                'jobs': self.job_queue.metrics(),
+                'read': self.read_queue.metrics(),
+                'write': self.write_queue.metrics(),
+            },
+        }
+
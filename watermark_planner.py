@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量处理预估（dry run）
+不添加水印，只读取文件头（Image.open 不解码像素，多线程并行）统计待处理文件的格式、
+颜色模式、总像素数和最大的图片，按处理清单和中断日志计算会被跳过的文件数；
+再抽取少量样本实际添加水印（输出到临时目录），按样本的耗时和输出大小估算整批的
+处理时间和输出总大小
+
+用法:
+    python -m watermark_cli 源目录 -w watermark.png --dry-run [--sample 5]
+"""
+
+import heapq
+import os
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+from watermark_animation import is_animated
+from watermark_encoder import output_path_for, format_for_path
+from watermark_journal import BatchJournal, JOURNAL_FILENAME
+from watermark_manifest import MANIFEST_FILENAME
+from watermark_options import BatchOptions
+
+# 并行读取文件头的线程数（读取文件头主要是等待 I/O）
+DEFAULT_READERS = 8
+
+# 实测添加水印的样本数
+DEFAULT_SAMPLE_SIZE = 5
+
+# 列出的最大图片数
+DEFAULT_TOP = 10
+
+
+def read_header(path):
+    """
+    只读取文件头
+
+    Returns:
+        dict: format, mode, size, animated, bytes（文件大小）
+    """
+    size = os.path.getsize(path)
+    with Image.open(path) as img:
+        return {
+            'format': img.format,
+            'mode': img.mode,
+            'size': img.size,
+            'animated': is_animated(img),
+            'bytes': size,
+        }
+
+
+def read_headers(paths, readers=DEFAULT_READERS):
+    """
+    并行读取文件头
+
+    Returns:
+        (成功读取的 [(路径, 文件头信息)], 无法读取的 [(路径, 错误信息)])
+    """
+    def read(path):
+        try:
+            return path, read_header(path), None
+        except Exception as e:
+            return path, None, str(e)
+
+    headers, errors = [], []
+    with ThreadPoolExecutor(max_workers=max(1, readers)) as executor:
+        for path, header, error in executor.map(read, paths):
+            if header is None:
+                errors.append((path, error))
+            else:
+                headers.append((path, header))
+    return headers, errors
+
+
+def fit_cost(samples):
+    """
+    按样本拟合单张耗时 = 固定开销 + 每百万像素耗时 × 百万像素数（最小二乘）
+
+    Args:
+        samples: [(百万像素数, 耗时秒数)]
+
+    Returns:
+        (固定开销秒数, 每百万像素秒数)；样本尺寸相同或拟合结果为负时只按像素数比例估算
+    """
+    if not samples:
+        return 0.0, 0.0
+    count = len(samples)
+    mean_x = sum(x for x, _ in samples) / count
+    mean_y = sum(y for _, y in samples) / count
+    var_x = sum((x - mean_x) ** 2 for x, _ in samples)
+    if var_x > 0:
+        slope = sum((x - mean_x) * (y - mean_y) for x, y in samples) / var_x
+        intercept = mean_y - slope * mean_x
+        if slope >= 0 and intercept >= 0:
+            return intercept, slope
+    total_x = sum(x for x, _ in samples)
+    if total_x <= 0:
+        return mean_y, 0.0
+    return 0.0, sum(y for _, y in samples) / total_x
+
+
+def pick_samples(records, sample_size):
+    """
+    抽取实测样本
+
+    各输出格式的编码耗时和压缩率相差很大，样本按输出格式的文件数比例分配（每种格式至少一个）；
+    同一格式内按像素数排序后等间隔抽取，覆盖从最小到最大的图片
+    """
+    if sample_size <= 0 or not records:
+        return []
+    groups = {}
+    for record in records:
+        groups.setdefault(record[1]['output_format'], []).append(record)
+    samples = []
+    for group in groups.values():
+        count = max(1, round(sample_size * len(group) / len(records)))
+        samples.extend(_spread(group, count))
+    return samples
+
+
+def _spread(records, sample_size):
+    """按像素数排序后等间隔抽取"""
+    ordered = sorted(records, key=lambda record: record[1]['size'][0] * record[1]['size'][1])
+    if sample_size >= len(ordered):
+        return ordered
+    if sample_size == 1:
+        return [ordered[len(ordered) // 2]]
+    step = (len(ordered) - 1) / (sample_size - 1)
+    indexes = sorted({round(i * step) for i in range(sample_size)})
+    return [ordered[i] for i in indexes]
+
+
+def pending_files(processor, image_files, input_path, output_path, watermark_path, options,
+                  batch, manifest_name=MANIFEST_FILENAME, journal_name=JOURNAL_FILENAME):
+    """
+    按与 batch_process 相同的规则（WatermarkProcessor.iter_pending_files）过滤掉会被跳过的
+    文件；只读，不修改处理清单和日志
+
+    Returns:
+        list: 需要处理的文件
+    """
+    fingerprint = processor.settings_fingerprint(watermark_path, options)
+    journal = None
+    if batch.resume:
+        journal = BatchJournal(output_path, input_path, fingerprint, filename=journal_name)
+        if not journal.load():
+            journal = None
+    opened = []
+    try:
+        return list(processor.iter_pending_files(
+            image_files, input_path, output_path, watermark_path, options, fingerprint, batch,
+            manifest_name, journal=journal, opened=opened
+        ))
+    finally:
+        for manifest in opened:
+            manifest.close()
+
+
+def calibrate(processor, samples, watermark_path, options):
+    """
+    对样本实际添加水印（输出到临时目录后删除）
+
+    第一张样本先处理一次预热（加载水印），不计入耗时
+
+    Returns:
+        (成功的 [{'file', 'megapixels', 'seconds', 'output_bytes'}], 错误列表)
+    """
+    results, errors = [], []
+    with tempfile.TemporaryDirectory(prefix='watermark_plan_') as temp_dir:
+        for index, (path, header) in enumerate(samples):
+            output_file = os.path.join(temp_dir, f"sample{index}{Path(path).suffix}")
+            try:
+                if index == 0:
+                    processor.add_watermark(str(path), watermark_path, output_file, **options)
+                start = time.perf_counter()
+                processor.add_watermark(str(path), watermark_path, output_file, **options)
+                seconds = time.perf_counter() - start
+                actual_output = output_path_for(output_file, options['output_format'])
+                results.append({
+                    'file': str(path),
+                    'output_format': header['output_format'],
+                    'megapixels': round(header['size'][0] * header['size'][1] / 1e6, 3),
+                    'seconds': round(seconds, 4),
+                    'output_bytes': os.path.getsize(actual_output),
+                })
+            except Exception as e:
+                errors.append(f"样本 {path} 处理出错: {e}")
+    return results, errors
+
+
+def estimate(headers, samples, workers=None):
+    """
+    按样本估算总耗时和输出大小：每种输出格式分别拟合，没有成功样本的格式使用全部样本
+
+    Args:
+        headers: [(路径, 文件头信息)]，文件头信息包含 output_format
+        samples: calibrate 返回的样本结果
+        workers: 并行进程数
+    """
+    groups = {}
+    for _, header in headers:
+        group = groups.setdefault(header['output_format'], [0, 0])
+        group[0] += 1
+        group[1] += header['size'][0] * header['size'][1] / 1e6
+
+    per_format = {}
+    for format_name, (files, megapixels) in groups.items():
+        format_samples = [s for s in samples if s['output_format'] == format_name] or samples
+        overhead, per_megapixel = fit_cost([(s['megapixels'], s['seconds']) for s in format_samples])
+        sample_pixels = sum(s['megapixels'] for s in format_samples)
+        bytes_per_megapixel = sum(s['output_bytes'] for s in format_samples) / sample_pixels \
+            if sample_pixels > 0 else 0.0
+        per_format[format_name] = {
+            'files': files,
+            'megapixels': round(megapixels, 3),
+            'samples': len(format_samples),
+            'seconds_per_file': round(overhead, 4),
+            'seconds_per_megapixel': round(per_megapixel, 4),
+            'cpu_seconds': round(overhead * files + per_megapixel * megapixels, 1),
+            'output_bytes': int(bytes_per_megapixel * megapixels),
+        }
+
+    cpu_seconds = sum(item['cpu_seconds'] for item in per_format.values())
+    workers = max(1, min(workers or os.cpu_count() or 1, len(headers) or 1))
+    return {
+        'cpu_seconds': round(cpu_seconds, 1),
+        'workers': workers,
+        'wall_seconds': round(cpu_seconds / workers, 1),
+        'output_bytes': sum(item['output_bytes'] for item in per_format.values()),
+        'per_format': per_format,
+    }
+
+
+def plan_batch(processor, input_dir, watermark_path, output_dir, position='bottom_right',
+               opacity=0.7, scale=0.1, options=None, header_readers=DEFAULT_READERS,
+               sample_size=DEFAULT_SAMPLE_SIZE, top=DEFAULT_TOP, **settings):
+    """
+    预估一次批量处理（参数同 batch_process），不写输出目录
+
+    Args:
+        options: 处理选项（watermark_options.BatchOptions）；按其中的 parallel / pipeline 和
+            workers 估算耗时（两者都未启用时按顺序处理估算）
+        settings: 逐项覆盖 options 中的设置
+        header_readers: 读取文件头的线程数
+        sample_size: 实测添加水印的样本数，0 表示不实测（不估算耗时和输出大小）
+        top: 列出的最大图片数
+
+    Returns:
+        dict: 预估结果
+    """
+    batch = options.replace(**settings) if options is not None else BatchOptions(**settings)
+    start = time.perf_counter()
+    input_path = Path(input_dir)
+    output_path = Path(output_dir)
+    options = processor.watermark_options(position, opacity, scale, batch.encoder,
+                                          batch.output_format, batch.tile_spacing,
+                                          batch.tile_angle)
+
+    image_files, manifest_name, journal_name = processor.batch_files(input_path, output_path,
+                                                                     batch)
+    image_files = list(image_files)
+    scan_time = time.perf_counter() - start
+
+    pending = pending_files(processor, image_files, input_path, output_path, watermark_path,
+                            options, batch, manifest_name, journal_name)
+
+    header_start = time.perf_counter()
+    headers, unreadable = read_headers(pending, header_readers)
+    header_time = time.perf_counter() - header_start
+
+    formats = Counter()
+    output_formats = Counter()
+    modes = Counter()
+    total_pixels = 0
+    total_bytes = 0
+    animated = 0
+    for path, header in headers:
+        header['output_format'] = format_for_path(output_path_for(path, batch.output_format))
+        formats[header['format']] += 1
+        output_formats[header['output_format']] += 1
+        modes[header['mode']] += 1
+        total_pixels += header['size'][0] * header['size'][1]
+        total_bytes += header['bytes']
+        animated += header['animated']
+    largest = heapq.nlargest(top, headers,
+                             key=lambda record: record[1]['size'][0] * record[1]['size'][1])
+
+    plan = {
+        'input_dir': str(input_dir),
+        'output_dir': str(output_dir),
+        'discovered': len(image_files),
+        'skipped': len(image_files) - len(pending),
+        'to_process': len(pending),
+        'unreadable': len(unreadable),
+        'unreadable_files': [f"{path}: {error}" for path, error in unreadable[:top]],
+        'formats': dict(formats.most_common()),
+        'output_formats': dict(output_formats.most_common()),
+        'modes': dict(modes.most_common()),
+        'animated': animated,
+        'total_megapixels': round(total_pixels / 1e6, 3),
+        'input_bytes': total_bytes,
+        'largest': [
+            {'file': str(path), 'size': list(header['size']),
+             'megapixels': round(header['size'][0] * header['size'][1] / 1e6, 3)}
+            for path, header in largest
+        ],
+        'scan_time': round(scan_time, 3),
+        'header_time': round(header_time, 3),
+    }
+    if batch.shard_count > 1:
+        plan['shard'] = {'index': batch.shard_index, 'count': batch.shard_count}
+
+    # 按样本实测估算耗时和输出大小
+    samples, sample_errors = calibrate(processor, pick_samples(headers, sample_size),
+                                       watermark_path, options)
+    plan['samples'] = samples
+    plan['sample_errors'] = sample_errors
+    if samples:
+        workers = batch.workers if batch.parallel or batch.pipeline else 1
+        plan['estimate'] = estimate(headers, samples, workers)
+    plan['plan_time'] = round(time.perf_counter() - start, 3)
+    return plan
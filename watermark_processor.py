@@ -5,16 +5,130 @@
 负责图片水印的添加、位置计算、透明度处理等功能
 """
 
-from PIL import Image, ImageEnhance
+from PIL import Image, ImageEnhance, UnidentifiedImageError
+import contextlib
+import io
 import os
 import tempfile
+from collections import OrderedDict
 from pathlib import Path
 
+from watermark_cache import WatermarkCache, estimate_image_bytes
+from watermark_encoder import (resolve_profile, output_path_for, format_for_path, save_image,
+                               FORMAT_NAMES)
+from watermark_animation import (ANIMATED_FORMATS, is_animated, iter_frames, composite_rgba,
+                                 save_animation)
+from watermark_manifest import (ProcessedManifest, MANIFEST_FILENAME, manifest_exists,
+                                settings_fingerprint)
+from watermark_stats import StageTimer, NULL_TIMER, BatchStats, JsonLinesLog
+from watermark_strips import (DEFAULT_STRIP_ROWS, STRIP_MIN_PIXELS, can_process_in_strips,
+                              strip_bytes, watermark_in_strips)
+from watermark_tiling import (TILED_POSITION, DEFAULT_TILE_SPACING, DEFAULT_TILE_ANGLE,
+                              validate_tiling, render_tiled_overlay)
+from watermark_text import TextWatermark
+from watermark_atomic import DirectoryCache, atomic_output, remove_temp_files
+from watermark_journal import BatchJournal, JOURNAL_FILENAME
+from watermark_shard import validate_shard, shard_filename, iter_shard
+from watermark_archive import (ArchiveWriter, DEFAULT_MAX_MEMBER_BYTES, archive_suffix,
+                               default_archive_output, iter_members, member_output_name)
+from watermark_dedup import Deduplicator, materialize
+from watermark_options import BatchOptions
+from watermark_renditions import (normalize_renditions, describe_renditions, rendition_output,
+                                  fit_size)
+
+# 输出目录名，扫描源目录时需要排除
+WATERMARKED_DIR_NAMES = ('watermarked', 'watermarked_new')
+
+# 预览样图缓存数量
+PREVIEW_SAMPLE_CACHE_SIZE = 4
+
+def apply_max_image_pixels(limit):
+    """
+    设置 Pillow 的解压炸弹保护像素上限（Image.MAX_IMAGE_PIXELS，进程内全局生效）
+    
+    只在程序入口（如命令行）调用，并行工作进程按主进程的设置初始化；处理器本身不修改该设置
+    
+    Args:
+        limit: 像素上限，0 表示不限制，为空时保持不变
+    """
+    if limit is not None:
+        Image.MAX_IMAGE_PIXELS = limit or None
+
+def check_source(input_path):
+    """检查输入文件是否存在"""
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"输入文件不存在: {input_path}")
+
+def read_source(input_path):
+    """
+    读取源文件内容（流水线的读取阶段），出错时的提示与 add_watermark 相同
+    
+    Returns:
+        bytes: 文件内容
+    """
+    try:
+        check_source(input_path)
+        with open(input_path, 'rb') as f:
+            return f.read()
+    except Exception as e:
+        raise Exception(f"添加水印时出错: {str(e)}")
+
+def unidentified_message(source_name=None):
+    """
+    无法识别的图片数据的提示：有源文件名时与按路径打开文件时 Pillow 的提示相同，
+    否则不显示内存对象
+    """
+    if source_name is None:
+        return "无法识别的图片数据"
+    return f"cannot identify image file {os.fspath(source_name)!r}"
+
+class AllocationTracker:
+    """单张图片处理过程中的图片缓冲区内存统计（不含缓存共享的水印叠加层）"""
+    
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+    
+    def alloc(self, img):
+        """记录新分配的图片缓冲区，返回图片本身"""
+        self.current += estimate_image_bytes(img)
+        self.peak = max(self.peak, self.current)
+        return img
+    
+    def free(self, img):
+        """记录释放的图片缓冲区"""
+        self.current -= estimate_image_bytes(img)
+
 class WatermarkProcessor:
     """水印处理器"""
     
-    def __init__(self):
-        self.supported_formats = {'.jpg', '.jpeg', '.png', '.bmp', '.gif'}
+    def __init__(self, cache_max_bytes=64 * 1024 * 1024, stats_hook=None,
+                 max_image_pixels=None, strip_min_pixels=STRIP_MIN_PIXELS,
+                 strip_rows=DEFAULT_STRIP_ROWS):
+        """
+        Args:
+            cache_max_bytes: 水印叠加层缓存的内存上限（字节）
+            stats_hook: 统计回调 hook(record)，批量处理时每个文件处理完成后调用，
+                record 为 StageTimer.record 生成的分阶段耗时和字节数记录
+            max_image_pixels: 本处理器的单张图片像素上限，打开图片后按文件头中的尺寸检查，
+                超过时报错；0 或为空时不另加限制。不修改 Pillow 的进程内上限
+                （Image.MAX_IMAGE_PIXELS），需要处理超过该上限的图片时在程序入口调用
+                apply_max_image_pixels
+            strip_min_pixels: 超过该像素数且格式允许（未压缩 BMP 输出为 BMP）时分条处理
+            strip_rows: 分条处理时每个条带的行数
+        """
+        self.supported_formats = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp'}
+        self.watermark_cache = WatermarkCache(max_bytes=cache_max_bytes)
+        self.stats_hook = stats_hook
+        self.last_pipeline_metrics = None
+        self.last_dedup_stats = None
+        self.last_skip_stats = None
+        self.max_image_pixels = max_image_pixels
+        self.strip_min_pixels = strip_min_pixels
+        self.strip_rows = strip_rows
+        self._directories = DirectoryCache()  # 已创建的输出目录，每个目录只创建一次
+        self.last_image_stats = {}
+        self._preview_samples = OrderedDict()  # 预览样图缓存
     
     def is_supported_format(self, file_path):
         """检查文件格式是否支持"""
@@ -35,16 +149,16 @@ class WatermarkProcessor:
         
         return positions.get(position, positions['bottom_right'])
     
-    def resize_watermark(self, watermark_img, base_img, scale_factor):
-        """调整水印大小"""
-        base_width, base_height = base_img.size
+    def calculate_watermark_size(self, watermark_size, base_size, scale_factor):
+        """计算水印缩放后的尺寸"""
+        base_width, base_height = base_size
         
         # 计算新的水印尺寸
         max_dimension = max(base_width, base_height)
         new_size = int(max_dimension * scale_factor)
         
         # 保持水印的宽高比
-        watermark_width, watermark_height = watermark_img.size
+        watermark_width, watermark_height = watermark_size
         if watermark_width > watermark_height:
             new_width = new_size
             new_height = int((new_size * watermark_height) / watermark_width)
@@ -52,7 +166,12 @@ class WatermarkProcessor:
             new_height = new_size
             new_width = int((new_size * watermark_width) / watermark_height)
         
-        return watermark_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        return max(new_width, 1), max(new_height, 1)
+    
+    def resize_watermark(self, watermark_img, base_img, scale_factor):
+        """调整水印大小"""
+        new_size = self.calculate_watermark_size(watermark_img.size, base_img.size, scale_factor)
+        return watermark_img.resize(new_size, Image.Resampling.LANCZOS)
     
     def apply_opacity(self, watermark_img, opacity):
         """应用透明度"""
@@ -66,84 +185,722 @@ class WatermarkProcessor:
         
         return watermark_img
     
+    def prepare_watermark(self, watermark_path, base_size, scale, opacity, timer=NULL_TIMER):
+        """
+        获取已缩放并应用透明度的水印叠加层（带缓存）
+        
+        Args:
+            watermark_path: 水印图片路径，或文字已确定的文字水印（TextWatermark）
+            base_size: 基础图片尺寸 (宽, 高)
+            scale: 水印缩放比例
+            opacity: 透明度
+            timer: 分阶段计时器，缓存未命中时统计 resize 和 opacity 阶段
+            
+        Returns:
+            RGBA 模式的水印图片（缓存共享，调用方不得修改）
+        """
+        if isinstance(watermark_path, TextWatermark):
+            return self.prepare_text_watermark(watermark_path, base_size, scale, opacity, timer)
+        
+        signature, source = self.watermark_cache.get_source(watermark_path)
+        target_size = self.calculate_watermark_size(source.size, base_size, scale)
+        key = (os.path.abspath(watermark_path), signature, target_size, round(opacity, 4))
+        
+        def build():
+            with timer.stage('resize'):
+                resized = source.resize(target_size, Image.Resampling.LANCZOS)
+            with timer.stage('opacity'):
+                return self.apply_opacity(resized, opacity)
+        
+        return self.watermark_cache.get_overlay(key, build)
+    
+    def prepare_text_watermark(self, text_watermark, base_size, scale, opacity,
+                               timer=NULL_TIMER):
+        """
+        获取已渲染并应用透明度的文字水印（带缓存）
+        
+        按 (文字, 字体, 字号, 样式, 透明度) 缓存，字号由图片最大边和缩放比例决定，
+        批量处理中同样的文字在同尺寸的图片上只渲染一次
+        
+        Args:
+            text_watermark: 文字已确定的文字水印（模板需先调用 resolve 填充）
+            timer: 分阶段计时器，缓存未命中时统计 text 和 opacity 阶段
+            
+        Returns:
+            RGBA 模式的文字图片（缓存共享，调用方不得修改）
+        """
+        if text_watermark.is_template:
+            raise ValueError(f"文字水印模板尚未填充: {text_watermark.text}")
+        pixel_size = text_watermark.pixel_size(base_size, scale)
+        key = text_watermark.cache_key() + (pixel_size, round(opacity, 4))
+        
+        def build():
+            with timer.stage('text'):
+                layer = text_watermark.render(pixel_size)
+            with timer.stage('opacity'):
+                return self.apply_opacity(layer, opacity)
+        
+        return self.watermark_cache.get_overlay(key, build)
+    
+    def resolve_watermark(self, watermark_path, source_path=None, img=None):
+        """
+        确定单张图片使用的水印：水印文件路径原样返回，文字水印按图片填充模板
+        
+        Args:
+            watermark_path: 水印图片路径或 TextWatermark
+            source_path: 源图片路径（用于文件名等模板字段）
+            img: 已打开的源图片（用于拍摄日期等 EXIF 字段）
+        """
+        if isinstance(watermark_path, TextWatermark):
+            return watermark_path.resolve(source_path, img)
+        return watermark_path
+    
+    def _watermark_key(self, watermark_path):
+        """缓存键的前缀：水印文件为 (绝对路径, 文件签名)，文字水印为 (文字标记, 文字, 样式)"""
+        if isinstance(watermark_path, TextWatermark):
+            return watermark_path.cache_key()
+        signature, _ = self.watermark_cache.get_source(watermark_path)
+        return (os.path.abspath(watermark_path), signature)
+    
+    def prepare_tiled_watermark(self, watermark_path, base_size, scale, opacity,
+                                spacing=DEFAULT_TILE_SPACING, angle=DEFAULT_TILE_ANGLE,
+                                mode='RGBa', timer=NULL_TIMER):
+        """
+        获取整张图片大小的平铺水印叠加层（带缓存）
+        
+        同一尺寸、间距、角度、透明度和缩放比例的叠加层只生成一次，
+        批量处理中同尺寸的图片共用，每张图片只需一次合成。
+        默认以预乘透明度的 RGBa 模式缓存，粘贴时 Pillow 不必再逐像素乘以透明度，
+        合成耗时约为 RGBA 叠加层的一半。
+        叠加层与图片同尺寸，计入水印缓存的内存上限；单个叠加层超过上限（默认 64MB，
+        约 1600 万像素以上的图片）时不占用 LRU 缓存，而是单独保留最近使用的一个，
+        同尺寸的图片连续处理时仍只生成一次（见 WatermarkCache），配合 group_by_size 效果最好
+        
+        Args:
+            watermark_path: 水印图片路径，或文字已确定的文字水印
+            base_size: 基础图片尺寸 (宽, 高)
+            scale: 水印缩放比例
+            opacity: 透明度
+            spacing: 相邻水印之间的空白占水印尺寸的比例
+            angle: 水印旋转角度（度，逆时针）
+            mode: 叠加层模式，'RGBa' 用于 paste_watermark，'RGBA' 用于 alpha_composite
+            timer: 分阶段计时器，缓存未命中时统计 resize、opacity 和 tile 阶段
+            
+        Returns:
+            叠加层图片（缓存共享，调用方不得修改）
+        """
+        spacing, angle = validate_tiling(spacing, angle)
+        key = self._watermark_key(watermark_path) + (
+            TILED_POSITION, tuple(base_size), round(scale, 6), round(opacity, 4),
+            spacing, angle, mode
+        )
+        
+        def build():
+            mark = self.prepare_watermark(watermark_path, base_size, scale, opacity, timer)
+            with timer.stage('tile'):
+                overlay = render_tiled_overlay(mark, base_size, spacing, angle)
+                return overlay if mode == 'RGBA' else overlay.convert(mode)
+        
+        return self.watermark_cache.get_overlay(key, build)
+    
+    def watermark_overlay(self, watermark_path, base_size, position, scale, opacity,
+                          tiling=(DEFAULT_TILE_SPACING, DEFAULT_TILE_ANGLE), mode='RGBa',
+                          timer=NULL_TIMER):
+        """
+        获取水印叠加层及其粘贴位置
+        
+        Args:
+            tiling: 平铺时的 (间距, 角度)，position 为 'tiled' 时使用
+            mode: 平铺叠加层的模式（见 prepare_tiled_watermark），单个水印总是 RGBA
+            
+        Returns:
+            (叠加层, 左上角坐标)
+        """
+        if position == TILED_POSITION:
+            overlay = self.prepare_tiled_watermark(watermark_path, base_size, scale, opacity,
+                                                   *tiling, mode=mode, timer=timer)
+            return overlay, (0, 0)
+        
+        overlay = self.prepare_watermark(watermark_path, base_size, scale, opacity, timer)
+        return overlay, self.calculate_watermark_position(base_size, overlay.size, position)
+    
+    def resolve_output_dir(self, source_dir, output_mode='watermarked', custom_dir=None):
+        """
+        根据输出模式获取实际输出目录
+        
+        Args:
+            source_dir: 源目录路径
+            output_mode: 输出模式 ('watermarked', 'watermarked_new', 'custom')
+            custom_dir: 自定义输出目录（custom 模式必填）
+            
+        Returns:
+            str: 输出目录路径
+        """
+        source_path = Path(source_dir)
+        if output_mode in WATERMARKED_DIR_NAMES:
+            return str(source_path / output_mode)
+        if output_mode == 'custom':
+            if not custom_dir:
+                raise ValueError("custom 输出模式需要指定输出目录")
+            return str(custom_dir)
+        raise ValueError(f"不支持的输出模式: {output_mode}")
+    
+    def worker_kwargs(self):
+        """获取在工作进程中创建相同配置处理器所需的参数"""
+        return {
+            'cache_max_bytes': self.watermark_cache.max_bytes,
+            'max_image_pixels': self.max_image_pixels,
+            'strip_min_pixels': self.strip_min_pixels,
+            'strip_rows': self.strip_rows,
+        }
+    
+    def use_strips(self, img, format_name):
+        """判断打开的图片是否分条处理"""
+        width, height = img.size
+        return width * height >= self.strip_min_pixels and can_process_in_strips(img, format_name)
+    
+    def _can_use_strips(self, img, format_name, composite_mode, position):
+        # 平铺水印的叠加层与整张图片同样大，分条处理没有意义
+        return (composite_mode == 'region' and position != TILED_POSITION
+                and self.use_strips(img, format_name))
+    
+    def estimate_memory(self, input_path, output_format='keep', animated=True,
+                        composite_mode='region', position='bottom_right', **_):
+        """
+        只读取文件头，估算处理该图片时的内存峰值（字节）
+        
+        Args:
+            input_path: 输入图片路径
+            output_format: 输出格式
+            animated: 是否逐帧处理动图
+            composite_mode: 合成方式
+            position: 水印位置，平铺时另计整张图片大小的叠加层
+            其余 add_watermark 参数被忽略，便于直接传入批量处理的水印设置
+        """
+        format_name = format_for_path(output_path_for(input_path, output_format))
+        with Image.open(input_path) as img:
+            width, height = img.size
+            rgba_bytes = width * height * 4
+            overlay = rgba_bytes if position == TILED_POSITION else 0
+            if animated and is_animated(img) and format_name in ANIMATED_FORMATS:
+                # GIF 流式写出只保留相邻两帧，其他格式保留全部帧
+                frames = 2 if format_name == 'GIF' else getattr(img, 'n_frames', 1)
+                return estimate_image_bytes(img) + rgba_bytes * frames + overlay
+            if self._can_use_strips(img, format_name, composite_mode, position):
+                return strip_bytes(img.size, self.strip_rows)
+            # 解码后的图片 + 转换出的 RGB 图片（RGB 源图片无需转换）
+            converted = 0 if img.mode == 'RGB' else rgba_bytes
+            copied = rgba_bytes if composite_mode == 'full' else 0
+            return estimate_image_bytes(img) + converted + copied + overlay
+    
+    def get_cache_stats(self):
+        """获取水印缓存统计（命中/未命中次数等）"""
+        return self.watermark_cache.stats()
+    
     def add_watermark(self, input_path, watermark_path, output_path, position='bottom_right', 
-                     opacity=0.7, scale=0.1):
+                     opacity=0.7, scale=0.1, composite_mode='region', encoder='default',
+                     output_format='keep', animated=True, tile_spacing=DEFAULT_TILE_SPACING,
+                     tile_angle=DEFAULT_TILE_ANGLE, timer=None):
         """
         添加水印到图片
         
         Args:
             input_path: 输入图片路径
-            watermark_path: 水印图片路径
+            watermark_path: 水印图片路径，或文字水印（watermark_text.TextWatermark）
             output_path: 输出图片路径
-            position: 水印位置 ('top_left', 'top_right', 'bottom_left', 'bottom_right', 'center')
+            position: 水印位置 ('top_left', 'top_right', 'bottom_left', 'bottom_right', 'center'，
+                或 'tiled' 旋转后错行平铺满整张图片)
             opacity: 透明度 (0.0-1.0)
             scale: 水印缩放比例 (0.0-1.0)
+            composite_mode: 合成方式，'region' 直接在解码后的图片上只混合水印所在区域；
+                'full' 为旧方式，先复制整张图片再粘贴水印
+            encoder: 编码配置名称（'default', 'fast', 'balanced', 'archival'）或覆盖参数字典
+            output_format: 输出格式（'keep' 按输出文件扩展名保持格式，或 'jpeg', 'png', 'webp'，
+                此时输出文件扩展名会被替换）
+            animated: 源图片为动图（GIF、APNG、WebP）且输出格式支持动图时，是否逐帧添加水印；
+                为 False 或输出格式不支持动图时只处理第一帧
+            tile_spacing: 平铺时相邻水印之间的空白占水印尺寸的比例
+            tile_angle: 平铺时水印的旋转角度（度，逆时针）
+            timer: 分阶段计时器（watermark_stats.StageTimer），为空时不统计
+        
+        处理完成后可通过 last_image_stats 获取本张图片的实际输出路径、内存峰值等信息
         """
         try:
             # 检查文件是否存在
+            check_source(input_path)
+            
+            output_path = output_path_for(output_path, output_format)
+            timer = timer or NULL_TIMER
+            if timer.enabled:
+                timer.count('input_bytes', os.path.getsize(input_path))
+            
+            # 根据输出文件扩展名确定保存格式
+            self.last_image_stats = self._watermark_image(
+                input_path, watermark_path, output_path, format_for_path(output_path),
+                position, opacity, scale, composite_mode, encoder, animated,
+                (tile_spacing, tile_angle), timer
+            )
+            
+            if timer.enabled:
+                timer.count('output_bytes', os.path.getsize(output_path))
+            return True
+                    
+        except Exception as e:
+            raise Exception(f"添加水印时出错: {str(e)}")
+    
+    def watermark_bytes(self, data, watermark_path, format_name='JPEG', position='bottom_right',
+                        opacity=0.7, scale=0.1, composite_mode='region', encoder='default',
+                        animated=True, tile_spacing=DEFAULT_TILE_SPACING,
+                        tile_angle=DEFAULT_TILE_ANGLE, timer=None, source_name=None):
+        """
+        在内存中添加水印：输入编码后的图片数据，返回编码后的输出数据
+        
+        Args:
+            data: 输入图片的文件内容（bytes），或以二进制方式读取的文件对象
+            watermark_path: 水印图片路径或文字水印
+            format_name: 输出格式（Pillow 格式名，如 'JPEG', 'PNG', 'WEBP'，不区分大小写）；
+                为 'keep' 或 None 时与输入图片格式相同（输入格式不支持保存时使用 JPEG）
+            source_name: 源文件名或路径，用于文字水印模板中的文件名字段
+            其余参数同 add_watermark
+            
+        实际使用的输出格式可通过 last_image_stats['format'] 获取
+            
+        Returns:
+            bytes: 添加水印后的图片文件内容
+        """
+        try:
+            timer = timer or NULL_TIMER
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                source = io.BytesIO(data)
+            elif data.seekable():
+                source = data
+            else:
+                # 不可定位的流（如网络请求体）先读入内存，Pillow 需要回退读取文件头
+                source = io.BytesIO(data.read())
+            if timer.enabled:
+                start = source.tell()
+                timer.count('input_bytes', source.seek(0, io.SEEK_END) - start)
+                source.seek(start)
+            
+            format_name = self.negotiate_format(source, format_name)
+            output = io.BytesIO()
+            self.last_image_stats = self._watermark_image(
+                source, watermark_path, output, format_name,
+                position, opacity, scale, composite_mode, encoder, animated,
+                (tile_spacing, tile_angle), timer, source_name
+            )
+            self.last_image_stats['format'] = format_name
+            result = output.getvalue()
+            
+            if timer.enabled:
+                timer.count('output_bytes', len(result))
+            return result
+            
+        except UnidentifiedImageError:
+            raise Exception(f"添加水印时出错: {unidentified_message(source_name)}")
+        except Exception as e:
+            raise Exception(f"添加水印时出错: {str(e)}")
+    
+    def negotiate_format(self, source, format_name=None):
+        """
+        确定内存处理的输出格式
+        
+        Args:
+            source: 输入图片的二进制文件对象（读取文件头后回到原位置）
+            format_name: 请求的格式；'keep' 或 None 表示与输入格式相同
+            
+        Returns:
+            str: Pillow 格式名
+        """
+        Image.init()  # 确保已注册全部格式插件（Image.SAVE 按需填充）
+        if format_name and format_name.lower() != 'keep':
+            format_name = FORMAT_NAMES.get(format_name.lower(), format_name.upper())
+            if format_name not in Image.SAVE:
+                raise ValueError(f"不支持的输出格式: {format_name}")
+            return format_name
+        
+        position = source.tell()
+        try:
+            with Image.open(source) as img:
+                source_format = img.format
+        finally:
+            source.seek(position)
+        return source_format if source_format in Image.SAVE else 'JPEG'
+    
+    def add_watermark_renditions(self, input_path, outputs, timer=None):
+        """
+        一次解码生成多个输出规格的图片（如原尺寸、网页尺寸和缩略图，或不同客户的不同水印）
+        
+        源图片只解码一次；输出按尺寸从大到小生成，较小的尺寸由上一个较大尺寸的（未加水印的）
+        中间图片缩小得到，不从原图重复缩小；所有输出都小于原图时，JPEG 直接按最大的输出尺寸
+        缩小解码。动图在输出格式支持动图且不需要缩小时按 add_watermark 逐帧处理（重新读取
+        源文件），需要缩小或输出格式不支持动图时只处理第一帧
+        
+        Args:
+            input_path: 输入图片路径
+            outputs: [(输出路径, 输出规格)]，输出路径已按规格的输出格式确定扩展名，
+                输出规格见 watermark_renditions.normalize_renditions
+            timer: 分阶段计时器（watermark_stats.StageTimer），为空时不统计
+        
+        处理完成后可通过 last_image_stats 获取全部输出路径、内存峰值等信息
+        
+        Returns:
+            list: 输出路径（与 outputs 顺序相同）
+        """
+        try:
             if not os.path.exists(input_path):
                 raise FileNotFoundError(f"输入文件不存在: {input_path}")
+            timer = timer or NULL_TIMER
+            if timer.enabled:
+                timer.count('input_bytes', os.path.getsize(input_path))
+            
+            tracker = AllocationTracker()
+            output_paths = [str(path) for path, _ in outputs]
+            animated_outputs = []  # 按动图单独处理的 (输出路径, 规格)
+            pending = []  # (输出路径, 规格, 解析后的水印, 输出尺寸)
             
-            if not os.path.exists(watermark_path):
-                raise FileNotFoundError(f"水印文件不存在: {watermark_path}")
-            
-            # 打开基础图片
-            with Image.open(input_path) as base_img:
-                # 转换为RGB模式（如果需要）
-                if base_img.mode in ('RGBA', 'LA'):
-                    background = Image.new('RGB', base_img.size, (255, 255, 255))
-                    if base_img.mode == 'RGBA':
-                        background.paste(base_img, mask=base_img.split()[-1])
-                    else:
-                        background.paste(base_img, mask=base_img.split()[-1])
-                    base_img = background
-                elif base_img.mode != 'RGB':
-                    base_img = base_img.convert('RGB')
+            with timer.stage('open'):
+                source_img = Image.open(input_path)
+            with source_img:
+                self._check_image_pixels(source_img)
+                size = source_img.size
+                animated = is_animated(source_img)
+                for path, (_, spec) in zip(output_paths, outputs):
+                    self._check_watermark(spec['watermark'])
+                    target = fit_size(size, spec['max_size'])
+                    if animated and target == size and format_for_path(path) in ANIMATED_FORMATS:
+                        animated_outputs.append((path, spec))
+                        continue
+                    # 文字水印按本张图片填充模板（文件名、拍摄日期等）
+                    watermark = self.resolve_watermark(spec['watermark'], input_path, source_img)
+                    pending.append((path, spec, watermark, target))
                 
-                # 打开水印图片
-                with Image.open(watermark_path) as watermark_img:
-                    # 调整水印大小
-                    watermark_resized = self.resize_watermark(watermark_img, base_img, scale)
-                    
-                    # 应用透明度
-                    watermark_with_opacity = self.apply_opacity(watermark_resized, opacity)
-                    
-                    # 计算水印位置
-                    position_coords = self.calculate_watermark_position(
-                        base_img.size, 
-                        watermark_with_opacity.size, 
-                        position
-                    )
-                    
-                    # 创建结果图片
-                    result_img = base_img.copy()
-                    
-                    # 粘贴水印
-                    if watermark_with_opacity.mode == 'RGBA':
-                        result_img.paste(watermark_with_opacity, position_coords, watermark_with_opacity)
-                    else:
-                        result_img.paste(watermark_with_opacity, position_coords)
-                    
-                    # 确保输出目录存在
-                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-                    
-                    # 保存结果
-                    # 根据输出文件扩展名确定保存格式
-                    output_ext = Path(output_path).suffix.lower()
-                    if output_ext in ['.jpg', '.jpeg']:
-                        result_img.save(output_path, 'JPEG', quality=95, optimize=True)
-                    elif output_ext == '.png':
-                        result_img.save(output_path, 'PNG', optimize=True)
-                    else:
-                        # 默认保存为JPEG
-                        if not output_ext:
-                            output_path = output_path + '.jpg'
-                        result_img.save(output_path, 'JPEG', quality=95, optimize=True)
-                    
-                    return True
-                    
+                if pending:
+                    pending.sort(key=lambda item: item[3][0] * item[3][1], reverse=True)
+                    largest = pending[0][3]
+                    if source_img.format == 'JPEG' and largest != size:
+                        # JPEG 可按 1/2、1/4、1/8 缩小解码（结果不小于最大的输出尺寸）
+                        source_img.draft(source_img.mode, largest)
+                    with timer.stage('decode'):
+                        source_img.load()
+                    with timer.stage('convert'):
+                        base_img = self.convert_to_rgb(source_img, tracker)
+                    self._write_renditions(base_img, pending, tracker, timer)
+            
+            for path, spec in animated_outputs:
+                self._watermark_image(
+                    input_path, spec['watermark'], path, format_for_path(path), spec['position'],
+                    spec['opacity'], spec['scale'], 'region', spec['encoder'], True,
+                    (spec['tile_spacing'], spec['tile_angle']), timer
+                )
+            
+            if timer.enabled:
+                for path in output_paths:
+                    timer.count('output_bytes', os.path.getsize(path))
+            self.last_image_stats = {
+                'output_path': output_paths[0],
+                'output_paths': output_paths,
+                'size': size,
+                'composite_mode': 'renditions',
+                'renditions': len(output_paths),
+                'peak_bytes': tracker.peak,
+            }
+            return output_paths
+            
         except Exception as e:
-            raise Exception(f"添加水印时出错: {str(e)}")
+            raise Exception(f"生成多规格输出时出错: {str(e)}")
+    
+    def _write_renditions(self, base_img, pending, tracker, timer):
+        """按尺寸从大到小依次缩小、添加水印并写出（pending 已按尺寸从大到小排序）"""
+        clean_img = base_img  # 当前尺寸未加水印的图片
+        for index, (path, spec, watermark, target) in enumerate(pending):
+            if clean_img.size != target:
+                with timer.stage('downscale'):
+                    clean_img = self._downscale(clean_img, target, tracker)
+            following = pending[index + 1][3] if index + 1 < len(pending) else None
+            if following == target:
+                # 下一个输出尺寸相同，仍需要未加水印的图片
+                result_img = tracker.alloc(clean_img.copy())
+            else:
+                result_img = clean_img
+                if following is not None:
+                    # 加水印之前先缩小出下一个尺寸
+                    with timer.stage('downscale'):
+                        clean_img = self._downscale(clean_img, following, tracker)
+            
+            overlay, position_coords = self.watermark_overlay(
+                watermark, result_img.size, spec['position'], spec['scale'], spec['opacity'],
+                (spec['tile_spacing'], spec['tile_angle']), timer=timer
+            )
+            with timer.stage('paste'):
+                self.paste_watermark(result_img, overlay, position_coords)
+            with self._open_output(path) as fp, timer.stage('save'):
+                save_image(result_img, fp, format_for_path(path), resolve_profile(spec['encoder']))
+            if timer.enabled:
+                timer.count('pixels', result_img.size[0] * result_img.size[1])
+            if result_img is not base_img:
+                tracker.free(result_img)
+    
+    def _downscale(self, img, size, tracker):
+        """缩小图片（大比例缩小时先按整数倍快速缩小再精细重采样）"""
+        return tracker.alloc(img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0))
+    
+    def _watermark_image(self, source, watermark_path, output, format_name, position, opacity,
+                         scale, composite_mode, encoder, animated, tiling, timer,
+                         source_name=None):
+        """
+        添加水印的核心流程
+        
+        Args:
+            source: 输入图片路径或二进制文件对象
+            output: 输出图片路径或二进制文件对象
+            format_name: 输出格式（Pillow 格式名）
+            tiling: 平铺参数 (tile_spacing, tile_angle)
+            source_name: 输入为文件对象时的源文件名（用于文字水印模板）
+            其余参数同 add_watermark
+            
+        Returns:
+            dict: 本张图片的处理信息（输出路径、尺寸、合成方式、内存峰值等）
+        """
+        self._check_watermark(watermark_path)
+        
+        if composite_mode not in ('region', 'full'):
+            raise ValueError(f"不支持的合成方式: {composite_mode}")
+        
+        if position == TILED_POSITION:
+            tiling = validate_tiling(*tiling)
+        
+        profile = resolve_profile(encoder)
+        output_path = output if isinstance(output, str) else None
+        tracker = AllocationTracker()
+        
+        # 打开基础图片
+        with timer.stage('open'):
+            source_img = Image.open(source)
+        with source_img:
+            self._check_image_pixels(source_img)
+            # 文字水印按本张图片填充模板（文件名、拍摄日期等）
+            watermark_path = self.resolve_watermark(
+                watermark_path, source if isinstance(source, str) else source_name, source_img
+            )
+            
+            # 动图逐帧处理
+            if animated and is_animated(source_img) and format_name in ANIMATED_FORMATS:
+                frame_count = self._add_watermark_animated(
+                    source_img, watermark_path, output, format_name,
+                    position, opacity, scale, tiling, profile, tracker, timer
+                )
+                if timer.enabled:
+                    timer.count('frames', frame_count)
+                    timer.count('pixels', source_img.size[0] * source_img.size[1] * frame_count)
+                return {
+                    'output_path': output_path,
+                    'size': source_img.size,
+                    'composite_mode': 'frames',
+                    'frames': frame_count,
+                    'peak_bytes': tracker.peak,
+                }
+            
+            # 超大图片在格式允许时分条处理，不整张解码
+            if self._can_use_strips(source_img, format_name, composite_mode, position):
+                strip_count = self._add_watermark_strips(
+                    source_img, watermark_path, output, position, opacity, scale,
+                    tracker, timer
+                )
+                if timer.enabled:
+                    timer.count('pixels', source_img.size[0] * source_img.size[1])
+                return {
+                    'output_path': output_path,
+                    'size': source_img.size,
+                    'composite_mode': 'strips',
+                    'strips': strip_count,
+                    'peak_bytes': tracker.peak,
+                }
+            
+            # 解码并转换为RGB模式（如果需要）
+            with timer.stage('decode'):
+                source_img.load()
+            with timer.stage('convert'):
+                base_img = self.convert_to_rgb(source_img, tracker)
+            
+            # 获取预处理好的水印（已缩放并应用透明度，来自缓存）及其位置；
+            # 平铺时为整张图片大小的叠加层，一次合成即可
+            watermark_with_opacity, position_coords = self.watermark_overlay(
+                watermark_path, base_img.size, position, scale, opacity, tiling, timer=timer
+            )
+            
+            with timer.stage('paste'):
+                # 创建结果图片：region 模式直接在基础图片上修改，不再整张复制
+                if composite_mode == 'full':
+                    result_img = tracker.alloc(base_img.copy())
+                else:
+                    result_img = base_img
+                
+                # 粘贴水印（只会改动水印覆盖的区域）
+                self.paste_watermark(result_img, watermark_with_opacity, position_coords)
+            
+            # 保存结果，按编码配置设置参数（写到路径时先写临时文件再改名）
+            with self._open_output(output) as fp, timer.stage('save'):
+                save_image(result_img, fp, format_name, profile)
+            
+            if timer.enabled:
+                timer.count('pixels', base_img.size[0] * base_img.size[1])
+            
+            return {
+                'output_path': output_path,
+                'size': base_img.size,
+                'composite_mode': composite_mode,
+                'peak_bytes': tracker.peak,
+            }
+    
+    def _check_image_pixels(self, img):
+        """按文件头中的尺寸检查单张图片的像素上限（解码之前）"""
+        pixels = img.size[0] * img.size[1]
+        if self.max_image_pixels and pixels > self.max_image_pixels:
+            raise Image.DecompressionBombError(
+                f"图片像素数 {pixels} 超过上限 {self.max_image_pixels}"
+            )
+    
+    def _check_watermark(self, watermark_path):
+        """检查水印文件是否存在（文字水印的字体在创建时已检查）"""
+        if isinstance(watermark_path, TextWatermark):
+            return
+        if not os.path.exists(watermark_path):
+            raise FileNotFoundError(f"水印文件不存在: {watermark_path}")
+    
+    def _open_output(self, output):
+        """
+        打开输出：为路径时以原子方式写出（所在目录只创建一次，写入临时文件，完成后改名），
+        为文件对象时直接使用
+        """
+        if isinstance(output, str):
+            return atomic_output(output, self._directories)
+        return contextlib.nullcontext(output)
+    
+    def _add_watermark_animated(self, source_img, watermark_path, output, format_name,
+                                position, opacity, scale, tiling, profile, tracker,
+                                timer=NULL_TIMER):
+        """
+        逐帧为动图添加水印并保存，同尺寸的帧共用同一个缓存的水印叠加层
+        
+        Returns:
+            int: 写出的帧数
+        """
+        # 只有 GIF 是流式写出，其他格式的帧会被编码器保留到最后
+        streaming = format_name == 'GIF'
+        
+        def render_frames():
+            previous = None
+            frames = iter_frames(source_img)
+            while True:
+                with timer.stage('decode'):
+                    item = next(frames, None)
+                if item is None:
+                    return
+                frame, duration, disposal = item
+                if previous is not None and streaming:
+                    tracker.free(previous)
+                with timer.stage('convert'):
+                    rgba_frame = tracker.alloc(frame.convert('RGBA'))
+                watermark_with_opacity, position_coords = self.watermark_overlay(
+                    watermark_path, rgba_frame.size, position, scale, opacity, tiling,
+                    mode='RGBA', timer=timer
+                )
+                with timer.stage('paste'):
+                    composite_rgba(rgba_frame, watermark_with_opacity, position_coords)
+                previous = rgba_frame
+                yield rgba_frame, duration, disposal
+        
+        # GIF 边生成边写出，帧的解码和合成耗时会从 save 阶段中扣除
+        with self._open_output(output) as fp, timer.stage('save'):
+            return save_animation(fp, format_name, render_frames(),
+                                  loop=source_img.info.get('loop'), profile=profile)
+    
+    def _add_watermark_strips(self, source_img, watermark_path, output, position,
+                              opacity, scale, tracker, timer=NULL_TIMER):
+        """
+        分条添加水印并保存为 BMP，内存中只保留当前条带和水印叠加层
+        
+        Returns:
+            int: 写出的条带数
+        """
+        watermark_with_opacity = self.prepare_watermark(
+            watermark_path, source_img.size, scale, opacity, timer
+        )
+        position_coords = self.calculate_watermark_position(
+            source_img.size, watermark_with_opacity.size, position
+        )
+        
+        def to_rgb(strip):
+            # 每个条带的源数据和转换结果在写出后即释放
+            strip_tracker = AllocationTracker()
+            rgb_strip = self.convert_to_rgb(strip, strip_tracker)
+            tracker.peak = max(tracker.peak, tracker.current + strip_tracker.peak)
+            return rgb_strip
+        
+        with self._open_output(output) as fp:
+            return watermark_in_strips(source_img, fp, watermark_with_opacity, position_coords,
+                                       to_rgb, self.strip_rows, timer)
+    
+    def convert_to_rgb(self, source_img, tracker=None):
+        """
+        将打开的图片解码并转换为 RGB 模式
+        
+        发生转换时会立即关闭原图以释放解码缓冲区
+        
+        Args:
+            source_img: Image.open 打开的图片
+            tracker: 内存占用统计（AllocationTracker），可为空
+            
+        Returns:
+            RGB 模式的图片
+        """
+        tracker = tracker or AllocationTracker()
+        source_img.load()
+        tracker.alloc(source_img)
+        
+        if source_img.mode == 'RGB':
+            return source_img
+        
+        if source_img.mode in ('RGBA', 'LA'):
+            # 直接用带透明通道的图片作为遮罩，避免拆分出各个通道
+            base_img = tracker.alloc(Image.new('RGB', source_img.size, (255, 255, 255)))
+            base_img.paste(source_img, mask=source_img)
+        else:
+            base_img = tracker.alloc(source_img.convert('RGB'))
+        
+        tracker.free(source_img)
+        source_img.close()
+        return base_img
+    
+    def paste_watermark(self, result_img, watermark_img, position_coords):
+        """将水印粘贴到图片上（原地修改，只混合水印覆盖的区域）"""
+        if watermark_img.mode in ('RGBA', 'RGBa'):
+            result_img.paste(watermark_img, position_coords, watermark_img)
+        else:
+            result_img.paste(watermark_img, position_coords)
+    
+    def group_by_size(self, image_files):
+        """
+        按图片尺寸分组排序（只读取文件头），同尺寸的图片连续处理，
+        共用同一个叠加层；无法读取的文件排在最后
+        
+        Returns:
+            list: 排序后的文件列表（同尺寸内保持原顺序）
+        """
+        sizes = {}
+        for path in image_files:
+            try:
+                with Image.open(path) as img:
+                    sizes[path] = img.size
+            except Exception:
+                sizes[path] = None
+        
+        groups = {}
+        for path, size in sizes.items():
+            groups.setdefault(size, []).append(path)
+        unreadable = groups.pop(None, [])
+        return [path for files in groups.values() for path in files] + unreadable
     
     def create_preview(self, input_path, watermark_path, position='bottom_right', 
                       opacity=0.7, scale=0.1):
@@ -174,23 +931,114 @@ class WatermarkProcessor:
         except Exception as e:
             raise Exception(f"创建预览时出错: {str(e)}")
     
+    def render_preview(self, input_path, watermark_path, position='bottom_right',
+                       opacity=0.7, scale=0.1, max_size=(1024, 768), as_bytes=False,
+                       tile_spacing=DEFAULT_TILE_SPACING, tile_angle=DEFAULT_TILE_ANGLE):
+        """
+        在内存中生成屏幕分辨率的预览图
+        
+        JPEG 通过 draft 直接按缩小比例解码，其他格式用 reduce 快速缩小；
+        缩小后的样图会被缓存，仅调整位置、透明度、大小时无需重新解码
+        
+        Args:
+            input_path: 输入图片路径
+            watermark_path: 水印图片路径或文字水印
+            position: 水印位置
+            opacity: 透明度
+            scale: 水印缩放比例（相对于图片最大边，预览中水印按比例缩小）
+            max_size: 预览图最大尺寸 (宽, 高)
+            as_bytes: 为 True 时返回 JPEG 编码后的字节串
+            tile_spacing: 平铺间距比例
+            tile_angle: 平铺旋转角度
+            
+        Returns:
+            PIL.Image 预览图，或 JPEG 字节串
+        """
+        try:
+            self._check_watermark(watermark_path)
+            
+            preview_img = self._get_preview_sample(input_path, tuple(max_size)).copy()
+            # 文字水印的模板按原图填充（拍摄日期从原图文件头读取）
+            watermark_path = self.resolve_watermark(watermark_path, input_path)
+            
+            watermark_with_opacity, position_coords = self.watermark_overlay(
+                watermark_path, preview_img.size, position, scale, opacity,
+                validate_tiling(tile_spacing, tile_angle)
+            )
+            self.paste_watermark(preview_img, watermark_with_opacity, position_coords)
+            
+            if as_bytes:
+                buffer = io.BytesIO()
+                preview_img.save(buffer, 'JPEG', quality=85)
+                return buffer.getvalue()
+            return preview_img
+            
+        except Exception as e:
+            raise Exception(f"创建预览时出错: {str(e)}")
+    
+    def _get_preview_sample(self, input_path, max_size):
+        """获取缩小解码后的样图（按文件签名和尺寸缓存）"""
+        stat = os.stat(input_path)
+        key = (os.path.abspath(input_path), stat.st_mtime_ns, stat.st_size, max_size)
+        
+        cached = self._preview_samples.get(key)
+        if cached is not None:
+            self._preview_samples.move_to_end(key)
+            return cached
+        
+        with Image.open(input_path) as img:
+            # thumbnail 会对 JPEG 使用 draft 缩小解码，其他格式先 reduce 再重采样
+            img.thumbnail(max_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+            sample = self.convert_to_rgb(img)
+            if sample is img:
+                sample = img.copy()
+        
+        self._preview_samples[key] = sample
+        while len(self._preview_samples) > PREVIEW_SAMPLE_CACHE_SIZE:
+            self._preview_samples.popitem(last=False)
+        return sample
+    
     def batch_process(self, input_dir, watermark_path, output_dir, position='bottom_right',
-                     opacity=0.7, scale=0.1, progress_callback=None):
+                     opacity=0.7, scale=0.1, progress_callback=None, options=None, **settings):
         """
         批量处理图片
         
         Args:
             input_dir: 输入目录
-            watermark_path: 水印文件路径
+            watermark_path: 水印文件路径，或文字水印（watermark_text.TextWatermark）
             output_dir: 输出目录
             position: 水印位置
             opacity: 透明度
             scale: 水印缩放比例
-            progress_callback: 进度回调函数 callback(current, total, filename)
+            progress_callback: 进度回调函数 callback(current, total, filename)，每个文件一次：
+                filename 为正在处理的文件，current 为在它之前已完成的文件数（从 0 开始）。
+                顺序处理时在处理该文件前调用；并行、流水线按完成顺序在该文件完成时调用，
+                total 为目前已发现的文件数。正常结束时最后调用一次 callback(total, total, "完成")
+            options: 处理选项（watermark_options.BatchOptions），为空时使用默认选项：
+                顺序处理，不写处理清单和批处理日志
+            settings: 逐项覆盖 options 中的设置（如 parallel=True, workers=4），
+                名称同 BatchOptions 的参数
+            
+        流水线模式结束后可通过 last_pipeline_metrics 获取各队列的深度和等待统计
+        去重时可通过 last_dedup_stats 获取去重统计（节省的解码 / 编码次数等）
+        正常结束后可通过 last_skip_stats 获取扫描到的文件数和跳过的已处理文件数
+        （collect_stats 为 True 时也包含在统计结果的 'pipeline' 中）
+        
+        设置了 collect_stats、stats_log 或处理器的 stats_hook 时按阶段统计每个文件
             
         Returns:
-            (成功数量, 总数量, 错误列表)
+            (成功数量, 总数量, 错误列表)；collect_stats 为 True 时为
+            (成功数量, 总数量, 错误列表, 统计结果)，统计结果见 BatchStats.summary。
+            取消时总数量只包含已开始处理的文件，成功数量与错误数之和总等于总数量
         """
+        batch = options.replace(**settings) if options is not None else BatchOptions(**settings)
+        manifest = None
+        skip_manifests = []
+        stats_log_file = None
+        batch_journal = None
+        finished = False
+        self.last_skip_stats = None
+        scan_counts = {'scanned': 0, 'pending': 0}
         try:
             input_path = Path(input_dir)
             output_path = Path(output_dir)
@@ -198,91 +1046,779 @@ class WatermarkProcessor:
             # 确保输出目录存在
             output_path.mkdir(parents=True, exist_ok=True)
             
-            # 获取所有支持的图片文件（递归搜索）
-            image_files = set()  # 使用set避免重复
-            for ext in self.supported_formats:
-                image_files.update(input_path.rglob(f"*{ext}"))
-                image_files.update(input_path.rglob(f"*{ext.upper()}"))
+            # 获取所有支持的图片文件（单次递归遍历）；分片时只保留分配到本分片的文件，
+            # 清单和日志使用本分片的文件名
+            image_files, manifest_name, journal_name = self.batch_files(input_path, output_path,
+                                                                        batch)
+            image_files = self._iter_counted(image_files, scan_counts, 'scanned')
             
-            image_files = list(image_files)  # 转换回列表
+            if batch.parallel and batch.pipeline:
+                raise ValueError("parallel 和 pipeline 不能同时使用")
             
-            total_files = len(image_files)
-            success_count = 0
-            errors = []
+            options = self.watermark_options(position, opacity, scale, batch.encoder,
+                                             batch.output_format, batch.tile_spacing,
+                                             batch.tile_angle)
+            if batch.renditions:
+                if batch.pipeline:
+                    raise ValueError("多规格输出不支持流水线模式")
+                # 单一输出的参数不再使用，设置指纹只取决于各规格
+                options = {'renditions': normalize_renditions(batch.renditions, watermark_path)}
             
-            for i, image_file in enumerate(image_files):
-                try:
-                    if progress_callback:
-                        progress_callback(i, total_files, image_file.name)
-                    
-                    # 计算相对路径，保留目录结构
-                    relative_path = image_file.relative_to(input_path)
-                    output_file = output_path / relative_path
-                    
-                    # 确保输出子目录存在
-                    output_file.parent.mkdir(parents=True, exist_ok=True)
-                    
-                    self.add_watermark(
-                        str(image_file),
-                        watermark_path,
-                        str(output_file),
-                        position,
-                        opacity,
-                        scale
-                    )
-                    success_count += 1
-                    
-                except Exception as e:
-                    error_msg = f"处理文件 {image_file.name} 时出错: {str(e)}"
-                    errors.append(error_msg)
-                    print(error_msg)
+            fingerprint = None
+            if batch.record_manifest or batch.skip_processed or batch.uses_journal:
+                fingerprint = self.settings_fingerprint(watermark_path, options)
+            if batch.record_manifest:
+                manifest = ProcessedManifest(output_path, filename=manifest_name)
             
-            if progress_callback:
+            # 批处理日志：从中断处继续时清理遗留的临时文件，并按日志跳过已完成的文件
+            resumed = None
+            if batch.uses_journal:
+                batch_journal = BatchJournal(output_path, input_path, fingerprint,
+                                             filename=journal_name)
+                if batch_journal.open(batch.resume):
+                    self._clean_interrupted(batch_journal, output_path, options)
+                    resumed = batch_journal
+            
+            # 跳过已完成和已处理的文件
+            image_files = self.iter_pending_files(
+                image_files, input_path, output_path, watermark_path, options, fingerprint,
+                batch, manifest_name, journal=resumed, manifest=manifest, opened=skip_manifests
+            )
+            image_files = self._iter_counted(image_files, scan_counts, 'pending')
+            
+            # 内容去重：每份内容只交给处理流程一次
+            deduplicator = None
+            self.last_dedup_stats = None
+            if batch.dedup:
+                if isinstance(watermark_path, TextWatermark) and watermark_path.is_template:
+                    print("文字水印包含模板字段，每个文件的水印不同，不进行内容去重")
+                elif batch.renditions:
+                    print("多规格输出不进行内容去重")
+                else:
+                    deduplicator = Deduplicator(batch.dedup_link)
+            
+            # 统计记录的接收方：汇总统计、JSON Lines 日志、统计回调
+            batch_stats = BatchStats() if batch.collect_stats else None
+            if batch.stats_log:
+                stats_log_file = JsonLinesLog(batch.stats_log)
+            stats_sinks = [sink for sink in (batch_stats and batch_stats.add, stats_log_file,
+                                             self.stats_hook) if sink]
+            
+            context = {
+                'input_path': input_path,
+                'output_path': output_path,
+                'watermark_path': watermark_path,
+                'options': options,
+                'manifest': manifest,
+                'fingerprint': fingerprint,
+                'verify_hash': batch.verify_hash,
+                'stats_sinks': stats_sinks,
+                'control': batch.control,
+                'journal': batch_journal,
+                'dedup': deduplicator,
+            }
+            if deduplicator is not None:
+                image_files = self._iter_deduplicated(image_files, context)
+            
+            if batch.parallel:
+                # 并行模式边扫描边提交任务
+                success_count, total_files, errors = self._batch_process_parallel(
+                    image_files, context, progress_callback, batch.workers, batch.max_in_flight,
+                    batch.memory_budget
+                )
+            elif batch.pipeline:
+                success_count, total_files, errors = self._batch_process_pipeline(
+                    image_files, context, progress_callback, batch.workers, batch.readers,
+                    batch.writers, batch.queue_size
+                )
+            else:
+                image_files = list(image_files)
+                if batch.group_by_size:
+                    image_files = self.group_by_size(image_files)
+                success_count, total_files, errors = self._batch_process_sequential(
+                    image_files, context, progress_callback
+                )
+            
+            if deduplicator is not None:
+                # 已生成输出（计为成功）或已判定失败的重复文件计入总数；取消时仍在等待
+                # 第一份的重复文件不计入，在去重统计的 cancelled 中
+                success_count += deduplicator.materialized
+                total_files += deduplicator.materialized + len(deduplicator.errors)
+                errors = errors + deduplicator.errors
+                self.last_dedup_stats = deduplicator.summary()
+                print(f"内容去重: {deduplicator.duplicates} 个重复文件，"
+                      f"节省 {deduplicator.materialized} 次解码和编码")
+            
+            finished = not (batch.control is not None and batch.control.cancelled)
+            if finished:
+                # 跳过的文件包括处理清单、已有输出和批处理日志判定为已完成的文件
+                self.last_skip_stats = {
+                    'scanned': scan_counts['scanned'],
+                    'skipped': scan_counts['scanned'] - scan_counts['pending'],
+                }
+            if progress_callback and finished:
                 progress_callback(total_files, total_files, "完成")
             
+            if batch_stats is not None:
+                summary = batch_stats.summary()
+                if batch.pipeline:
+                    summary['pipeline'] = self.last_pipeline_metrics
+                return success_count, total_files, errors, summary
             return success_count, total_files, errors
             
         except Exception as e:
             raise Exception(f"批量处理时出错: {str(e)}")
+        
+        finally:
+            if manifest is not None:
+                manifest.close()
+            for skip_manifest in skip_manifests:
+                skip_manifest.close()
+            if stats_log_file is not None:
+                stats_log_file.close()
+            # 处理清单提交后再删除日志；中断或取消时保留日志供下次继续
+            if batch_journal is not None:
+                if finished:
+                    batch_journal.complete()
+                else:
+                    batch_journal.close()
     
-    def get_source_files_excluding_watermarked(self, source_dir):
+    def watermark_options(self, position='bottom_right', opacity=0.7, scale=0.1,
+                          encoder='default', output_format='keep',
+                          tile_spacing=DEFAULT_TILE_SPACING, tile_angle=DEFAULT_TILE_ANGLE):
         """
-        获取源目录中的文件，排除watermarked相关目录
+        生成批量处理中每个文件使用的 add_watermark 参数（也用于计算设置指纹）
+        
+        提前校验编码配置和平铺参数，避免每个文件都报同样的错误
+        """
+        resolve_profile(encoder)
+        options = {
+            'position': position,
+            'opacity': opacity,
+            'scale': scale,
+            'encoder': encoder,
+            'output_format': output_format,
+        }
+        if position == TILED_POSITION:
+            # 只有平铺时才加入平铺参数，其他位置的设置指纹保持不变
+            options['tile_spacing'], options['tile_angle'] = validate_tiling(tile_spacing,
+                                                                             tile_angle)
+        return options
+    
+    def process_archive(self, input_archive, watermark_path, output_archive=None,
+                        position='bottom_right', opacity=0.7, scale=0.1, progress_callback=None,
+                        encoder='default', output_format='keep',
+                        tile_spacing=DEFAULT_TILE_SPACING, tile_angle=DEFAULT_TILE_ANGLE,
+                        copy_other=True, max_member_bytes=DEFAULT_MAX_MEMBER_BYTES):
+        """
+        为压缩包（zip / tar）中的图片添加水印，直接写入输出压缩包，不解压到磁盘
+        
+        成员按顺序逐个读入内存处理，成员路径保持不变（输出格式不为 keep 时替换扩展名，
+        替换后与已写入的成员重名时保留原扩展名，仍重名时作为错误报告）；
+        输出压缩包先写入临时文件，全部完成后再改名
         
         Args:
-            source_dir: 源目录路径
+            input_archive: 输入压缩包路径（.zip, .tar, .tar.gz, .tgz, .tar.bz2, .tar.xz）
+            watermark_path: 水印文件路径，或文字水印（模板中的文件名字段取成员路径）
+            output_archive: 输出压缩包路径，格式按扩展名确定；默认为输入压缩包同目录下的
+                “名称_watermarked.扩展名”
+            copy_other: 是否将非图片成员和目录原样复制到输出压缩包
+            max_member_bytes: 单个图片成员的大小上限，超过时报告错误并跳过
+            其余参数同 batch_process
             
         Returns:
-            list: 源文件列表（不包含watermarked目录中的文件）
+            (成功数量, 图片成员总数, 错误列表)
         """
         try:
-            source_path = Path(source_dir)
+            if archive_suffix(input_archive) is None:
+                raise ValueError(f"不支持的压缩包格式: {input_archive}")
+            output_archive = str(output_archive or default_archive_output(input_archive))
+            output_suffix = archive_suffix(output_archive)
+            if output_suffix is None:
+                raise ValueError(f"不支持的输出压缩包格式: {output_archive}")
+            
+            # 提前校验编码配置和输出格式，避免每个成员都报同样的错误
+            resolve_profile(encoder)
+            member_output_name('', output_format)
+            options = {'position': position, 'opacity': opacity, 'scale': scale,
+                       'encoder': encoder}
+            if position == TILED_POSITION:
+                options['tile_spacing'], options['tile_angle'] = validate_tiling(tile_spacing,
+                                                                                 tile_angle)
             
-            # 获取所有图片文件
-            all_files = set()
-            for ext in self.supported_formats:
-                all_files.update(source_path.rglob(f"*{ext}"))
-                all_files.update(source_path.rglob(f"*{ext.upper()}"))
+            success_count = 0
+            total_files = 0
+            errors = []
+            written = set()  # 已写入输出压缩包的成员路径，避免重名
+            with atomic_output(output_archive, self._directories) as fp:
+                writer = ArchiveWriter(fp, output_suffix)
+                try:
+                    for member, open_member in iter_members(input_archive):
+                        if member.is_dir or not self.is_supported_format(member.name):
+                            if copy_other and member.name in written:
+                                print(f"输出压缩包中已有同名成员，跳过: {member.name}")
+                            elif copy_other:
+                                if member.is_dir:
+                                    writer.add_dir(member)
+                                else:
+                                    with open_member() as stream:
+                                        writer.add_stream(member, stream)
+                                written.add(member.name)
+                            continue
+                        
+                        total_files += 1
+                        if progress_callback:
+                            # 流式读取时总数为目前已读到的图片成员数
+                            progress_callback(total_files - 1, total_files, member.name)
+                        try:
+                            if member.size > max_member_bytes:
+                                raise ValueError(f"成员大小 {member.size} 字节超过上限 "
+                                                 f"{max_member_bytes} 字节")
+                            output_name = member_output_name(member.name, output_format, written)
+                            with open_member() as stream:
+                                data = stream.read()
+                            encoded = self.watermark_bytes(
+                                data, watermark_path, format_for_path(output_name),
+                                source_name=member.name, **options
+                            )
+                            del data
+                            writer.add_bytes(output_name, encoded, member)
+                            written.add(output_name)
+                            success_count += 1
+                        except Exception as e:
+                            error_msg = f"处理文件 {member.name} 时出错: {str(e)}"
+                            errors.append(error_msg)
+                            print(error_msg)
+                finally:
+                    writer.close()
             
-            # 过滤出不在watermarked相关目录中的文件
-            source_files = []
-            watermarked_dirs = ['watermarked', 'watermarked_new']  # 需要排除的目录名
+            if progress_callback:
+                progress_callback(total_files, total_files, "完成")
+            return success_count, total_files, errors
             
-            for file_path in all_files:
-                # 检查文件路径中是否包含watermarked相关目录
-                relative_path = file_path.relative_to(source_path)
-                path_parts = relative_path.parts
+        except Exception as e:
+            raise Exception(f"处理压缩包时出错: {str(e)}")
+    
+    def batch_files(self, input_path, output_path, batch):
+        """
+        扫描批量处理的输入文件（输出目录位于输入目录内时不进入）；分片时只保留分配到
+        本分片的文件
+        
+        Args:
+            batch: BatchOptions 处理选项
+            
+        Returns:
+            (文件迭代器, 处理清单文件名, 批处理日志文件名)；分片时为本分片单独的文件名
+        """
+        exclude_paths = []
+        if output_path.resolve() != input_path.resolve():
+            exclude_paths.append(output_path)
+        image_files = self.iter_image_files(input_path, exclude_names=batch.exclude_dirs,
+                                            exclude_paths=exclude_paths)
+        validate_shard(batch.shard_index, batch.shard_count)
+        if batch.shard_count <= 1:
+            return image_files, MANIFEST_FILENAME, JOURNAL_FILENAME
+        shard = (batch.shard_index, batch.shard_count)
+        return (iter_shard(image_files, input_path, *shard),
+                shard_filename(MANIFEST_FILENAME, *shard), shard_filename(JOURNAL_FILENAME, *shard))
+    
+    def iter_pending_files(self, image_files, input_path, output_path, watermark_path, options,
+                           fingerprint, batch, manifest_name=MANIFEST_FILENAME, journal=None,
+                           manifest=None, opened=None):
+        """
+        按批量处理的跳过规则过滤文件（batch_process 和预估共用）
+        
+        1. journal 为载入的中断日志时，跳过日志中已完成且之后未变化的文件
+        2. skip_processed 时跳过已处理且未变化的文件：检测目录即输出目录且已有记录的
+           处理清单时按清单判断（分片时先按合并后的主清单，再按本分片的清单）；
+           否则按 filter_unprocessed_files 判断，检测目录即输出目录时把判断为已处理的
+           文件补记到 manifest（第一次在已有输出的目录上记录清单时不会重新处理旧输出）
+        
+        Args:
+            image_files: 源文件（可迭代）
+            options: 水印设置（watermark_options 的返回值）
+            fingerprint: 水印设置指纹
+            batch: BatchOptions 处理选项
+            manifest_name: 本次处理的处理清单文件名
+            journal: 已打开或载入的中断日志（BatchJournal）
+            manifest: 本次处理写入的处理清单；为空时以只读方式使用已存在的清单。
+                不为空时补记日志中已完成、清单中缺少的记录
+            opened: 列表，在此打开的处理清单加入其中，由调用方关闭
+            
+        Returns:
+            需要处理的文件（可迭代）
+        """
+        if journal is not None:
+            image_files = self._iter_not_journaled(image_files, input_path, output_path, journal,
+                                                   manifest, fingerprint, options)
+        if not batch.skip_processed:
+            return image_files
+        
+        check_dir = Path(batch.watermarked_dir) if batch.watermarked_dir else output_path
+        if check_dir.resolve() == output_path.resolve():
+            manifests = []
+            if manifest_name != MANIFEST_FILENAME and manifest_exists(output_path):
+                manifests.append(ProcessedManifest(output_path))
+            if manifest is None and manifest_exists(output_path, manifest_name):
+                manifest = ProcessedManifest(output_path, filename=manifest_name)
+                manifests.append(manifest)
+            if opened is not None:
+                opened.extend(manifests)
+            if manifest is not None and manifest not in manifests:
+                manifests.append(manifest)
+            # 空清单（刚创建）不能说明哪些文件已处理过
+            manifests = [checked for checked in manifests if not checked.is_empty()]
+            if manifests:
+                for checked in manifests:
+                    image_files = self.iter_unprocessed_files(
+                        image_files, input_path, checked, fingerprint, batch.verify_hash
+                    )
+                return image_files
+            
+            # 还没有清单记录时按输出文件的相对路径判断，已有的输出补记到清单
+            image_files = list(image_files)
+            pending = self.filter_unprocessed_files(image_files, input_path, check_dir,
+                                                    options=options)
+            if manifest is not None:
+                self._record_existing(manifest, image_files, pending, input_path, output_path,
+                                      fingerprint, options)
+            return pending
+        return self.filter_unprocessed_files(image_files, input_path, check_dir, watermark_path,
+                                             options, batch.verify_hash)
+    
+    def _record_existing(self, manifest, image_files, pending, input_path, output_path,
+                         fingerprint, options):
+        """把按相对路径判断为已处理的文件（输出已存在）记录到处理清单"""
+        pending = set(pending)
+        for image_file in image_files:
+            if image_file in pending:
+                continue
+            relative_path = image_file.relative_to(input_path)
+            output_file = self.output_file_for(output_path, relative_path, options)
+            try:
+                manifest.record(relative_path, image_file, output_file, fingerprint)
+            except Exception as e:
+                print(f"记录处理清单时出错: {e}")
+    
+    def _clean_interrupted(self, batch_journal, output_path, options):
+        """删除上次中断时正在写出的文件遗留的临时文件"""
+        removed = 0
+        for relative_path in batch_journal.interrupted():
+            for output_file in self.output_files_for(output_path, relative_path, options):
+                removed += remove_temp_files(output_file)
+        print(f"从中断处继续: 已完成 {len(batch_journal.done)} 个文件"
+              + (f"，清理临时文件 {removed} 个" if removed else ""))
+    
+    def _iter_not_journaled(self, image_files, input_path, output_path, batch_journal,
+                            manifest, fingerprint, options):
+        """
+        跳过批处理日志中已完成且之后未变化的文件；处理清单中缺少的记录（中断前尚未提交）
+        在此补记
+        """
+        for image_file in image_files:
+            try:
+                relative_path = image_file.relative_to(input_path)
+                stat = os.stat(image_file)
+            except (ValueError, OSError):
+                yield image_file
+                continue
+            if not batch_journal.is_done(relative_path, stat):
+                yield image_file
+                continue
+            if manifest is not None and not manifest.is_current(relative_path, image_file,
+                                                                fingerprint, stat=stat):
+                output_file = self.output_file_for(output_path, relative_path, options)
+                try:
+                    manifest.record(relative_path, image_file, output_file, fingerprint, stat=stat)
+                except Exception as e:
+                    print(f"记录处理清单时出错: {e}")
+    
+    def output_file_for(self, output_dir, relative_path, options=None):
+        """根据相对路径和输出格式计算输出文件路径（多规格输出时为第一个规格的输出）"""
+        return self.output_files_for(output_dir, relative_path, options)[0]
+    
+    def output_files_for(self, output_dir, relative_path, options=None):
+        """计算一个源文件的全部输出文件路径（多规格输出时每个规格一个）"""
+        options = options or {}
+        if options.get('renditions'):
+            return [rendition_output(output_dir, relative_path, spec)
+                    for spec in options['renditions']]
+        output_format = options.get('output_format', 'keep')
+        return [Path(output_path_for(Path(output_dir) / relative_path, output_format))]
+    
+    def process_file(self, input_path, watermark_path, output, timer=None, renditions=None,
+                     **options):
+        """
+        处理批量任务中的一个文件
+        
+        Args:
+            output: 输出路径；多规格输出时为各规格的输出路径列表（与 renditions 顺序相同）
+            renditions: 输出规格列表，为空时按 add_watermark 处理
+            其余参数同 add_watermark
+        """
+        if renditions:
+            return self.add_watermark_renditions(input_path, list(zip(output, renditions)),
+                                                 timer=timer)
+        return self.add_watermark(input_path, watermark_path, output, timer=timer, **options)
+    
+    def _job_output(self, output_files, options):
+        """process_file 的 output 参数"""
+        if options.get('renditions'):
+            return [str(output_file) for output_file in output_files]
+        return str(output_files[0])
+    
+    def _journal_start(self, context, relative_path):
+        """在批处理日志中记录开始处理一个文件"""
+        if context['journal'] is not None:
+            context['journal'].start(relative_path)
+    
+    def _record_processed(self, context, image_file, output_file, stat):
+        """将处理成功的文件记录到批处理日志和处理清单"""
+        if context['journal'] is not None and stat is not None:
+            context['journal'].finish(image_file.relative_to(context['input_path']), stat)
+        manifest = context['manifest']
+        if manifest is None:
+            return
+        manifest.record(
+            image_file.relative_to(context['input_path']),
+            image_file,
+            output_file,
+            context['fingerprint'],
+            stat=stat,
+            with_hash=context['verify_hash']
+        )
+    
+    def _iter_counted(self, image_files, counts, key):
+        """边生成边计数（counts[key]），不改变扫描和处理的顺序"""
+        for image_file in image_files:
+            counts[key] += 1
+            yield image_file
+    
+    def _iter_deduplicated(self, image_files, context):
+        """只生成每份内容的第一个文件；重复文件等第一份处理完成后由其输出生成"""
+        deduplicator = context['dedup']
+        for image_file in image_files:
+            try:
+                stat = os.stat(image_file)
+                output_file = self.output_file_for(
+                    context['output_path'], image_file.relative_to(context['input_path']),
+                    context['options']
+                )
+                primary = deduplicator.discover(image_file, stat.st_size,
+                                                format_for_path(str(output_file)))
+            except (ValueError, OSError):
+                # 无法读取的文件交给处理流程报告错误
+                yield image_file
+                continue
+            if primary is None:
+                yield image_file
+                continue
+            deduplicator.add_duplicate(primary, image_file, stat)
+            # 第一份已处理完成时立即生成
+            self._materialize_duplicates(context, primary)
+    
+    def _primary_finished(self, context, image_file, output_file=None, error=None):
+        """一个文件处理结束：去重时生成等待它的重复文件的输出"""
+        deduplicator = context['dedup']
+        if deduplicator is None:
+            return
+        if error is None:
+            deduplicator.primary_done(image_file, output_file)
+        else:
+            deduplicator.primary_failed(image_file, error)
+        self._materialize_duplicates(context, image_file)
+    
+    def _materialize_duplicates(self, context, primary):
+        """第一份已处理完成时，为等待它的重复文件生成输出（硬链接、reflink 或复制）"""
+        deduplicator = context['dedup']
+        result, duplicates = deduplicator.take_ready(primary)
+        for image_file, stat in duplicates:
+            if result[0] == 'error':
+                error_msg = f"处理文件 {image_file.name} 时出错: 与 {primary.name} 内容相同，{result[1]}"
+                deduplicator.errors.append(error_msg)
+                print(error_msg)
+                continue
+            output_file = self.output_file_for(
+                context['output_path'], image_file.relative_to(context['input_path']),
+                context['options']
+            )
+            try:
+                method = materialize(result[1], output_file, deduplicator.link_mode,
+                                     self._directories)
+            except Exception as e:
+                error_msg = f"处理文件 {image_file.name} 时出错: 生成重复输出失败: {e}"
+                deduplicator.errors.append(error_msg)
+                print(error_msg)
+                continue
+            deduplicator.add_materialized(method)
+            try:
+                self._record_processed(context, image_file, output_file, stat)
+            except Exception as e:
+                print(f"记录处理清单时出错: {e}")
+    
+    def _emit_stats(self, context, record):
+        """将单个文件的统计记录交给各接收方，接收方出错不影响处理"""
+        for sink in context['stats_sinks']:
+            try:
+                sink(record)
+            except Exception as e:
+                print(f"处理统计记录时出错: {e}")
+    
+    def _checkpoint(self, context):
+        """开始下一个文件前检查暂停 / 取消：暂停时等待，已取消时返回 False"""
+        control = context['control']
+        return control is None or control.wait_if_paused()
+    
+    def _batch_process_sequential(self, image_files, context, progress_callback):
+        """
+        在当前进程中逐个处理文件
+        
+        Returns:
+            (成功数量, 已开始处理的数量, 错误列表)；取消时不包含未开始的文件
+        """
+        input_path = context['input_path']
+        output_path = context['output_path']
+        total_files = len(image_files)
+        started = 0
+        success_count = 0
+        errors = []
+        
+        for image_file in image_files:
+            if not self._checkpoint(context):
+                break
+            if progress_callback:
+                progress_callback(started, total_files, image_file.name)
+            started += 1
+            timer = StageTimer() if context['stats_sinks'] else None
+            output_file = None
+            try:
+                # 计算相对路径，保留目录结构
+                relative_path = image_file.relative_to(input_path)
+                output_files = self.output_files_for(output_path, relative_path,
+                                                     context['options'])
+                output_file = output_files[0]
                 
-                # 如果路径中不包含watermarked相关目录，则保留
-                if not any(part in watermarked_dirs for part in path_parts):
-                    source_files.append(file_path)
+                # 处理前记录源文件状态，处理期间源文件被修改时下次仍会重新处理
+                stat = os.stat(image_file)
+                self._journal_start(context, relative_path)
+                self.process_file(
+                    str(image_file),
+                    context['watermark_path'],
+                    self._job_output(output_files, context['options']),
+                    timer=timer,
+                    **context['options']
+                )
+                success_count += 1
+                
+            except Exception as e:
+                error_msg = f"处理文件 {image_file.name} 时出错: {str(e)}"
+                errors.append(error_msg)
+                print(error_msg)
+                if timer is not None:
+                    self._emit_stats(context, timer.record(image_file, output_file, str(e)))
+                self._primary_finished(context, image_file, error=str(e))
+                continue
+            
+            if timer is not None:
+                peak_bytes = self.last_image_stats.get('peak_bytes')
+                self._emit_stats(context, timer.record(image_file, output_file,
+                                                       peak_bytes=peak_bytes))
+            
+            try:
+                self._record_processed(context, image_file, output_file, stat)
+            except Exception as e:
+                print(f"记录处理清单时出错: {e}")
+            self._primary_finished(context, image_file, output_file)
+        
+        return success_count, started, errors
+    
+    def _batch_process_parallel(self, image_files, context, progress_callback, workers,
+                                max_in_flight, memory_budget=None):
+        """
+        使用进程池并行处理文件，进度回调和处理清单记录都在主进程中按完成顺序进行
+        
+        image_files 可以是仍在扫描中的生成器，此时进度回调中的总数为目前已发现的文件数
+        
+        Returns:
+            (成功数量, 总数量, 错误列表)
+        """
+        from watermark_parallel import ParallelExecutor
+        
+        def job_cost(job):
+            try:
+                return self.estimate_memory(job[0], **context['options'])
+            except Exception:
+                # 无法读取文件头时按 0 计，由工作进程报告错误
+                return 0
+        
+        executor = ParallelExecutor(
+            workers=workers,
+            max_in_flight=max_in_flight,
+            processor_kwargs=self.worker_kwargs(),
+            memory_budget=memory_budget
+        )
+        return self._run_executor(executor, image_files, context, progress_callback,
+                                  cost=job_cost if memory_budget else None)
+    
+    def _batch_process_pipeline(self, image_files, context, progress_callback, workers,
+                                readers, writers, queue_size):
+        """
+        使用读取 / 计算 / 写出流水线处理文件
+        
+        Returns:
+            (成功数量, 总数量, 错误列表)
+        """
+        from watermark_pipeline import PipelineExecutor
+        
+        executor = PipelineExecutor(
+            processor_kwargs=self.worker_kwargs(),
+            readers=readers,
+            workers=workers,
+            writers=writers,
+            queue_size=queue_size
+        )
+        try:
+            return self._run_executor(executor, image_files, context, progress_callback)
+        finally:
+            self.last_pipeline_metrics = executor.metrics()
+    
+    def _run_executor(self, executor, image_files, context, progress_callback, cost=None):
+        """
+        通过执行器（进程池或流水线）处理文件，进度回调、统计和处理清单记录都在当前线程中
+        按完成顺序进行
+        
+        image_files 可以是仍在扫描中的生成器，此时进度回调中的总数为目前已发现的文件数
+        
+        Returns:
+            (成功数量, 总数量, 错误列表)
+        """
+        input_path = context['input_path']
+        output_path = context['output_path']
+        instrument = bool(context['stats_sinks'])
+        discovered = 0
+        success_count = 0
+        errors = []
+        in_flight = {}  # 输入路径 -> (源文件, 输出文件, 处理前的源文件状态)
+        
+        def iter_jobs():
+            nonlocal discovered
+            for image_file in image_files:
+                # 暂停时不再提交新任务，已提交的任务继续完成；取消后不再提交
+                if not self._checkpoint(context):
+                    return
+                discovered += 1
+                # 计算相对路径，保留目录结构
+                output_files = self.output_files_for(
+                    output_path, image_file.relative_to(input_path), context['options']
+                )
+                try:
+                    stat = os.stat(image_file)
+                except OSError:
+                    stat = None
+                in_flight[str(image_file)] = (image_file, output_files[0], stat)
+                self._journal_start(context, image_file.relative_to(input_path))
+                yield (str(image_file), self._job_output(output_files, context['options']),
+                       context['watermark_path'], context['options'], instrument)
+        
+        results = executor.run(iter_jobs(), cost=cost)
+        for completed, result in enumerate(results):
+            image_file, output_file, stat = in_flight.pop(result['source'])
+            name = image_file.name
+            if result.get('stats') is not None:
+                self._emit_stats(context, result['stats'])
+            if result['error'] is None:
+                success_count += 1
+                try:
+                    self._record_processed(context, image_file, output_file, stat)
+                except Exception as e:
+                    print(f"记录处理清单时出错: {e}")
+                self._primary_finished(context, image_file, output_file)
+            else:
+                error_msg = f"处理文件 {name} 时出错: {result['error']}"
+                errors.append(error_msg)
+                print(error_msg)
+                self._primary_finished(context, image_file, error=result['error'])
+            
+            if progress_callback:
+                # 与顺序处理一致：completed 为在该文件之前已完成的文件数
+                progress_callback(completed, discovered, name)
+        
+        return success_count, discovered, errors
+    
+    def iter_image_files(self, root_dir, exclude_names=(), exclude_paths=()):
+        """
+        单次遍历目录树，逐个生成支持格式的图片文件
+        
+        每个目录只访问一次（基于 os.scandir），扩展名不区分大小写，
+        被排除的目录在进入之前就被跳过；以生成器方式返回，调用方可边扫描边处理
+        
+        Args:
+            root_dir: 根目录路径
+            exclude_names: 需要排除的目录名（任意层级）
+            exclude_paths: 需要排除的目录路径
+            
+        Yields:
+            Path: 图片文件路径（同一目录内按文件名排序）
+        """
+        exclude_names = set(exclude_names)
+        exclude_paths = {os.path.normcase(os.path.abspath(p)) for p in exclude_paths}
+        
+        stack = [os.fspath(root_dir)]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError as e:
+                print(f"无法读取目录 {current}: {e}")
+                continue
             
-            return source_files
+            subdirs = []
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name in exclude_names:
+                            continue
+                        if exclude_paths and os.path.normcase(os.path.abspath(entry.path)) in exclude_paths:
+                            continue
+                        subdirs.append(entry.path)
+                    elif entry.is_file() and self.is_supported_format(entry.name):
+                        yield Path(entry.path)
+                except OSError:
+                    continue
+            
+            # 逆序压栈，保证子目录按名称顺序遍历
+            stack.extend(reversed(subdirs))
+    
+    def get_source_files_excluding_watermarked(self, source_dir):
+        """
+        获取源目录中的文件，排除watermarked相关目录
+        
+        Args:
+            source_dir: 源目录路径
+            
+        Returns:
+            list: 源文件列表（不包含watermarked目录中的文件）
+        """
+        try:
+            return list(self.iter_source_files_excluding_watermarked(source_dir))
             
         except Exception as e:
             print(f"获取源文件列表时出错: {e}")
             return []
     
+    def iter_source_files_excluding_watermarked(self, source_dir):
+        """
+        以生成器方式获取源目录中的文件，watermarked相关目录不会被进入
+        
+        Args:
+            source_dir: 源目录路径
+            
+        Yields:
+            Path: 源文件路径
+        """
+        return self.iter_image_files(source_dir, exclude_names=WATERMARKED_DIR_NAMES)
+    
     def get_processed_files(self, source_dir, watermarked_dir):
         """
         获取已经处理过的文件列表
@@ -295,21 +1831,14 @@ class WatermarkProcessor:
             set: 已处理文件的相对路径集合
         """
         try:
-            source_path = Path(source_dir)
             watermarked_path = Path(watermarked_dir)
             
             if not watermarked_path.exists():
                 return set()
             
-            # 获取水印目录中的所有图片文件
-            watermarked_files = set()
-            for ext in self.supported_formats:
-                watermarked_files.update(watermarked_path.rglob(f"*{ext}"))
-                watermarked_files.update(watermarked_path.rglob(f"*{ext.upper()}"))
-            
-            # 转换为相对路径集合
+            # 获取水印目录中的所有图片文件，并转换为相对路径集合
             processed_relative_paths = set()
-            for file_path in watermarked_files:
+            for file_path in self.iter_image_files(watermarked_path):
                 try:
                     # 计算相对于水印目录的相对路径
                     relative_path = file_path.relative_to(watermarked_path)
@@ -323,27 +1852,43 @@ class WatermarkProcessor:
             print(f"获取已处理文件列表时出错: {e}")
             return set()
     
-    def filter_unprocessed_files(self, source_files, source_dir, watermarked_dir):
+    def filter_unprocessed_files(self, source_files, source_dir, watermarked_dir,
+                                 watermark_path=None, options=None, verify_hash=False):
         """
         过滤出未处理的文件
         
+        水印目录中存在处理清单且提供了水印设置时，按清单逐个查表判断（源文件、
+        水印文件或水印设置变化以及输出缺失的文件都视为未处理）；否则按相对路径比对
+        
         Args:
             source_files: 源文件列表
             source_dir: 源目录路径
             watermarked_dir: 水印目录路径
+            watermark_path: 水印文件路径（用于计算设置指纹）
+            options: 水印设置（位置、透明度、缩放比例等）
+            verify_hash: 仅修改时间变化时是否用内容哈希确认
             
         Returns:
             list: 未处理的文件列表
         """
         try:
+            if watermark_path is not None and manifest_exists(watermarked_dir):
+                with ProcessedManifest(watermarked_dir) as manifest:
+                    return list(self.iter_unprocessed_files(
+                        source_files, source_dir, manifest,
+                        self.settings_fingerprint(watermark_path, options), verify_hash
+                    ))
+            
             source_path = Path(source_dir)
             processed_files = self.get_processed_files(source_dir, watermarked_dir)
+            output_format = (options or {}).get('output_format', 'keep')
             
             unprocessed_files = []
             for file_path in source_files:
                 try:
-                    # 计算源文件的相对路径
-                    relative_path = file_path.relative_to(source_path)
+                    # 计算源文件的相对路径（以及按输出格式对应的输出文件相对路径）
+                    relative_path = Path(output_path_for(file_path.relative_to(source_path),
+                                                         output_format))
                     
                     # 检查是否已处理
                     if relative_path not in processed_files:
@@ -358,7 +1903,40 @@ class WatermarkProcessor:
         except Exception as e:
             print(f"过滤未处理文件时出错: {e}")
             return source_files  # 出错时返回所有文件
-
+    
+    def iter_unprocessed_files(self, source_files, source_dir, manifest, fingerprint,
+                               verify_hash=False):
+        """
+        按处理清单逐个判断，以生成器方式返回需要（重新）处理的文件
+        
+        Args:
+            source_files: 源文件（可迭代）
+            source_dir: 源目录路径
+            manifest: ProcessedManifest 处理清单
+            fingerprint: 当前水印设置指纹
+            verify_hash: 仅修改时间变化时是否用内容哈希确认
+            
+        Yields:
+            Path: 未处理的文件路径
+        """
+        source_path = Path(source_dir)
+        for file_path in source_files:
+            try:
+                relative_path = file_path.relative_to(source_path)
+                if manifest.is_current(relative_path, file_path, fingerprint,
+                                       verify_hash=verify_hash):
+                    continue
+            except (ValueError, OSError):
+                pass
+            yield file_path
+    
+    def settings_fingerprint(self, watermark_path, options):
+        """计算水印设置指纹（水印文件内容 + 水印参数；多规格输出时包含每个规格的水印内容）"""
+        options = options or {}
+        if options.get('renditions'):
+            options = dict(options, renditions=describe_renditions(options['renditions']))
+        return settings_fingerprint(watermark_path, options)
+    
     def get_image_info(self, image_path):
         """获取图片信息"""
         try:
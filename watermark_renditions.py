@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多规格输出模块
+同一张源图片按多个输出规格（最大边长、水印、位置、透明度、大小、编码配置、输出子目录）
+生成多份输出，例如原尺寸、网页尺寸和缩略图，或给不同客户使用不同的水印；
+源图片只解码一次，见 WatermarkProcessor.add_watermark_renditions
+
+规格文件为 JSON 列表（或 {"renditions": [...]}），例如:
+    [
+        {"name": "full"},
+        {"name": "web", "max_size": 2048, "encoder": "balanced"},
+        {"name": "thumb", "max_size": 400, "watermark": "small.png", "scale": 0.2,
+         "output_format": "webp"}
+    ]
+"""
+
+import json
+from pathlib import Path, PurePath
+
+from watermark_encoder import OUTPUT_FORMATS, output_path_for, resolve_profile
+from watermark_manifest import settings_fingerprint
+from watermark_text import TextWatermark
+from watermark_tiling import (POSITIONS, TILED_POSITION, DEFAULT_TILE_SPACING, DEFAULT_TILE_ANGLE,
+                              validate_tiling)
+
+# 规格中可以使用的键（watermark 为水印图片路径，text / font 为文字水印）
+RENDITION_KEYS = ('name', 'subdir', 'max_size', 'watermark', 'text', 'font', 'position',
+                  'opacity', 'scale', 'encoder', 'output_format', 'tile_spacing', 'tile_angle')
+
+
+def normalize_renditions(renditions, watermark=None):
+    """
+    校验输出规格并补全默认值
+
+    Args:
+        renditions: 规格字典列表
+        watermark: 规格中没有指定水印时使用的水印（水印图片路径或文字水印）
+
+    Returns:
+        list: 规格字典列表；subdir 为输出目录下的子目录（默认与 name 相同，'' 表示输出目录本身），
+            max_size 为 None 时保持原尺寸
+    """
+    if not renditions:
+        raise ValueError("至少需要一个输出规格")
+
+    normalized = []
+    subdirs = set()
+    for index, spec in enumerate(renditions):
+        unknown = set(spec) - set(RENDITION_KEYS)
+        if unknown:
+            raise ValueError(f"输出规格 {index} 包含不支持的设置: {', '.join(sorted(unknown))}")
+        name = spec.get('name') or f"rendition{index}"
+
+        rendition_watermark = spec.get('watermark') or watermark
+        if spec.get('text'):
+            rendition_watermark = TextWatermark(spec['text'], font_path=spec.get('font'))
+        if rendition_watermark is None:
+            raise ValueError(f"输出规格 {name} 没有指定水印")
+
+        max_size = spec.get('max_size')
+        if max_size is not None:
+            max_size = int(max_size)
+            if max_size < 1:
+                raise ValueError(f"输出规格 {name} 的 max_size 必须大于 0")
+
+        subdir = spec.get('subdir', name)
+        subdir_path = PurePath(subdir)
+        if subdir_path.is_absolute() or '..' in subdir_path.parts:
+            raise ValueError(f"输出规格 {name} 的子目录必须是输出目录内的相对路径: {subdir}")
+        if subdir_path.as_posix() in subdirs:
+            raise ValueError(f"输出规格的子目录重复: {subdir}")
+        subdirs.add(subdir_path.as_posix())
+
+        position = spec.get('position', 'bottom_right')
+        if position not in POSITIONS:
+            raise ValueError(f"输出规格 {name} 的水印位置不支持: {position}")
+        opacity = float(spec.get('opacity', 0.7))
+        scale = float(spec.get('scale', 0.1))
+        if not 0.0 <= opacity <= 1.0 or not 0.0 < scale <= 1.0:
+            raise ValueError(f"输出规格 {name} 的透明度或大小超出范围")
+        encoder = spec.get('encoder', 'default')
+        resolve_profile(encoder)
+        output_format = spec.get('output_format', 'keep')
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"输出规格 {name} 的输出格式不支持: {output_format}")
+        tile_spacing, tile_angle = validate_tiling(spec.get('tile_spacing', DEFAULT_TILE_SPACING),
+                                                   spec.get('tile_angle', DEFAULT_TILE_ANGLE))
+
+        normalized.append({
+            'name': name,
+            'subdir': subdir,
+            'max_size': max_size,
+            'watermark': rendition_watermark,
+            'position': position,
+            'opacity': opacity,
+            'scale': scale,
+            'encoder': encoder,
+            'output_format': output_format,
+            'tile_spacing': tile_spacing,
+            'tile_angle': tile_angle,
+        })
+    return normalized
+
+
+def load_renditions(path):
+    """读取 JSON 规格文件"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('renditions')
+    if not isinstance(data, list) or not all(isinstance(spec, dict) for spec in data):
+        raise ValueError(f"规格文件应为规格对象的列表: {path}")
+    return data
+
+
+def describe_renditions(renditions):
+    """生成用于计算设置指纹的规格描述（水印按文件内容或文字设置描述）"""
+    described = []
+    for spec in renditions:
+        item = dict(spec)
+        item['watermark'] = settings_fingerprint(spec['watermark'], {})
+        if spec['position'] != TILED_POSITION:
+            # 与单一输出相同，只有平铺时平铺参数才影响输出
+            item.pop('tile_spacing')
+            item.pop('tile_angle')
+        described.append(item)
+    return described
+
+
+def rendition_output(output_dir, relative_path, spec):
+    """规格的输出文件路径：输出目录/子目录/相对路径（按输出格式替换扩展名）"""
+    return Path(output_path_for(Path(output_dir) / spec['subdir'] / relative_path,
+                                spec['output_format']))
+
+
+def fit_size(size, max_size):
+    """按最大边长等比例缩小后的尺寸（不放大）"""
+    width, height = size
+    if max_size is None or max(width, height) <= max_size:
+        return size
+    ratio = max_size / max(width, height)
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内存预算调度模块
+根据图片文件头中的尺寸和颜色模式估算处理时的内存占用，按预算准入并行任务，
+大图运行时同时运行的其他任务会相应减少
+"""
+
+import threading
+
+
+class MemoryBudget:
+    """
+    内存预算
+
+    正在运行的任务估算内存之和不超过预算；单个任务超过预算时，
+    等其他任务全部完成后单独运行，保证不会卡住
+    """
+
+    def __init__(self, max_bytes):
+        """
+        Args:
+            max_bytes: 所有同时运行任务的内存预算（字节）
+        """
+        if max_bytes <= 0:
+            raise ValueError("内存预算必须大于 0")
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self.running = 0
+        self.peak_in_use = 0
+        self.waits = 0  # 因预算不足而暂缓提交的次数
+        self._lock = threading.Lock()
+
+    def try_acquire(self, cost):
+        """预算足够时占用预算并返回 True，否则返回 False"""
+        with self._lock:
+            if self.running and self.in_use + cost > self.max_bytes:
+                self.waits += 1
+                return False
+            self.in_use += cost
+            self.running += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            return True
+
+    def release(self, cost):
+        """任务完成后释放占用的预算"""
+        with self._lock:
+            self.in_use -= cost
+            self.running -= 1
+
+    def stats(self):
+        """获取预算使用统计"""
+        with self._lock:
+            return {
+                'max_bytes': self.max_bytes,
+                'in_use': self.in_use,
+                'running': self.running,
+                'peak_in_use': self.peak_in_use,
+                'waits': self.waits,
+            }
@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+水印 HTTP 服务
+基于 WatermarkProcessor.watermark_bytes 的内存接口：请求体为图片数据，响应体为添加水印后的图片，
+不写临时文件。图片在常驻的工作进程中处理，每个进程启动时即加载水印（并可预先生成常见尺寸的叠加层），
+多个请求并发处理；/metrics 返回延迟分位数和排队请求数
+
+用法:
+    python -m watermark_server -w watermark.png [--port 8080] [-j 工作进程数]
+
+接口:
+    POST /watermark?position=&opacity=&scale=&format=&tile_spacing=&tile_angle=&filename=
+        请求体为原始图片数据；未指定 format 时按 Accept 请求头选择输出格式，
+        Accept 不限定图片格式时与输入格式相同。成功返回 200 和图片数据
+    GET /metrics  JSON 格式的运行统计
+    GET /health   存活检查
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from PIL import Image, UnidentifiedImageError
+
+from watermark_processor import WatermarkProcessor
+from watermark_encoder import ENCODER_PROFILES, FORMAT_NAMES
+from watermark_tiling import POSITIONS, DEFAULT_TILE_SPACING, DEFAULT_TILE_ANGLE, validate_tiling
+from watermark_text import TextWatermark
+from watermark_stats import summarize
+
+# 请求体大小上限（字节）
+DEFAULT_MAX_BODY_BYTES = 64 * 1024 * 1024
+
+# 延迟统计保留最近多少个请求
+DEFAULT_LATENCY_WINDOW = 1000
+
+# 输出格式对应的 Content-Type（保持输入格式时可能为 GIF、BMP）
+MIME_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp',
+              'GIF': 'image/gif', 'BMP': 'image/bmp'}
+
+# 可以通过 Accept 请求头选择的输出格式
+ACCEPT_FORMATS = {MIME_TYPES[name]: name for name in FORMAT_NAMES.values()}
+
+# 由请求数据引起的异常（无法识别、损坏或截断的图片，超过像素上限），返回 422；
+# 解码器报告数据错误时抛出的是 OSError 本身，其子类（文件不存在、权限等）属于服务端问题
+INPUT_ERRORS = (UnidentifiedImageError, Image.DecompressionBombError, SyntaxError, EOFError)
+
+# 每个工作进程内常驻的水印处理器和水印
+_worker_processor = None
+_worker_watermark = None
+
+
+def _init_worker(processor_kwargs, watermark, warm_sizes, scale, opacity):
+    """工作进程初始化：创建处理器并加载水印，预先生成指定尺寸的叠加层"""
+    global _worker_processor, _worker_watermark
+    _worker_processor = WatermarkProcessor(**processor_kwargs)
+    _worker_watermark = watermark
+    if not isinstance(watermark, TextWatermark):
+        _worker_processor.watermark_cache.get_source(watermark)
+    if isinstance(watermark, TextWatermark) and watermark.is_template:
+        # 模板文字随图片变化，无法预先生成
+        return
+    for size in warm_sizes:
+        _worker_processor.prepare_watermark(watermark, size, scale, opacity)
+
+
+def _ready():
+    """确认工作进程已启动"""
+    return os.getpid()
+
+
+class InputError(Exception):
+    """请求中的图片数据无法处理（在工作进程中识别后传回）"""
+
+
+def is_input_error(error):
+    """异常（含 watermark_bytes 包装前的原始异常）是否由请求的图片数据引起"""
+    while error is not None:
+        if isinstance(error, INPUT_ERRORS) or type(error) is OSError:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def _process(data, format_name, options, source_name):
+    """
+    在工作进程中处理一张图片
+
+    Returns:
+        (输出数据, 输出格式, 处理耗时秒数)
+
+    Raises:
+        InputError: 图片数据无法识别、损坏或超过像素上限；其他异常属于服务端错误
+    """
+    start = time.perf_counter()
+    try:
+        result = _worker_processor.watermark_bytes(data, _worker_watermark, format_name,
+                                                   source_name=source_name, **options)
+    except Exception as e:
+        if is_input_error(e):
+            raise InputError(str(e))
+        raise
+    return result, _worker_processor.last_image_stats['format'], time.perf_counter() - start
+
+
+def format_from_accept(accept):
+    """
+    按 Accept 请求头选择输出格式
+
+    Returns:
+        Pillow 格式名；未限定图片格式（缺省、*/*、image/*）时返回 'keep'，
+        只接受不支持的格式时返回 None
+    """
+    if not accept:
+        return 'keep'
+    candidates = []
+    for index, item in enumerate(accept.split(',')):
+        media_type, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            candidates.append((-quality, index, media_type.lower()))
+    for _, _, media_type in sorted(candidates):
+        if media_type in ('*/*', 'image/*'):
+            return 'keep'
+        if media_type in ACCEPT_FORMATS:
+            return ACCEPT_FORMATS[media_type]
+    return None
+
+
+class RequestError(Exception):
+    """请求无效，status 为返回的 HTTP 状态码"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class WatermarkService:
+    """
+    常驻工作进程池和运行统计
+
+    同时处理的请求超过工作进程数时在进程池中排队；排队数超过 max_queue 时直接拒绝（503）。
+    图片数据无法处理时返回 422；工作进程崩溃（进程池损坏）时返回 503 并重建进程池，
+    其他服务端错误返回 500
+    """
+
+    def __init__(self, watermark, workers=None, position='bottom_right', opacity=0.7, scale=0.1,
+                 encoder='default', tile_spacing=DEFAULT_TILE_SPACING, tile_angle=DEFAULT_TILE_ANGLE,
+                 processor_kwargs=None, warm_sizes=(), max_queue=None,
+                 max_body_bytes=DEFAULT_MAX_BODY_BYTES, latency_window=DEFAULT_LATENCY_WINDOW):
+        """
+        Args:
+            watermark: 水印图片路径或文字水印
+            workers: 工作进程数，默认 CPU 核心数
+            position, opacity, scale, encoder, tile_spacing, tile_angle: 请求未指定时的默认值
+            processor_kwargs: 工作进程中创建 WatermarkProcessor 的参数
+            warm_sizes: 启动时预先生成叠加层的图片尺寸 [(宽, 高)]（使用默认大小和透明度）
+            max_queue: 允许排队的请求数，None 表示不限制
+            max_body_bytes: 请求体大小上限
+            latency_window: 延迟统计保留的最近请求数
+        """
+        self.watermark = watermark
+        self.workers = workers or os.cpu_count() or 1
+        self.defaults = {
+            'position': position,
+            'opacity': opacity,
+            'scale': scale,
+            'encoder': encoder,
+            'tile_spacing': tile_spacing,
+            'tile_angle': tile_angle,
+        }
+        self.processor_kwargs = processor_kwargs or {}
+        self.warm_sizes = list(warm_sizes)
+        self.max_queue = max_queue
+        self.max_body_bytes = max_body_bytes
+        self._executor = None
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=latency_window)
+        self._processing = deque(maxlen=latency_window)
+        self._started = time.time()
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.server_errors = 0
+        self.rejected = 0
+        self.restarts = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _create_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self.processor_kwargs, self.watermark, self.warm_sizes,
+                      self.defaults['scale'], self.defaults['opacity'])
+        )
+
+    def start(self):
+        """启动全部工作进程并等待水印加载完成"""
+        self._executor = self._create_executor()
+        # 同时提交与进程数相同的任务，使所有工作进程立即启动
+        futures = [self._executor.submit(_ready) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+        self._started = time.time()
+
+    def _restart(self, broken):
+        """工作进程崩溃后重建进程池（多个请求同时发现时只重建一次）"""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = self._create_executor()
+            self.restarts += 1
+        print("工作进程异常退出，已重建进程池", file=sys.stderr)
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def options_from_query(self, query):
+        """
+        由查询参数生成 watermark_bytes 的参数（未指定的使用默认值）
+
+        Returns:
+            (输出格式或 None, 参数字典, 文件名或 None)
+        """
+        params = {key: values[-1] for key, values in parse_qs(query).items()}
+        options = dict(self.defaults)
+        try:
+            if 'position' in params:
+                options['position'] = params['position']
+            for key in ('opacity', 'scale', 'tile_spacing', 'tile_angle'):
+                if key in params:
+                    options[key] = float(params[key])
+            if 'encoder' in params:
+                options['encoder'] = params['encoder']
+        except ValueError as e:
+            raise RequestError(400, f"参数无效: {e}")
+
+        if options['position'] not in POSITIONS:
+            raise RequestError(400, f"不支持的水印位置: {options['position']}")
+        if not 0.0 <= options['opacity'] <= 1.0:
+            raise RequestError(400, "opacity 必须在 0.0 到 1.0 之间")
+        if not 0.0 < options['scale'] <= 1.0:
+            raise RequestError(400, "scale 必须在 0.0 到 1.0 之间")
+        if options['encoder'] not in ENCODER_PROFILES:
+            raise RequestError(400, f"不支持的编码配置: {options['encoder']}")
+        try:
+            options['tile_spacing'], options['tile_angle'] = validate_tiling(
+                options['tile_spacing'], options['tile_angle'])
+        except ValueError as e:
+            raise RequestError(400, str(e))
+
+        format_name = params.get('format')
+        if format_name is not None and format_name.lower() not in FORMAT_NAMES and format_name.lower() != 'keep':
+            raise RequestError(400, f"不支持的输出格式: {format_name}")
+        return format_name, options, params.get('filename')
+
+    def process(self, data, format_name='keep', options=None, source_name=None):
+        """
+        处理一张图片（阻塞直到完成，可在多个线程中同时调用）
+
+        Returns:
+            (输出数据, 输出格式)
+        """
+        with self._lock:
+            if self.max_queue is not None and self.in_flight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise RequestError(503, "排队的请求过多")
+            self.in_flight += 1
+            self.requests += 1
+            self.bytes_in += len(data)
+
+        start = time.perf_counter()
+        executor = self._executor
+        try:
+            future = executor.submit(_process, data, format_name, options or self.defaults,
+                                     source_name)
+            result, used_format, processing = future.result()
+        except InputError as e:
+            with self._lock:
+                self.errors += 1
+            raise RequestError(422, str(e))
+        except BrokenProcessPool:
+            self._count_server_error()
+            self._restart(executor)
+            raise RequestError(503, "工作进程异常退出，请稍后重试")
+        except Exception as e:
+            self._count_server_error()
+            raise RequestError(500, f"服务端处理出错: {e}")
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+        with self._lock:
+            self._latencies.append(time.perf_counter() - start)
+            self._processing.append(processing)
+            self.bytes_out += len(result)
+        return result, used_format
+
+    def _count_server_error(self):
+        with self._lock:
+            self.errors += 1
+            self.server_errors += 1
+
+    def metrics(self):
+        """
+        运行统计
+
+        latency 为请求从提交到返回的耗时（含排队），processing 为工作进程中的处理耗时，
+        均为最近 latency_window 个成功请求的统计；queue_depth 为等待空闲工作进程的请求数
+        """
+        with self._lock:
+            latencies = list(self._latencies)
+            processing = list(self._processing)
+            return {
+                'workers': self.workers,
+                'uptime': round(time.time() - self._started, 3),
+                'requests': self.requests,
+                'errors': self.errors,
+                'server_errors': self.server_errors,
+                'rejected': self.rejected,
+                'restarts': self.restarts,
+                'in_flight': self.in_flight,
+                'queue_depth': max(0, self.in_flight - self.workers),
+                'max_queue': self.max_queue,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'latency': summarize(latencies),
+                'processing': summarize(processing),
+            }
+
+
+class WatermarkRequestHandler(BaseHTTPRequestHandler):
+    """HTTP 请求处理（self.server.service 为 WatermarkService）"""
+
+    server_version = 'WatermarkServer/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/metrics':
+            self._send_json(200, self.server.service.metrics())
+        elif path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': f"未知路径: {path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/watermark':
+            self._discard_body()
+            self._send_json(404, {'error': f"未知路径: {url.path}"})
+            return
+        service = self.server.service
+        try:
+            # 先读取请求体，参数无效时连接仍可继续使用
+            data = self._read_body(service.max_body_bytes)
+            format_name, options, source_name = service.options_from_query(url.query)
+            if format_name is None:
+                format_name = format_from_accept(self.headers.get('Accept'))
+                if format_name is None:
+                    raise RequestError(406, "Accept 中没有支持的图片格式")
+            result, used_format = service.process(data, format_name, options, source_name)
+        except RequestError as e:
+            self._send_json(e.status, {'error': str(e)})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', MIME_TYPES.get(used_format, 'application/octet-stream'))
+        self.send_header('Content-Length', str(len(result)))
+        self.end_headers()
+        self.wfile.write(result)
+
+    def _read_body(self, max_bytes):
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.close_connection = True
+            raise RequestError(411, "缺少 Content-Length")
+        try:
+            length = int(length)
+        except ValueError:
+            self.close_connection = True
+            raise RequestError(400, f"Content-Length 无效: {length}")
+        if length > max_bytes:
+            # 不读取过大的请求体，直接关闭连接
+            self.close_connection = True
+            raise RequestError(413, f"请求体超过上限 {max_bytes} 字节")
+        if length == 0:
+            raise RequestError(400, "请求体为空")
+        return self.rfile.read(length)
+
+    def _discard_body(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = 0
+        if 0 < length <= self.server.service.max_body_bytes:
+            self.rfile.read(length)
+        elif length:
+            self.close_connection = True
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} - {format % args}", file=sys.stderr)
+
+
+def create_server(service, host='127.0.0.1', port=8080):
+    """创建 HTTP 服务（service 需已启动），调用 serve_forever() 开始处理请求"""
+    server = ThreadingHTTPServer((host, port), WatermarkRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def _parse_size(text):
+    try:
+        width, height = (int(part) for part in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"尺寸格式应为 宽x高: {text}")
+    if width < 1 or height < 1:
+        raise argparse.ArgumentTypeError(f"尺寸必须大于 0: {text}")
+    return width, height
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='watermark_server', description='水印 HTTP 服务')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-w', '--watermark', help='水印图片路径')
+    source.add_argument('--text', help='文字水印（可使用模板字段，{filename} 取自请求的 filename 参数）')
+    parser.add_argument('--font', help='文字水印的字体文件')
+    parser.add_argument('--text-color', default='white', help='文字颜色（默认 white）')
+    parser.add_argument('--stroke-width', type=float, default=0.0, help='文字描边宽度（相对于字号）')
+    parser.add_argument('--stroke-color', default='black', help='文字描边颜色（默认 black）')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址（默认 127.0.0.1）')
+    parser.add_argument('--port', type=int, default=8080, help='监听端口（默认 8080）')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='工作进程数（默认 CPU 核心数）')
+    parser.add_argument('--max-queue', type=int, default=None,
+                        help='允许排队的请求数，超过时返回 503（默认不限制）')
+    parser.add_argument('--max-body-mb', type=int, default=DEFAULT_MAX_BODY_BYTES // (1024 * 1024),
+                        help='请求体大小上限（MB，默认 64）')
+    parser.add_argument('--position', choices=POSITIONS, default='bottom_right', help='默认水印位置')
+    parser.add_argument('--opacity', type=float, default=0.7, help='默认透明度（默认 0.7）')
+    parser.add_argument('--scale', type=float, default=0.1, help='默认水印大小比例（默认 0.1）')
+    parser.add_argument('--encoder', choices=list(ENCODER_PROFILES), default='default', help='默认编码配置')
+    parser.add_argument('--cache-mb', type=int, default=64, help='每个工作进程的水印叠加层缓存上限（MB，默认 64）')
+    parser.add_argument('--warm-size', type=_parse_size, action='append', default=[], metavar='宽x高',
+                        help='启动时按默认大小和透明度预先生成该尺寸图片的叠加层（可重复指定）')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.watermark and not os.path.isfile(args.watermark):
+        parser.error(f"水印文件不存在: {args.watermark}")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers 必须大于 0")
+    if args.max_queue is not None and args.max_queue < 0:
+        parser.error("--max-queue 不能为负数")
+    if not 0.0 <= args.opacity <= 1.0 or not 0.0 < args.scale <= 1.0:
+        parser.error("--opacity 必须在 0.0 到 1.0 之间，--scale 必须在 0.0 到 1.0 之间")
+
+    if args.text:
+        try:
+            watermark = TextWatermark(args.text, font_path=args.font, color=args.text_color,
+                                      stroke_width=args.stroke_width, stroke_color=args.stroke_color)
+        except (ValueError, OSError) as e:
+            parser.error(f"文字水印设置无效: {e}")
+    else:
+        watermark = args.watermark
+
+    service = WatermarkService(
+        watermark,
+        workers=args.workers,
+        position=args.position,
+        opacity=args.opacity,
+        scale=args.scale,
+        encoder=args.encoder,
+        processor_kwargs={'cache_max_bytes': args.cache_mb * 1024 * 1024},
+        warm_sizes=args.warm_size,
+        max_queue=args.max_queue,
+        max_body_bytes=args.max_body_mb * 1024 * 1024,
+    )
+    with service:
+        server = create_server(service, args.host, args.port)
+        print(f"水印服务已启动: http://{args.host}:{server.server_port}（{service.workers} 个工作进程）",
+              file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分片处理模块
+按源文件相对路径的稳定哈希把文件分配到 N 个分片，多个进程或多台机器各自处理
+互不重叠的一部分，输出到同一个输出目录；每个分片使用单独的处理清单和批处理日志，
+全部分片结束后用 merge 合并各分片的运行报告，并把分片清单并入输出目录的处理清单
+
+用法:
+    python -m watermark_cli 源目录 -w watermark.png --shard-index 0 --shard-count 3 --report r0.json
+    ...
+    python -m watermark_shard merge r0.json r1.json r2.json --output-dir 源目录/watermarked
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+
+from watermark_manifest import MANIFEST_FILENAME, ProcessedManifest
+
+
+def validate_shard(shard_index, shard_count):
+    """检查分片参数"""
+    if shard_count < 1:
+        raise ValueError(f"分片数必须大于 0: {shard_count}")
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"分片序号必须在 0 到 {shard_count - 1} 之间: {shard_index}")
+
+
+def shard_of(relative_path, shard_count):
+    """
+    计算文件所属的分片
+
+    只取决于 / 分隔的相对路径，与机器、进程、扫描顺序和 Python 的哈希随机化无关
+    """
+    key = Path(relative_path).as_posix().encode('utf-8')
+    digest = hashlib.blake2b(key, digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shard_count
+
+
+def shard_filename(filename, shard_index, shard_count):
+    """分片使用的文件名，如 .watermark_manifest.sqlite -> .watermark_manifest.shard-0-of-3.sqlite"""
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.shard-{shard_index}-of-{shard_count}{ext}"
+
+
+def iter_shard(image_files, input_dir, shard_index, shard_count):
+    """只生成属于指定分片的文件"""
+    input_path = Path(input_dir)
+    for image_file in image_files:
+        if shard_of(image_file.relative_to(input_path), shard_count) == shard_index:
+            yield image_file
+
+
+def merge_manifests(output_dir):
+    """
+    把输出目录中各分片的处理清单并入主清单，并删除分片清单
+
+    Returns:
+        int: 合并的记录数
+    """
+    stem, ext = os.path.splitext(MANIFEST_FILENAME)
+    pattern = os.path.join(glob.escape(str(output_dir)), f"{stem}.shard-*-of-*{ext}")
+    merged = 0
+    with ProcessedManifest(output_dir) as manifest:
+        for shard_manifest in sorted(glob.glob(pattern)):
+            merged += manifest.merge_from(shard_manifest)
+            os.remove(shard_manifest)
+    return merged
+
+
+def merge_reports(reports):
+    """
+    合并各分片的运行报告（watermark_cli 的 JSON 汇总）
+
+    Args:
+        reports: 报告字典列表，每个报告的 'shard' 为 {'index', 'count'}
+
+    Returns:
+        dict: 合并后的汇总，missing_shards 为没有报告的分片
+    """
+    if not reports:
+        raise ValueError("没有需要合并的报告")
+
+    counts = {report.get('shard', {}).get('count', 1) for report in reports}
+    if len(counts) != 1:
+        raise ValueError(f"报告的分片数不一致: {sorted(counts)}")
+    shard_count = counts.pop()
+
+    by_index = {}
+    for report in reports:
+        index = report.get('shard', {}).get('index', 0)
+        if index in by_index:
+            raise ValueError(f"分片 {index} 有多个报告")
+        by_index[index] = report
+
+    # 各分片并行运行，整体耗时取最慢的分片
+    wall_time = max(report.get('wall_time', 0.0) for report in reports)
+    success = sum(report.get('success', 0) for report in reports)
+    errors = [error for index in sorted(by_index) for error in by_index[index].get('errors', [])]
+    return {
+        'shard_count': shard_count,
+        'shards': sorted(by_index),
+        'missing_shards': [i for i in range(shard_count) if i not in by_index],
+        'total': sum(report.get('total', 0) for report in reports),
+        'success': success,
+        'failed': sum(report.get('failed', 0) for report in reports),
+        'errors': errors,
+        'wall_time': wall_time,
+        'images_per_sec': round(success / wall_time, 3) if wall_time > 0 else 0.0,
+        'per_shard': [
+            {
+                'index': index,
+                'host': by_index[index].get('host'),
+                'total': by_index[index].get('total', 0),
+                'success': by_index[index].get('success', 0),
+                'failed': by_index[index].get('failed', 0),
+                'wall_time': by_index[index].get('wall_time', 0.0),
+            }
+            for index in sorted(by_index)
+        ],
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='watermark_shard', description='合并分片处理的结果')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    merge = subparsers.add_parser('merge', help='合并各分片的运行报告和处理清单')
+    merge.add_argument('reports', nargs='+', help='各分片的运行报告（--report 写出的 JSON 文件）')
+    merge.add_argument('--output-dir', help='输出目录，指定时把各分片的处理清单并入主清单')
+    merge.add_argument('-o', '--output', help='合并后的报告写入此文件（默认只输出到标准输出）')
+    return parser
+
+
+def main(argv=None):
+    """返回进程退出码（0 成功，1 有文件处理失败或缺少分片报告，2 执行出错）"""
+    args = build_parser().parse_args(argv)
+    try:
+        reports = []
+        for path in args.reports:
+            with open(path, 'r', encoding='utf-8') as f:
+                reports.append(json.load(f))
+        summary = merge_reports(reports)
+        if args.output_dir:
+            summary['manifest_records_merged'] = merge_manifests(args.output_dir)
+    except Exception as e:
+        print(json.dumps({'error': str(e)}, ensure_ascii=False))
+        return 2
+
+    text = json.dumps(summary, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
+    return 1 if summary['failed'] or summary['missing_shards'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
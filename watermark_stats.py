@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+处理统计模块
+按阶段（读取、打开、解码、转换、渲染文字、缩放水印、透明度、平铺、合成、保存、写出）统计单张图片的耗时和字节数，
+汇总批量处理的分位数统计，并可将每个文件的记录写入 JSON Lines 日志
+"""
+
+import json
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+
+# 处理阶段（按处理顺序）；read 和 write 只在流水线模式中单独统计，
+# 其他模式下文件读写包含在 open/decode 和 save 中
+STAGES = ('read', 'open', 'decode', 'convert', 'text', 'resize', 'opacity', 'tile', 'paste',
+          'save', 'write')
+
+# 汇总统计中的分位数
+PERCENTILES = (50, 90, 99)
+
+
+class StageTimer:
+    """
+    单张图片的分阶段计时器
+
+    阶段可以嵌套（例如动图在保存过程中逐帧解码），
+    嵌套时外层阶段暂停计时，各阶段耗时互不重叠
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self._stack = []  # [阶段名, 本段开始时间]
+
+    @contextmanager
+    def stage(self, name):
+        """统计一个阶段的耗时（同名阶段累加）"""
+        now = time.perf_counter()
+        if self._stack:
+            self._credit(self._stack[-1], now)
+        entry = [name, now]
+        self._stack.append(entry)
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self._stack.pop()
+            self._credit(entry, now)
+            if self._stack:
+                self._stack[-1][1] = now
+
+    def _credit(self, entry, now):
+        name, started = entry
+        self.stages[name] = self.stages.get(name, 0.0) + (now - started)
+        entry[1] = now
+
+    def count(self, name, value):
+        """累加计数（字节数、像素数、帧数等）"""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self, source, output=None, error=None, peak_bytes=None):
+        """
+        生成单个文件的统计记录
+
+        Args:
+            peak_bytes: 处理该图片时图片缓冲区的内存峰值（字节），未知时为 None
+
+        Returns:
+            dict: {'source', 'output', 'error', 'total', 'stages', 'counters', 'peak_bytes'}
+        """
+        return {
+            'source': str(source),
+            'output': str(output) if output is not None else None,
+            'error': error,
+            'total': round(time.perf_counter() - self.started, 6),
+            'stages': {name: round(seconds, 6) for name, seconds in self.stages.items()},
+            'counters': dict(self.counters),
+            'peak_bytes': peak_bytes,
+        }
+
+
+class _NullTimer:
+    """不统计时使用的空计时器"""
+
+    enabled = False
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def count(self, name, value):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+def percentile(values, pct):
+    """计算分位数（最近秩法），values 为空时返回 0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(values):
+    """汇总一组耗时：次数、总计、平均、分位数、最大值"""
+    if not values:
+        return {'count': 0, 'total': 0.0, 'mean': 0.0, 'max': 0.0}
+    ordered = sorted(values)
+    total = sum(ordered)
+    result = {
+        'count': len(ordered),
+        'total': round(total, 6),
+        'mean': round(total / len(ordered), 6),
+        'max': round(ordered[-1], 6),
+    }
+    for pct in PERCENTILES:
+        result[f'p{pct}'] = round(percentile(ordered, pct), 6)
+    return result
+
+
+class BatchStats:
+    """批量处理的汇总统计（各阶段耗时以紧凑数组保存，文件数很多时内存占用也较小）"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files = 0
+        self.failed = 0
+        self.totals = array('d')
+        self.stages = {}
+        self.counters = {}
+        self.peaks = array('d')
+
+    def add(self, record):
+        """加入一个文件的统计记录"""
+        self.files += 1
+        if record.get('error'):
+            self.failed += 1
+        self.totals.append(record['total'])
+        for name, seconds in record['stages'].items():
+            self.stages.setdefault(name, array('d')).append(seconds)
+        for name, value in record['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        if record.get('peak_bytes') is not None:
+            self.peaks.append(record['peak_bytes'])
+
+    def summary(self):
+        """
+        获取汇总结果
+
+        Returns:
+            dict: 文件数、失败数、总耗时、每秒处理张数、单张耗时和各阶段耗时分布、计数合计、
+                单张图片内存峰值的分布（peak_bytes：平均、最大值和分位数，字节）
+        """
+        wall_time = time.perf_counter() - self.started
+        ordered_stages = [name for name in STAGES if name in self.stages]
+        ordered_stages += sorted(set(self.stages) - set(STAGES))
+        return {
+            'files': self.files,
+            'failed': self.failed,
+            'wall_time': round(wall_time, 3),
+            'images_per_sec': round(self.files / wall_time, 3) if wall_time > 0 else 0.0,
+            'per_file': summarize(self.totals),
+            'stages': {name: summarize(self.stages[name]) for name in ordered_stages},
+            'counters': dict(self.counters),
+            'peak_bytes': {name: int(value) for name, value in summarize(self.peaks).items()
+                           if name != 'total'},
+        }
+
+
+class JsonLinesLog:
+    """将每个文件的统计记录逐行写入 JSON Lines 文件（可直接作为统计回调使用）"""
+
+    def __init__(self, path, append=False):
+        self.path = str(path)
+        self._file = open(self.path, 'a' if append else 'w', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大图分条处理模块
+对未压缩的 BMP 图片按条带直接从文件读取、添加水印并写出，内存中只保留一个条带
+和水印叠加层，适用于上亿像素的全景图等超大图片；其他格式的解码器需要整张解码，
+仍走常规流程
+"""
+
+import struct
+
+from PIL import Image
+
+from watermark_stats import NULL_TIMER
+
+# 每个条带的行数
+DEFAULT_STRIP_ROWS = 256
+
+# 超过该像素数的图片在格式允许时分条处理
+STRIP_MIN_PIXELS = 32_000_000
+
+# 支持分条读取的源图片模式
+STRIP_SOURCE_MODES = {'RGB', 'RGBA', 'L', 'P'}
+
+
+def can_process_in_strips(img, format_name):
+    """判断打开（尚未解码）的图片能否分条处理：源图片和输出格式均为未压缩的 BMP"""
+    if img.format != 'BMP' or format_name != 'BMP' or img.mode not in STRIP_SOURCE_MODES:
+        return False
+    if img.info.get('compression', 0) != 0:
+        return False
+    tile = getattr(img, 'tile', None)
+    if not tile or len(tile) != 1:
+        return False
+    codec, extents, _, args = tile[0]
+    return (codec == 'raw' and tuple(extents) == (0, 0) + img.size
+            and isinstance(args, tuple) and len(args) == 3 and args[2] in (1, -1))
+
+
+def strip_bytes(size, strip_rows=DEFAULT_STRIP_ROWS):
+    """估算分条处理时的内存占用（源条带 + RGB 条带）"""
+    width, height = size
+    return width * min(strip_rows, height) * 4 * 2
+
+
+def iter_strips(img, strip_rows=DEFAULT_STRIP_ROWS, bottom_up=True):
+    """
+    按条带读取图片数据
+
+    Args:
+        img: Image.open 打开且满足 can_process_in_strips 的 BMP 图片
+        strip_rows: 每个条带的行数
+        bottom_up: 是否从图片底部开始读取（与 BMP 的存储顺序一致）
+
+    Yields:
+        (条带顶部所在行, 条带图片)，条带图片模式与源图片相同
+    """
+    _, _, offset, (rawmode, stride, orientation) = img.tile[0]
+    width, height = img.size
+    palette = img.palette if img.mode == 'P' else None
+
+    tops = range(0, height, strip_rows)
+    for top in (reversed(tops) if bottom_up else tops):
+        rows = min(strip_rows, height - top)
+        # 自下而上存储的 BMP 中，图片第 top 行位于文件第 height - 1 - top 行
+        first_row = height - top - rows if orientation == -1 else top
+        img.fp.seek(offset + first_row * stride)
+        data = img.fp.read(rows * stride)
+        if len(data) < rows * stride:
+            raise ValueError("BMP 文件数据不完整")
+
+        strip = Image.frombuffer(img.mode, (width, rows), data, 'raw', rawmode, stride, orientation)
+        if palette is not None:
+            strip.putpalette(palette.palette, palette.rawmode or palette.mode)
+        yield top, strip
+
+
+class BmpStripWriter:
+    """逐条写出 24 位 BMP（文件头与 Pillow 保存的一致），条带须按自下而上的顺序写入"""
+
+    def __init__(self, fp, size, dpi=(96, 96)):
+        self.fp = fp
+        self.width, self.height = size
+        self.stride = (self.width * 3 + 3) & ~3
+        image_bytes = self.stride * self.height
+        offset = 14 + 40
+        if offset + image_bytes > 2 ** 32 - 1:
+            raise ValueError("图片过大，无法保存为 BMP")
+
+        ppm = [int(x * 39.3701 + 0.5) for x in dpi]
+        fp.write(b'BM' + struct.pack('<III', offset + image_bytes, 0, offset))
+        fp.write(struct.pack('<IiiHHIIiiII', 40, self.width, self.height, 1, 24, 0,
+                             image_bytes, ppm[0], ppm[1], 0, 0))
+
+    def write(self, strip):
+        """写出一个 RGB 条带"""
+        self.fp.write(strip.tobytes('raw', ('BGR', self.stride, -1)))
+
+
+def watermark_in_strips(img, fp, overlay, position_coords, to_rgb,
+                        strip_rows=DEFAULT_STRIP_ROWS, timer=NULL_TIMER):
+    """
+    分条添加水印并写出 BMP
+
+    Args:
+        img: 满足 can_process_in_strips 的源图片（未解码）
+        fp: 已打开的二进制输出文件
+        overlay: RGBA 水印叠加层
+        position_coords: 水印在整张图片中的位置
+        to_rgb: 将条带转换为 RGB 的函数
+        strip_rows: 每个条带的行数
+        timer: 分阶段计时器
+
+    Returns:
+        int: 写出的条带数
+    """
+    x, y = position_coords
+    writer = BmpStripWriter(fp, img.size)
+    strips = iter_strips(img, strip_rows)
+    count = 0
+    while True:
+        with timer.stage('decode'):
+            item = next(strips, None)
+        if item is None:
+            return count
+        top, strip = item
+        with timer.stage('convert'):
+            rgb_strip = to_rgb(strip)
+        # 只有与水印区域相交的条带需要合成，超出条带的部分由 paste 自动裁剪
+        if y < top + rgb_strip.height and y + overlay.height > top:
+            with timer.stage('paste'):
+                rgb_strip.paste(overlay, (x, y - top), overlay)
+        with timer.stage('save'):
+            writer.write(rgb_strip)
+        count += 1
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文字水印模块
+用字体文件渲染文字水印，支持按图片填充的模板（文件名、拍摄日期等）。
+渲染好的文字层由处理器按 (文字, 字体, 字号, 样式) 放入水印缓存，
+批量处理中重复出现的文字不会对每张图片重新栅格化
+"""
+
+import functools
+import os
+import string
+from datetime import datetime
+from pathlib import Path
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from watermark_manifest import file_content_hash
+
+# 文字层缓存键的第一个元素（水印文件的缓存键以绝对路径开头，二者不会冲突）
+TEXT_CACHE_KEY = '<text>'
+
+# EXIF 标签：拍摄时间（位于 Exif 子 IFD）和修改时间
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+EXIF_DATETIME = 0x0132
+
+# 模板中可用的字段
+TEMPLATE_FIELDS = {
+    'filename': '文件名（含扩展名）',
+    'stem': '文件名（不含扩展名）',
+    'ext': '扩展名（不含点）',
+    'parent': '所在目录名',
+    'date': '拍摄日期 YYYY-MM-DD（无 EXIF 时为文件修改日期）',
+    'time': '拍摄时间 HH:MM:SS',
+    'year': '拍摄年份',
+    'datetime': '拍摄时间，可指定 strftime 格式，如 {datetime:%Y/%m/%d}',
+}
+
+# 需要读取拍摄时间的字段
+_DATE_FIELDS = {'date', 'time', 'year', 'datetime'}
+
+
+def _template_fields(text):
+    """解析模板中引用的字段名"""
+    fields = set()
+    for _, field_name, _, _ in string.Formatter().parse(text):
+        if field_name is not None:
+            fields.add(field_name)
+    return fields
+
+
+def _exif_datetime(img):
+    """读取 EXIF 拍摄时间，没有或无法解析时返回 None"""
+    try:
+        exif = img.getexif()
+    except Exception:
+        return None
+    value = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(str(value).strip('\0 '), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+
+
+class TextWatermark:
+    """
+    文字水印设置
+
+    可以代替水印文件路径传给 WatermarkProcessor 的各个方法；
+    只包含普通属性，可以随任务传给工作进程
+    """
+
+    def __init__(self, text, font_path=None, color='white', stroke_width=0.0,
+                 stroke_color='black', template=True):
+        """
+        Args:
+            text: 水印文字，可包含多行；template 为 True 时可使用 {filename}、{date} 等模板字段
+            font_path: 字体文件路径（TrueType/OpenType），为空时使用 Pillow 内置字体
+                （不含中文字形，中文文字需要指定字体）
+            color: 文字颜色（'#RRGGBB'、'#RRGGBBAA' 或颜色名）
+            stroke_width: 描边宽度，相对于字号的比例（如 0.05），0 表示不描边
+            stroke_color: 描边颜色
+            template: 是否将 text 作为模板按图片填充
+        """
+        if not text:
+            raise ValueError("水印文字不能为空")
+        if font_path is not None and not os.path.exists(font_path):
+            raise FileNotFoundError(f"字体文件不存在: {font_path}")
+        if stroke_width < 0:
+            raise ValueError(f"描边宽度不能为负数: {stroke_width}")
+
+        self.text = text
+        self.font_path = os.path.abspath(font_path) if font_path else None
+        self.color = ImageColor.getcolor(color, 'RGBA') if isinstance(color, str) else tuple(color)
+        self.stroke_width = float(stroke_width)
+        self.stroke_color = (ImageColor.getcolor(stroke_color, 'RGBA')
+                             if isinstance(stroke_color, str) else tuple(stroke_color))
+        self.template = template
+
+        self.fields = _template_fields(text) if template else set()
+        unknown = self.fields - set(TEMPLATE_FIELDS)
+        if unknown:
+            raise ValueError(f"未知的模板字段: {', '.join(sorted(unknown))}")
+
+    def __repr__(self):
+        return f"TextWatermark({self.text!r})"
+
+    @property
+    def is_template(self):
+        return bool(self.fields)
+
+    def font_signature(self):
+        """字体文件签名（修改时间和大小），字体文件变化时缓存自动失效"""
+        if self.font_path is None:
+            return None
+        stat = os.stat(self.font_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def style_key(self):
+        """样式部分的缓存键（不含文字和字号）"""
+        return (self.font_path, self.font_signature(), self.color,
+                round(self.stroke_width, 4), self.stroke_color)
+
+    def cache_key(self):
+        """缓存键的前缀：(文字标记, 文字, 样式)"""
+        return (TEXT_CACHE_KEY, self.text) + self.style_key()
+
+    def describe(self):
+        """用于计算设置指纹的描述（字体按内容参与计算）"""
+        return {
+            'text': self.text,
+            'template': self.template,
+            'font': file_content_hash(self.font_path) if self.font_path else None,
+            'color': self.color,
+            'stroke_width': self.stroke_width,
+            'stroke_color': self.stroke_color,
+        }
+
+    def template_values(self, source_path=None, img=None):
+        """
+        获取模板字段的值
+
+        Args:
+            source_path: 源图片路径（流式处理时可为空）
+            img: 已打开的源图片，用于读取 EXIF；为空且需要拍摄时间时从 source_path 读取文件头
+
+        Returns:
+            dict: 模板字段 -> 值
+        """
+        path = Path(source_path) if source_path else None
+        values = {
+            'filename': path.name if path else '',
+            'stem': path.stem if path else '',
+            'ext': path.suffix.lstrip('.') if path else '',
+            'parent': path.parent.name if path else '',
+        }
+        if self.fields & _DATE_FIELDS:
+            taken = None
+            if img is not None:
+                taken = _exif_datetime(img)
+            elif path is not None:
+                with Image.open(path) as opened:
+                    taken = _exif_datetime(opened)
+            if taken is None:
+                taken = (datetime.fromtimestamp(os.path.getmtime(path))
+                         if path and path.exists() else datetime.now())
+            values.update({
+                'date': taken.strftime('%Y-%m-%d'),
+                'time': taken.strftime('%H:%M:%S'),
+                'year': taken.strftime('%Y'),
+                'datetime': taken,
+            })
+        return values
+
+    def resolve(self, source_path=None, img=None):
+        """
+        按图片填充模板
+
+        Returns:
+            TextWatermark: 文字已确定的文字水印（不含模板字段时返回自身）
+        """
+        if not self.is_template:
+            return self
+        text = self.text.format_map(self.template_values(source_path, img))
+        resolved = TextWatermark.__new__(TextWatermark)
+        resolved.__dict__.update(self.__dict__)
+        resolved.text = text
+        resolved.template = False
+        resolved.fields = set()
+        return resolved
+
+    def pixel_size(self, base_size, scale):
+        """字号（像素）：图片最大边乘以缩放比例，与图片水印的缩放方式一致"""
+        return max(1, int(max(base_size) * scale))
+
+    def render(self, pixel_size):
+        """
+        渲染文字层
+
+        Returns:
+            RGBA 模式的文字图片（裁剪到文字边界）
+        """
+        font = load_font(self.font_path, pixel_size)
+        stroke = int(round(pixel_size * self.stroke_width))
+        if self.stroke_width and not stroke:
+            stroke = 1
+
+        probe = ImageDraw.Draw(Image.new('L', (1, 1)))
+        left, top, right, bottom = probe.textbbox((0, 0), self.text, font=font,
+                                                  stroke_width=stroke)
+        layer = Image.new('RGBA', (max(1, right - left), max(1, bottom - top)), (0, 0, 0, 0))
+        ImageDraw.Draw(layer).text((-left, -top), self.text, font=font, fill=self.color,
+                                   stroke_width=stroke, stroke_fill=self.stroke_color)
+        return layer
+
+
+@functools.lru_cache(maxsize=32)
+def load_font(font_path, pixel_size):
+    """加载指定字号的字体（进程内缓存）"""
+    if font_path is not None:
+        return ImageFont.truetype(font_path, pixel_size)
+    try:
+        return ImageFont.load_default(size=pixel_size)
+    except TypeError:
+        raise ValueError("当前 Pillow 版本的内置字体不支持缩放，请指定字体文件")
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+平铺水印模块
+将（已缩放并应用透明度的）水印旋转后错行平铺成整张图片大小的叠加层，
+叠加层按图片尺寸缓存，同尺寸的图片只需一次合成即可铺满水印
+"""
+
+from PIL import Image
+
+# 平铺位置名称
+TILED_POSITION = 'tiled'
+
+# 全部水印位置
+POSITIONS = ('top_left', 'top_right', 'bottom_left', 'bottom_right', 'center', TILED_POSITION)
+
+# 默认间距：相邻水印之间的空白为水印尺寸的该比例
+DEFAULT_TILE_SPACING = 0.5
+
+# 默认旋转角度（度，逆时针）
+DEFAULT_TILE_ANGLE = 30
+
+
+def validate_tiling(spacing, angle):
+    """校验平铺参数，返回规范化后的 (间距, 角度)"""
+    spacing = float(spacing)
+    if spacing < 0:
+        raise ValueError(f"平铺间距不能为负数: {spacing}")
+    return round(spacing, 4), round(float(angle) % 360, 4)
+
+
+def rotate_mark(mark, angle):
+    """旋转水印（扩展画布以保留完整水印），角度为 0 时直接返回原图"""
+    if not angle:
+        return mark
+    return mark.rotate(angle, resample=Image.Resampling.BICUBIC, expand=True)
+
+
+def tile_positions(base_size, tile_size, spacing):
+    """
+    计算平铺时每个水印的左上角坐标（奇数行错开半个间隔，形成斜向排列）
+
+    Args:
+        base_size: 图片尺寸 (宽, 高)
+        tile_size: 旋转后的水印尺寸 (宽, 高)
+        spacing: 间距比例
+
+    Yields:
+        (x, y): 水印左上角坐标（可能为负数或超出图片，超出部分会被裁掉）
+    """
+    width, height = base_size
+    tile_width, tile_height = tile_size
+    step_x = max(1, int(round(tile_width * (1 + spacing))))
+    step_y = max(1, int(round(tile_height * (1 + spacing))))
+
+    for row, y in enumerate(range(-(step_y // 2), height, step_y)):
+        offset = step_x // 2 if row % 2 else 0
+        for x in range(offset - step_x, width, step_x):
+            if x + tile_width > 0 and y + tile_height > 0:
+                yield x, y
+
+
+def render_tiled_overlay(mark, base_size, spacing=DEFAULT_TILE_SPACING,
+                         angle=DEFAULT_TILE_ANGLE):
+    """
+    生成整张图片大小的平铺水印叠加层
+
+    Args:
+        mark: 已缩放并应用透明度的 RGBA 水印
+        base_size: 图片尺寸 (宽, 高)
+        spacing: 间距比例（不小于 0，水印之间不重叠）
+        angle: 旋转角度
+
+    Returns:
+        RGBA 模式的叠加层，与图片同尺寸
+    """
+    tile = rotate_mark(mark, angle)
+    overlay = Image.new('RGBA', base_size, (0, 0, 0, 0))
+    # 水印之间不重叠，直接复制像素即可，无需逐个混合
+    for coords in tile_positions(base_size, tile.size, spacing):
+        overlay.paste(tile, coords)
+    return overlay
@@ -9,14 +9,25 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
 import threading
+import multiprocessing
 from pathlib import Path
-from watermark_processor import WatermarkProcessor
+from PIL import ImageTk
+from watermark_processor import WatermarkProcessor, WATERMARKED_DIR_NAMES
+from watermark_control import BatchControl, ProgressMonitor, format_duration
+from watermark_encoder import ENCODER_PROFILES, OUTPUT_FORMATS
+from watermark_tiling import TILED_POSITION
+
+# 预览图最大尺寸
+PREVIEW_MAX_SIZE = (900, 600)
+
+# 处理过程中刷新进度显示的间隔（毫秒），与处理速度无关
+PROGRESS_REFRESH_MS = 200
 
 class WatermarkApp:
     def __init__(self, root):
         self.root = root
         self.root.title("imgAddWatermark v2.0 - 批量水印添加工具")
-        self.root.geometry("800x750")
+        self.root.geometry("800x820")
         self.root.resizable(True, True)
         
         # 设置窗口图标
@@ -37,6 +48,8 @@ class WatermarkApp:
         self.position = tk.StringVar(value="bottom_right")
         self.opacity = tk.DoubleVar(value=0.7)
         self.scale = tk.DoubleVar(value=0.1)
+        self.encoder = tk.StringVar(value="default")  # 编码配置
+        self.output_format = tk.StringVar(value="keep")  # 输出格式
         self.progress_var = tk.DoubleVar()
         
         # 新增智能检测选项
@@ -44,6 +57,18 @@ class WatermarkApp:
         self.output_mode = tk.StringVar(value="watermarked")  # 输出模式
         self.auto_detect_watermarked = tk.BooleanVar(value=True)  # 自动检测 watermarked 目录
         
+        # 预览窗口
+        self.preview_window = None
+        self.preview_label = None
+        self.preview_photo = None
+        self._preview_sample = None  # (源目录, 预览图片路径)
+        self._preview_after_id = None
+        
+        # 批量处理的暂停 / 取消控制和进度记录（处理时创建）
+        self.control = None
+        self.progress_monitor = None
+        self._progress_after_id = None
+        
         self.setup_ui()
         
     def setup_ui(self):
@@ -80,7 +105,7 @@ class WatermarkApp:
         # 水印位置
         ttk.Label(settings_frame, text="水印位置:").grid(row=0, column=0, sticky=tk.W, pady=5)
         position_combo = ttk.Combobox(settings_frame, textvariable=self.position, 
-                                    values=["top_left", "top_right", "bottom_left", "bottom_right", "center"],
+                                    values=["top_left", "top_right", "bottom_left", "bottom_right", "center", TILED_POSITION],
                                     state="readonly")
         position_combo.grid(row=0, column=1, sticky="ew", padx=(5, 0), pady=5)
         
@@ -118,6 +143,18 @@ class WatermarkApp:
             scale_label.config(text=f"{int(self.scale.get() * 100)}%")
         self.scale.trace('w', update_scale_label)
         
+        # 编码配置
+        ttk.Label(settings_frame, text="编码配置:").grid(row=3, column=0, sticky=tk.W, pady=5)
+        ttk.Combobox(settings_frame, textvariable=self.encoder,
+                     values=list(ENCODER_PROFILES), state="readonly").grid(
+            row=3, column=1, sticky="ew", padx=(5, 0), pady=5)
+        
+        # 输出格式
+        ttk.Label(settings_frame, text="输出格式:").grid(row=4, column=0, sticky=tk.W, pady=5)
+        ttk.Combobox(settings_frame, textvariable=self.output_format,
+                     values=list(OUTPUT_FORMATS), state="readonly").grid(
+            row=4, column=1, sticky="ew", padx=(5, 0), pady=5)
+        
         # 输出和智能检测设置框架
         smart_frame = ttk.LabelFrame(main_frame, text="输出和智能检测设置", padding="10")
         smart_frame.grid(row=4, column=0, columnspan=3, sticky="ew", pady=10)
@@ -194,9 +231,20 @@ class WatermarkApp:
                                      command=self.start_processing, style="Accent.TButton")
         self.start_button.pack(side=tk.LEFT, padx=(0, 10))
         
+        self.pause_button = ttk.Button(button_frame, text="暂停", command=self.toggle_pause,
+                                       state="disabled")
+        self.pause_button.pack(side=tk.LEFT, padx=(0, 10))
+        self.cancel_button = ttk.Button(button_frame, text="取消", command=self.cancel_processing,
+                                        state="disabled")
+        self.cancel_button.pack(side=tk.LEFT, padx=(0, 10))
+        
         ttk.Button(button_frame, text="预览效果", command=self.preview_watermark).pack(side=tk.LEFT, padx=(0, 10))
         ttk.Button(button_frame, text="清空设置", command=self.clear_settings).pack(side=tk.LEFT)
         
+        # 水印设置变化时自动刷新已打开的预览
+        for var in (self.position, self.opacity, self.scale):
+            var.trace('w', self.schedule_preview_refresh)
+        
         # 设置默认水印文件
         watermark_file = Path("watermark.png")
         if watermark_file.exists():
@@ -254,13 +302,9 @@ class WatermarkApp:
     
     def get_actual_output_dir(self):
         """获取实际输出目录"""
-        source_path = Path(self.source_dir.get())
-        if self.output_mode.get() == "watermarked":
-            return str(source_path / "watermarked")
-        elif self.output_mode.get() == "watermarked_new":
-            return str(source_path / "watermarked_new")
-        else:  # custom
-            return self.output_dir.get()
+        return self.processor.resolve_output_dir(
+            self.source_dir.get(), self.output_mode.get(), self.output_dir.get()
+        )
     
     def get_watermarked_dir(self):
         """获取水印检测目录"""
@@ -268,138 +312,232 @@ class WatermarkApp:
         return str(source_path / "watermarked")
     
     def preview_watermark(self):
-        """预览水印效果"""
+        """预览水印效果（在窗口内直接显示缩小后的预览图）"""
         if not self.validate_inputs():
             return
         
         try:
-            # 找到第一个图片文件进行预览（排除watermarked目录）
-            source_dir = Path(self.source_dir.get())
-            image_files = self.processor.get_source_files_excluding_watermarked(str(source_dir))
+            sample_image = self.get_preview_sample()
             
-            if not image_files:
+            if sample_image is None:
                 messagebox.showwarning("警告", "源目录中没有找到图片文件")
                 return
             
-            # 使用第一个图片文件进行预览
-            sample_image = str(image_files[0])
-            
-            preview_path = self.processor.create_preview(
-                sample_image,
-                self.watermark_path.get(),
-                self.position.get(),
-                self.opacity.get(),
-                self.scale.get()
-            )
-            
-            # 打开预览图片
-            os.startfile(preview_path)
+            self.show_preview(sample_image)
             
         except Exception as e:
             messagebox.showerror("预览错误", f"生成预览时出错: {str(e)}")
     
+    def get_preview_sample(self):
+        """获取用于预览的图片（源目录中找到的第一个图片文件，排除watermarked目录）"""
+        source_dir = self.source_dir.get()
+        if self._preview_sample and self._preview_sample[0] == source_dir \
+                and os.path.exists(self._preview_sample[1]):
+            return self._preview_sample[1]
+        
+        # 找到第一个文件即停止扫描
+        first_file = next(iter(self.processor.iter_source_files_excluding_watermarked(source_dir)), None)
+        if first_file is None:
+            return None
+        
+        self._preview_sample = (source_dir, str(first_file))
+        return str(first_file)
+    
+    def show_preview(self, sample_image):
+        """生成预览图并显示在预览窗口中"""
+        preview_img = self.processor.render_preview(
+            sample_image,
+            self.watermark_path.get(),
+            self.position.get(),
+            self.opacity.get(),
+            self.scale.get(),
+            max_size=PREVIEW_MAX_SIZE
+        )
+        
+        if self.preview_window is None or not self.preview_window.winfo_exists():
+            self.preview_window = tk.Toplevel(self.root)
+            self.preview_label = ttk.Label(self.preview_window)
+            self.preview_label.pack(padx=10, pady=10)
+        
+        # 保留引用，避免图片被回收
+        self.preview_photo = ImageTk.PhotoImage(preview_img)
+        self.preview_label.config(image=self.preview_photo)
+        self.preview_window.title(f"预览效果 - {Path(sample_image).name}")
+    
+    def schedule_preview_refresh(self, *args):
+        """水印设置变化时，延迟刷新已打开的预览窗口（拖动滑块时合并多次刷新）"""
+        if self.preview_window is None or not self.preview_window.winfo_exists():
+            return
+        
+        if self._preview_after_id is not None:
+            self.root.after_cancel(self._preview_after_id)
+        self._preview_after_id = self.root.after(150, self.refresh_preview)
+    
+    def refresh_preview(self):
+        """刷新预览窗口"""
+        self._preview_after_id = None
+        try:
+            sample_image = self.get_preview_sample()
+            if sample_image is not None:
+                self.show_preview(sample_image)
+        except Exception as e:
+            print(f"刷新预览失败: {e}")
+    
     def start_processing(self):
         """开始处理"""
         if not self.validate_inputs():
             return
         
-        # 在新线程中运行处理过程
+        self.control = BatchControl()
+        self.progress_monitor = ProgressMonitor()
         self.start_button.config(state="disabled")
+        self.pause_button.config(state="normal", text="暂停")
+        self.cancel_button.config(state="normal")
+        self.status_label.config(text="正在扫描图片文件...")
+        
+        # 在新线程中运行处理过程，界面按固定间隔读取进度
         thread = threading.Thread(target=self.process_images)
         thread.daemon = True
         thread.start()
+        self._progress_after_id = self.root.after(PROGRESS_REFRESH_MS, self.refresh_progress)
+    
+    def toggle_pause(self):
+        """暂停 / 继续处理（正在处理的文件会先完成）"""
+        if self.control is None:
+            return
+        if self.control.paused:
+            self.control.resume()
+            self.pause_button.config(text="暂停")
+        else:
+            self.control.pause()
+            self.pause_button.config(text="继续")
+        self.refresh_progress(reschedule=False)
+    
+    def cancel_processing(self):
+        """取消处理（正在处理的文件完成后停止）"""
+        if self.control is None:
+            return
+        self.control.cancel()
+        self.pause_button.config(state="disabled")
+        self.cancel_button.config(state="disabled")
+        self.status_label.config(text="正在取消，等待正在处理的文件完成...")
+    
+    def refresh_progress(self, reschedule=True):
+        """刷新进度条、吞吐量和剩余时间（处理期间每 PROGRESS_REFRESH_MS 毫秒一次）"""
+        if self.control is None:
+            return
+        
+        if not self.control.cancelled:
+            snapshot = self.progress_monitor.snapshot()
+            current, total = snapshot['current'], snapshot['total']
+            if total:
+                self.progress_var.set(current / total * 100)
+                text = f"{current}/{total}  {snapshot['rate']:.1f} 张/秒"
+                if snapshot['eta'] is not None:
+                    text += f"  剩余 {format_duration(snapshot['eta'])}"
+                if self.control.paused:
+                    text = f"已暂停  {text}"
+                else:
+                    text = f"正在处理: {snapshot['filename']}  {text}"
+                self.status_label.config(text=text)
+            elif self.control.paused:
+                self.status_label.config(text="已暂停")
+        
+        if reschedule:
+            self._progress_after_id = self.root.after(PROGRESS_REFRESH_MS, self.refresh_progress)
     
     def process_images(self):
-        """处理图片"""
+        """处理图片（在后台线程中运行，与命令行使用相同的批量处理引擎）"""
+        control = self.control
         try:
-            # 更新状态
-            self.root.after(0, lambda: self.status_label.config(text="正在扫描图片文件..."))
-            
-            # 获取所有图片文件（排除watermarked相关目录）
-            source_dir = Path(self.source_dir.get())
-            image_files = self.processor.get_source_files_excluding_watermarked(str(source_dir))
-            
-            if not image_files:
-                self.root.after(0, lambda: messagebox.showwarning("警告", "源目录中没有找到图片文件"))
-                return
-            
-            # 确保输出目录存在
-            output_dir = Path(self.get_actual_output_dir())
-            output_dir.mkdir(parents=True, exist_ok=True)
-            
-            total_found = len(image_files)
-            
-            # 智能检测已处理文件
-            if self.skip_processed.get():
-                self.root.after(0, lambda: self.status_label.config(text="正在检测已处理文件..."))
-                watermarked_dir = self.get_watermarked_dir()
-                image_files = self.processor.filter_unprocessed_files(
-                    image_files, self.source_dir.get(), watermarked_dir
-                )
-                
-                skipped_count = total_found - len(image_files)
-                if skipped_count > 0:
-                    self.root.after(0, lambda: self.status_label.config(
-                        text=f"智能检测: 跳过 {skipped_count} 个已处理文件"))
-            
-            if not image_files:
-                self.root.after(0, lambda: messagebox.showinfo("信息", 
-                    f"所有图片都已处理完成！\n总计扫描: {total_found} 个文件\n已处理: {total_found} 个文件"))
-                return
-            
-            total_files = len(image_files)
-            processed = 0
-            
-            for i, image_file in enumerate(image_files):
-                try:
-                    # 更新状态
-                    self.root.after(0, lambda f=image_file.name: 
-                                   self.status_label.config(text=f"正在处理: {f}"))
-                    
-                    # 计算相对路径，保留目录结构
-                    relative_path = image_file.relative_to(source_dir)
-                    output_path = output_dir / relative_path
-                    
-                    # 确保输出子目录存在
-                    output_path.parent.mkdir(parents=True, exist_ok=True)
-                    
-                    # 处理图片
-                    self.processor.add_watermark(
-                        str(image_file),
-                        self.watermark_path.get(),
-                        str(output_path),
-                        self.position.get(),
-                        self.opacity.get(),
-                        self.scale.get()
-                    )
-                    
-                    processed += 1
-                    progress = (processed / total_files) * 100
-                    self.root.after(0, lambda p=progress: self.progress_var.set(p))
-                    
-                except Exception as e:
-                    print(f"处理文件 {image_file} 时出错: {e}")
-                    continue
+            output_dir = self.get_actual_output_dir()
             
-            # 完成信息
-            completion_msg = f"水印添加完成！\n"
-            if self.skip_processed.get() and total_found > total_files:
-                skipped = total_found - total_files
-                completion_msg += f"总计扫描: {total_found} 个文件\n跳过已处理: {skipped} 个文件\n新处理: {processed} 个文件"
-            else:
-                completion_msg += f"成功处理 {processed} 个文件"
-            
-            completion_msg += f"\n输出目录: {output_dir}"
+            # 多核时使用多进程并行处理
+            parallel = (os.cpu_count() or 1) > 1
             
-            self.root.after(0, lambda: self.status_label.config(text=f"完成! 成功处理 {processed} 个文件"))
-            self.root.after(0, lambda: messagebox.showinfo("完成", completion_msg))
+            # 处理结果记录到输出目录的处理清单，供下次智能检测使用
+            success_count, total_files, errors = self.processor.batch_process(
+                self.source_dir.get(),
+                self.watermark_path.get(),
+                output_dir,
+                position=self.position.get(),
+                opacity=self.opacity.get(),
+                scale=self.scale.get(),
+                progress_callback=self.progress_monitor,
+                parallel=parallel,
+                skip_processed=self.skip_processed.get(),
+                record_manifest=True,
+                journal=True,
+                resume=self.skip_processed.get(),
+                watermarked_dir=self.get_watermarked_dir(),
+                exclude_dirs=WATERMARKED_DIR_NAMES,
+                encoder=self.encoder.get(),
+                output_format=self.output_format.get(),
+                control=control
+            )
+            skip_stats = self.processor.last_skip_stats
+            result = (success_count, total_files, errors, output_dir, skip_stats)
+            self.root.after(0, lambda: self.finish_processing(control, result))
             
         except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("错误", f"处理过程中出错: {str(e)}"))
+            error = str(e)
+            self.root.after(0, lambda: self.finish_processing(control, error=error))
+    
+    def finish_processing(self, control, result=None, error=None):
+        """处理结束后恢复界面并显示结果（在界面线程中调用）"""
+        self.control = None
+        if self._progress_after_id is not None:
+            self.root.after_cancel(self._progress_after_id)
+            self._progress_after_id = None
+        self.start_button.config(state="normal")
+        self.pause_button.config(state="disabled", text="暂停")
+        self.cancel_button.config(state="disabled")
+        self.progress_var.set(0)
+        
+        if error is not None:
+            self.status_label.config(text="处理出错")
+            messagebox.showerror("错误", f"处理过程中出错: {error}")
+            return
+        
+        success_count, total_files, errors, output_dir, skip_stats = result
+        if control.cancelled:
+            self.status_label.config(text=f"已取消! 成功处理 {success_count} 个文件")
+            messagebox.showinfo("已取消",
+                f"处理已取消\n成功处理: {success_count} 个文件\n"
+                f"失败: {len(errors)} 个文件\n输出目录: {output_dir}")
+            return
+        
+        total_found = skip_stats['scanned'] if skip_stats else total_files
+        skipped_count = skip_stats['skipped'] if skip_stats else 0
+        
+        if total_files == 0:
+            self.status_label.config(text="准备就绪")
+            if total_found > 0:
+                self.status_label.config(text=f"智能检测: 跳过 {skipped_count} 个已处理文件")
+                messagebox.showinfo("信息",
+                    f"所有图片都已处理完成！\n总计扫描: {total_found} 个文件\n"
+                    f"已处理: {skipped_count} 个文件")
+            elif self.skip_processed.get():
+                messagebox.showinfo("信息", "没有需要处理的图片，所有图片都已处理完成！")
+            else:
+                messagebox.showwarning("警告", "源目录中没有找到图片文件")
+            return
         
-        finally:
-            self.root.after(0, lambda: self.start_button.config(state="normal"))
-            self.root.after(0, lambda: self.progress_var.set(0))
+        completion_msg = f"水印添加完成！\n"
+        if self.skip_processed.get() and skipped_count > 0:
+            completion_msg += (f"总计扫描: {total_found} 个文件\n跳过已处理: {skipped_count} 个文件\n"
+                               f"新处理: {success_count} 个文件")
+        else:
+            completion_msg += f"成功处理 {success_count} 个文件"
+        if errors:
+            completion_msg += f"\n失败: {len(errors)} 个文件（详见控制台输出）"
+        completion_msg += f"\n输出目录: {output_dir}"
+        
+        status = f"完成! 成功处理 {success_count} 个文件"
+        if skipped_count > 0:
+            status = f"智能检测: 跳过 {skipped_count} 个已处理文件  " + status
+        self.status_label.config(text=status)
+        messagebox.showinfo("完成", completion_msg)
     
     def clear_settings(self):
         """清空设置"""
@@ -409,6 +547,8 @@ class WatermarkApp:
         self.position.set("bottom_right")
         self.opacity.set(0.7)
         self.scale.set(0.1)
+        self.encoder.set("default")
+        self.output_format.set("keep")
         self.output_mode.set("watermarked")  # 重置为默认模式
         self.skip_processed.set(True)  # 重置智能检测选项
         self.progress_var.set(0)
@@ -416,6 +556,8 @@ class WatermarkApp:
 
 def main():
     """主函数"""
+    # 打包为 exe 后，多进程并行处理需要此调用
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = WatermarkApp(root)
     root.mainloop()
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监视目录模块
+持续监视源目录，新增或修改的图片写入完成后立即添加水印。
+Linux 上使用 inotify（通过 ctypes 调用，无需额外依赖），其他平台或 inotify 不可用时
+定期扫描目录；处理器和水印缓存常驻，每张图片从上传到输出只需几秒
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+
+from watermark_manifest import ProcessedManifest
+from watermark_processor import WATERMARKED_DIR_NAMES
+
+# 文件大小和修改时间保持不变超过该时间（秒）才视为写入完成
+DEFAULT_SETTLE_SECONDS = 2.0
+
+# 定期扫描的间隔（秒）
+DEFAULT_POLL_INTERVAL = 5.0
+
+# inotify 事件
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """基于 inotify 的目录树监视（递归为每个子目录添加监视，新建的子目录自动加入）"""
+
+    def __init__(self, root, is_excluded_dir):
+        """
+        Args:
+            root: 监视的根目录
+            is_excluded_dir: 判断目录是否需要排除的函数 is_excluded_dir(路径)
+        """
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError("当前系统不支持 inotify")
+
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify 初始化失败")
+
+        self.root = os.path.abspath(root)
+        self.is_excluded_dir = is_excluded_dir
+        self._watches = {}  # 监视描述符 -> 目录路径
+        self.rescan_needed = False
+        self._add_tree(self.root)
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            print(f"无法监视目录 {directory}: {os.strerror(errno)}")
+            return False
+        self._watches[wd] = directory
+        return True
+
+    def _add_tree(self, directory):
+        """为目录及其所有子目录添加监视，返回其中已有的文件"""
+        files = []
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            if not self._add_watch(current):
+                continue
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not self.is_excluded_dir(entry.path):
+                                stack.append(entry.path)
+                        elif entry.is_file():
+                            files.append(entry.path)
+            except OSError as e:
+                print(f"无法读取目录 {current}: {e}")
+        return files
+
+    def read_events(self, timeout):
+        """
+        等待并读取事件
+
+        Returns:
+            list: 发生变化的文件路径；事件队列溢出时 rescan_needed 被置为 True
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+
+        changed = []
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    self.rescan_needed = True
+                    continue
+                directory = self._watches.get(wd)
+                if directory is None:
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                if not name:
+                    continue
+
+                path = os.path.join(directory, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    # 新建或移入的子目录：加入监视，并处理在加入监视前已写入的文件
+                    if mask & (IN_CREATE | IN_MOVED_TO) and not self.is_excluded_dir(path):
+                        changed.extend(self._add_tree(path))
+                else:
+                    changed.append(path)
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher:
+    """定期扫描目录树，比较文件大小和修改时间（inotify 不可用时使用）"""
+
+    def __init__(self, iter_files, interval=DEFAULT_POLL_INTERVAL):
+        """
+        Args:
+            iter_files: 返回当前所有文件路径的函数（已排除输出目录）
+            interval: 扫描间隔（秒）
+        """
+        self.iter_files = iter_files
+        self.interval = interval
+        self.rescan_needed = False
+        self._snapshot = self._scan()
+        self._next_scan = time.monotonic() + interval
+
+    def _scan(self):
+        snapshot = {}
+        for path in self.iter_files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[str(path)] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def read_events(self, timeout):
+        """等待到下次扫描时间（最多 timeout 秒），扫描后返回新增或变化的文件"""
+        remaining = self._next_scan - time.monotonic()
+        if remaining > 0:
+            time.sleep(min(timeout, remaining))
+            if time.monotonic() < self._next_scan:
+                return []
+
+        snapshot = self._scan()
+        changed = [path for path, signature in snapshot.items()
+                   if self._snapshot.get(path) != signature]
+        self._snapshot = snapshot
+        self._next_scan = time.monotonic() + self.interval
+        return changed
+
+    def close(self):
+        pass
+
+
+class PendingFiles:
+    """等待写入完成的文件：大小和修改时间在一段时间内不再变化才视为完成"""
+
+    def __init__(self, settle_seconds=DEFAULT_SETTLE_SECONDS):
+        self.settle_seconds = settle_seconds
+        self._pending = {}  # 路径 -> [首次发现时间, 最近变化时间, (大小, 修改时间)]
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, path, now=None, signature=None):
+        """
+        记录文件发生了变化
+
+        Args:
+            path: 文件路径
+            now: 当前时间（time.monotonic）
+            signature: 已知文件已写入完成时传入其 (大小, 修改时间)，无需再等待
+        """
+        now = time.monotonic() if now is None else now
+        entry = self._pending.get(path)
+        if signature is not None:
+            self._pending[path] = [now, now - self.settle_seconds, signature]
+        elif entry is None:
+            self._pending[path] = [now, now, None]
+        else:
+            entry[1] = now
+
+    def pop_ready(self, now=None):
+        """
+        取出已写入完成的文件
+
+        Returns:
+            list: [(路径, 首次发现时间)]
+        """
+        now = time.monotonic() if now is None else now
+        ready = []
+        for path, entry in list(self._pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # 文件已被删除或改名
+                del self._pending[path]
+                continue
+
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if signature != entry[2]:
+                entry[1] = now
+                entry[2] = signature
+                continue
+            if now - entry[1] >= self.settle_seconds and stat.st_size > 0:
+                ready.append((path, entry[0]))
+                del self._pending[path]
+        return ready
+
+
+class HotFolder:
+    """监视源目录并持续添加水印"""
+
+    def __init__(self, processor, source_dir, watermark_path, output_dir, options=None,
+                 exclude_dirs=WATERMARKED_DIR_NAMES, settle_seconds=DEFAULT_SETTLE_SECONDS,
+                 poll_interval=DEFAULT_POLL_INTERVAL, use_inotify=True, on_result=None):
+        """
+        Args:
+            processor: WatermarkProcessor（常驻，保留水印缓存）
+            source_dir: 监视的源目录
+            watermark_path: 水印文件路径或文字水印
+            output_dir: 输出目录（位于源目录内时自动排除）
+            options: 水印设置（position、opacity、scale、encoder、output_format）
+            exclude_dirs: 需要排除的目录名
+            settle_seconds: 文件大小和修改时间保持不变多久后才处理
+            poll_interval: 不使用 inotify 时的扫描间隔
+            use_inotify: 是否优先使用 inotify
+            on_result: 每处理完一个文件调用 on_result(result)，
+                result 为 {'source', 'output', 'error', 'latency'}
+        """
+        self.processor = processor
+        self.source_dir = Path(os.path.abspath(source_dir))
+        self.watermark_path = watermark_path
+        self.output_dir = Path(os.path.abspath(output_dir))
+        self.options = dict(options or {})
+        self.exclude_dirs = set(exclude_dirs)
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.on_result = on_result
+        self.pending = PendingFiles(settle_seconds)
+        self.processed = 0
+        self.failed = 0
+        self.watcher = None
+        self._stop = threading.Event()
+        self._fingerprint = None
+        self._watermark_signature = None
+        self._exclude_paths = set()
+        if self.output_dir.resolve() != self.source_dir.resolve():
+            self._exclude_paths.add(os.path.normcase(str(self.output_dir.resolve())))
+
+    def is_excluded_dir(self, path):
+        """判断目录是否需要排除（输出目录）"""
+        if os.path.basename(path) in self.exclude_dirs:
+            return True
+        return os.path.normcase(os.path.abspath(path)) in self._exclude_paths
+
+    def _is_candidate(self, path):
+        """判断文件是否需要处理：支持的图片格式，且不在被排除的目录中"""
+        if not self.processor.is_supported_format(path):
+            return False
+        try:
+            relative = Path(path).relative_to(self.source_dir)
+        except ValueError:
+            return False
+        current = self.source_dir
+        for part in relative.parts[:-1]:
+            current = current / part
+            if self.is_excluded_dir(str(current)):
+                return False
+        return True
+
+    def _iter_source_files(self):
+        return self.processor.iter_image_files(self.source_dir, exclude_names=self.exclude_dirs,
+                                               exclude_paths=self._exclude_paths)
+
+    def _create_watcher(self):
+        if self.use_inotify and sys.platform.startswith('linux'):
+            try:
+                return InotifyWatcher(self.source_dir, self.is_excluded_dir)
+            except (OSError, AttributeError) as e:
+                print(f"inotify 不可用，改为定期扫描: {e}")
+        return PollingWatcher(self._iter_source_files, self.poll_interval)
+
+    def _current_fingerprint(self):
+        """获取设置指纹，水印文件（文字水印为字体文件）变化时重新计算"""
+        font_signature = getattr(self.watermark_path, 'font_signature', None)
+        if font_signature is not None:
+            signature = ('text', font_signature())
+        else:
+            stat = os.stat(self.watermark_path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        if signature != self._watermark_signature:
+            self._fingerprint = self.processor.settings_fingerprint(self.watermark_path,
+                                                                    self.options)
+            self._watermark_signature = signature
+        return self._fingerprint
+
+    def catch_up(self, manifest):
+        """启动时将尚未处理（或已变化）的文件加入待处理队列"""
+        fingerprint = self._current_fingerprint()
+        for path in self.processor.iter_unprocessed_files(
+            self._iter_source_files(), self.source_dir, manifest, fingerprint
+        ):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # 已有的文件只要处理时大小和修改时间未变就直接处理，无需等待
+            self.pending.touch(str(path), signature=(stat.st_size, stat.st_mtime_ns))
+
+    def process_file(self, manifest, path, first_seen=None):
+        """
+        处理单个文件并记录到处理清单
+
+        Returns:
+            dict: 处理结果，文件未变化无需处理时返回 None
+        """
+        image_file = Path(path)
+        relative_path = image_file.relative_to(self.source_dir)
+        output_file = self.processor.output_file_for(self.output_dir, relative_path,
+                                                     self.options)
+        result = {'source': str(image_file), 'output': str(output_file), 'error': None,
+                  'latency': None}
+        try:
+            stat = os.stat(image_file)
+            fingerprint = self._current_fingerprint()
+            # 只有修改时间变化、内容未变的文件（如被 touch、chmod）不重复处理
+            if manifest.is_current(relative_path, image_file, fingerprint, stat=stat,
+                                   verify_hash=True):
+                return None
+            self.processor.add_watermark(str(image_file), self.watermark_path, str(output_file),
+                                         **self.options)
+            manifest.record(relative_path, image_file, output_file, fingerprint, stat=stat,
+                            with_hash=True)
+            manifest.commit()
+            self.processed += 1
+        except Exception as e:
+            result['error'] = f"处理文件 {image_file.name} 时出错: {str(e)}"
+            self.failed += 1
+            print(result['error'])
+
+        if first_seen is not None:
+            result['latency'] = round(time.monotonic() - first_seen, 3)
+        if self.on_result:
+            self.on_result(result)
+        return result
+
+    def run(self, catch_up=True):
+        """
+        开始监视，直到调用 stop()
+
+        Args:
+            catch_up: 启动时是否先处理尚未处理的已有文件
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._stop.clear()
+        with ProcessedManifest(self.output_dir, commit_interval=1) as manifest:
+            self.watcher = self._create_watcher()
+            try:
+                if catch_up:
+                    self.catch_up(manifest)
+                tick = min(1.0, self.settle_seconds / 2) if self.settle_seconds else 0.2
+                while not self._stop.is_set():
+                    for path in self.watcher.read_events(tick):
+                        if self._is_candidate(path):
+                            self.pending.touch(path)
+                    if self.watcher.rescan_needed:
+                        # inotify 事件队列溢出，重新比对全部文件
+                        self.watcher.rescan_needed = False
+                        self.catch_up(manifest)
+                    for path, first_seen in self.pending.pop_ready():
+                        if self._stop.is_set():
+                            break
+                        self.process_file(manifest, path, first_seen)
+            finally:
+                self.watcher.close()
+
+    def stop(self):
+        """停止监视（可在其他线程或信号处理中调用）"""
+        self._stop.set()